@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Callable, List, Tuple
+
+Prediction = Tuple[str, float]
+
+
+class MicroBatcher:
+    """Собирает одиночные запросы в пачку для одного вызова модели.
+
+    Если модель свободна, запрос уходит сразу. Пока модель считает пачку,
+    копится следующая: она уходит, когда набрано max_items текстов или прошло
+    max_wait_ms, даже если предыдущая еще считается. Поэтому одновременно
+    может считаться несколько пачек (не больше, чем потоков в executor по
+    умолчанию). Так одиночные запросы не ждут дольше max_wait_ms, а под
+    нагрузкой пачки растут.
+    """
+
+    def __init__(self, predict_batch: Callable[[List[str]], List[Prediction]], max_items: int, max_wait_ms: float) -> None:
+        self.predict_batch = predict_batch
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000
+        self.pending: List[Tuple[str, asyncio.Future]] = []
+        self.nonempty = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.running: set = set()
+        self.batches = 0
+        self.items = 0
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def submit(self, text: str) -> Prediction:
+        if self.task is None:
+            self.start()
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append((text, fut))
+        self.nonempty.set()
+        if len(self.pending) >= self.max_items:
+            self.full.set()
+        return await fut
+
+    async def _run(self) -> None:
+        while True:
+            await self.nonempty.wait()
+            if self.running and len(self.pending) < self.max_items:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+            batch, self.pending = self.pending[: self.max_items], self.pending[self.max_items :]
+            if len(self.pending) < self.max_items:
+                self.full.clear()
+            if not self.pending:
+                self.nonempty.clear()
+            # пачка считается в фоне: следующая копится и может уйти, пока эта еще считается
+            task = asyncio.create_task(self._predict(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _predict(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(None, self.predict_batch, texts)
+        except Exception as exc:  # noqa: BLE001
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        self.batches += 1
+        self.items += len(batch)
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "queued": len(self.pending),
+        }
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+# Полиномиальный хэш n-граммы по кодовым точкам (uint64, переполнение по модулю 2^64).
+# Начальное значение - длина n-граммы, чтобы граммы разной длины не совпадали
+HASH_BASE = np.uint64(1099511628211)
+WHITE_SPACES = re.compile(r"\s\s+")  # как в sklearn: схлопываются только серии пробельных
+
+
+def _codepoints(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+
+
+def ngram_hashes(text: str, ngram_range: Tuple[int, int]) -> np.ndarray:
+    """Хэши всех символьных n-грамм текста, посчитанные массивами без строк n-грамм"""
+    cp = _codepoints(text)
+    parts = []
+    with np.errstate(over="ignore"):
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            count = len(cp) - n + 1
+            if count <= 0:
+                break
+            h = np.full(count, n, dtype=np.uint64)
+            for k in range(n):
+                h = h * HASH_BASE + cp[k : k + count]
+            parts.append(h)
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint64)
+
+
+def export_fast(vectorizer, clf, out_dir: Path) -> None:
+    """Словарь TfidfVectorizer -> отсортированные хэши n-грамм и веса в .npy.
+
+    Вместо dict строк хранятся keys (uint64), idf (float32) и coef
+    (float32, термы x классы). Все массивы можно открыть через mmap.
+    """
+    vocab = vectorizer.vocabulary_
+    terms = sorted(vocab, key=vocab.get)
+    keys = np.array([ngram_hashes(t, (len(t), len(t)))[0] for t in terms], dtype=np.uint64)
+    if len(np.unique(keys)) != len(keys):
+        raise ValueError("hash collision in vocabulary")
+    order = np.argsort(keys)
+    coef = clf.coef_.T.astype(np.float32)  # (термы, классы)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    np.save(out_dir / "keys.npy", keys[order])
+    np.save(out_dir / "idf.npy", vectorizer.idf_.astype(np.float32)[order])
+    np.save(out_dir / "coef.npy", np.ascontiguousarray(coef[order]))
+    np.save(out_dir / "intercept.npy", clf.intercept_.astype(np.float64))
+    meta = {
+        "classes": [str(c) for c in clf.classes_],
+        "ngram_range": list(vectorizer.ngram_range),
+        "lowercase": bool(vectorizer.lowercase),
+        "norm": vectorizer.norm,
+        "sublinear_tf": bool(vectorizer.sublinear_tf),
+        "ovr": getattr(clf, "multi_class", "auto") == "ovr",
+    }
+    (out_dir / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+
+
+class FastScorer:
+    """Логистическая регрессия поверх хэшированных char n-грамм.
+
+    Для текста считаются хэши n-грамм. Через np.unique получаются частоты,
+    через searchsorted по keys - термы словаря. Дальше tf*idf, L2-нормировка
+    и softmax (или sigmoid), как в TfidfVectorizer + LogisticRegression.
+    """
+
+    def __init__(self, model_dir: Path, mmap: bool = True) -> None:
+        mode = "r" if mmap else None
+        self.keys = np.load(model_dir / "keys.npy", mmap_mode=mode)
+        self.idf = np.load(model_dir / "idf.npy", mmap_mode=mode)
+        self.coef = np.load(model_dir / "coef.npy", mmap_mode=mode)
+        self.intercept = np.load(model_dir / "intercept.npy")
+        meta = json.loads((model_dir / "meta.json").read_text(encoding="utf-8"))
+        self.classes = meta["classes"]
+        self.ngram_range = tuple(meta["ngram_range"])
+        self.lowercase = meta["lowercase"]
+        self.norm = meta["norm"]
+        self.sublinear_tf = meta["sublinear_tf"]
+        self.ovr = meta["ovr"]
+
+    def scores(self, text: str) -> np.ndarray:
+        if self.lowercase:
+            text = text.lower()
+        hashes = ngram_hashes(WHITE_SPACES.sub(" ", text), self.ngram_range)
+        uniq, counts = np.unique(hashes, return_counts=True)
+        pos = np.minimum(np.searchsorted(self.keys, uniq), len(self.keys) - 1)
+        hit = self.keys[pos] == uniq
+        idx = pos[hit]
+        tf = counts[hit].astype(np.float64)
+        if self.sublinear_tf:
+            tf = np.log(tf) + 1.0
+        w = tf * self.idf[idx]
+        if self.norm == "l2":
+            norm = np.sqrt(np.dot(w, w))
+            if norm > 0:
+                w /= norm
+        elif self.norm == "l1":
+            norm = np.abs(w).sum()
+            if norm > 0:
+                w /= norm
+        return w @ self.coef[idx] + self.intercept
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        s = self.scores(text)
+        if len(self.classes) == 2:
+            p1 = 1.0 / (1.0 + np.exp(-s[0]))
+            return np.array([1.0 - p1, p1])
+        if self.ovr:
+            p = 1.0 / (1.0 + np.exp(-s))
+            return p / p.sum()
+        e = np.exp(s - s.max())
+        return e / e.sum()
+
+    def predict_batch(self, texts: List[str]) -> List[Tuple[str, float]]:
+        out = []
+        for text in texts:
+            probs = self.predict_proba(text)
+            idx = int(probs.argmax())
+            out.append((self.classes[idx], float(probs[idx])))
+        return out
+
+
+def check_parity(reference: List[Tuple[str, float]], fast: FastScorer, texts: List[str]) -> Tuple[int, float]:
+    """(число расхождений меток, макс. разница уверенности) между эталоном sklearn и FastScorer"""
+    mismatches = 0
+    max_diff = 0.0
+    for (ref_label, ref_conf), (label, conf) in zip(reference, fast.predict_batch(texts)):
+        if label != ref_label:
+            mismatches += 1
+        max_diff = max(max_diff, abs(conf - ref_conf))
+    return mismatches, max_diff
@@ -4,12 +4,25 @@ import asyncio
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 
+from .batcher import MicroBatcher
 from .settings import settings
-from .schemas import AnalyzeRequest, AnalyzeResponse
+from .schemas import AnalyzeBatchRequest, AnalyzeBatchResponse, AnalyzeRequest, AnalyzeResponse
 from .train_on_startup import ensure_model
 
 app = FastAPI(title="AI Analyzer")
 model_holder = ensure_model()
+batcher = MicroBatcher(model_holder.predict_batch, settings.batch_max_items, settings.batch_max_wait_ms)
+
+
+@app.on_event("startup")
+async def startup() -> None:
+    if settings.micro_batching:
+        batcher.start()
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await batcher.stop()
 
 
 @app.get("/health")
@@ -49,9 +62,8 @@ def decide_action(label: str, confidence: float) -> str:
     return "allow"
 
 
-@app.post("/analyze", response_model=AnalyzeResponse)
-async def analyze(req: AnalyzeRequest) -> AnalyzeResponse:
-    text = " ".join(
+def request_text(req: AnalyzeRequest) -> str:
+    return " ".join(
         [
             req.method.upper(),
             req.path,
@@ -60,12 +72,9 @@ async def analyze(req: AnalyzeRequest) -> AnalyzeResponse:
             (req.body or ""),
         ]
     )
-    try:
-        label, confidence = await asyncio.get_event_loop().run_in_executor(
-            None, model_holder.predict, text
-        )
-    except Exception as exc:  # noqa: BLE001
-        raise HTTPException(status_code=500, detail=str(exc))
+
+
+def build_response(label: str, confidence: float) -> AnalyzeResponse:
     action = decide_action(label, confidence)
     explanation = f"label={label} conf={confidence:.2f}"
     return AnalyzeResponse(
@@ -77,6 +86,43 @@ async def analyze(req: AnalyzeRequest) -> AnalyzeResponse:
     )
 
 
+@app.post("/analyze", response_model=AnalyzeResponse)
+async def analyze(req: AnalyzeRequest) -> AnalyzeResponse:
+    text = request_text(req)
+    try:
+        if settings.micro_batching:
+            label, confidence = await batcher.submit(text)
+        else:
+            label, confidence = await asyncio.get_event_loop().run_in_executor(
+                None, model_holder.predict, text
+            )
+    except Exception as exc:  # noqa: BLE001
+        raise HTTPException(status_code=500, detail=str(exc))
+    return build_response(label, confidence)
+
+
+@app.post("/analyze/batch", response_model=AnalyzeBatchResponse)
+async def analyze_batch(req: AnalyzeBatchRequest) -> AnalyzeBatchResponse:
+    """Пачка запросов за один transform/predict_proba"""
+    if not req.items:
+        return AnalyzeBatchResponse(results=[])
+    if len(req.items) > settings.batch_request_limit:
+        raise HTTPException(status_code=413, detail=f"batch larger than {settings.batch_request_limit}")
+    texts = [request_text(item) for item in req.items]
+    try:
+        predictions = await asyncio.get_event_loop().run_in_executor(
+            None, model_holder.predict_batch, texts
+        )
+    except Exception as exc:  # noqa: BLE001
+        raise HTTPException(status_code=500, detail=str(exc))
+    return AnalyzeBatchResponse(results=[build_response(label, conf) for label, conf in predictions])
+
+
+@app.get("/metrics")
+async def metrics() -> dict:
+    return {"micro_batching": settings.micro_batching, "batcher": batcher.stats()}
+
+
 @app.exception_handler(HTTPException)
 async def http_error(_, exc: HTTPException) -> JSONResponse:
     return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
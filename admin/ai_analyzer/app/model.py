@@ -1,20 +1,25 @@
 from __future__ import annotations
 
+import sys
+
 import joblib
 from pathlib import Path
-from typing import Any, Tuple
+from typing import Any, List, Tuple
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
 
 from .dataset_synth import build_dataset
+from .fast_model import FastScorer, check_parity, export_fast
 
 
 class AnalyzerModel:
-    def __init__(self, path: Path) -> None:
+    def __init__(self, path: Path, fast_dir: Path | None = None) -> None:
         self.path = path
+        self.fast_dir = fast_dir
         self.vectorizer: TfidfVectorizer | None = None
         self.clf: LogisticRegression | None = None
+        self.fast: FastScorer | None = None
 
     def exists(self) -> bool:
         return self.path.exists()
@@ -28,6 +33,7 @@ class AnalyzerModel:
         self.vectorizer = vectorizer
         self.clf = clf
         self.save()
+        self.enable_fast(texts)
 
     def save(self) -> None:
         if self.vectorizer is None or self.clf is None:
@@ -39,11 +45,41 @@ class AnalyzerModel:
         data: dict[str, Any] = joblib.load(self.path)
         self.vectorizer = data["vectorizer"]
         self.clf = data["clf"]
+        self.enable_fast(build_dataset()[0])
+
+    def enable_fast(self, texts: List[str]) -> None:
+        """Экспорт весов для FastScorer и переход на него, если метки совпадают со sklearn"""
+        if self.fast_dir is None or self.vectorizer is None or self.clf is None:
+            return
+        meta = self.fast_dir / "meta.json"
+        if not meta.exists() or meta.stat().st_mtime < self.path.stat().st_mtime:
+            export_fast(self.vectorizer, self.clf, self.fast_dir)
+        fast = FastScorer(self.fast_dir)
+        mismatches, max_diff = check_parity(self._predict_sklearn(texts), fast, texts)
+        if mismatches or max_diff > 1e-3:
+            print(
+                f"[model] fast scorer disabled: {mismatches} label mismatches, max confidence diff {max_diff:.2e}",
+                file=sys.stderr,
+            )
+            return
+        self.fast = fast
+        # словарь n-грамм больше не нужен: это основная часть памяти модели
+        self.vectorizer = None
 
     def predict(self, text: str) -> Tuple[str, float]:
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts: List[str]) -> List[Tuple[str, float]]:
+        """Один transform/predict_proba на всю пачку"""
+        if self.fast is not None:
+            return self.fast.predict_batch(texts)
+        return self._predict_sklearn(texts)
+
+    def _predict_sklearn(self, texts: List[str]) -> List[Tuple[str, float]]:
         if self.vectorizer is None or self.clf is None:
             raise RuntimeError("model not loaded")
-        probs = self.clf.predict_proba(self.vectorizer.transform([text]))[0]
-        idx = probs.argmax()
-        label = self.clf.classes_[idx]
-        return str(label), float(probs[idx])
+        probs = self.clf.predict_proba(self.vectorizer.transform(texts))
+        idx = probs.argmax(axis=1)
+        labels = self.clf.classes_[idx]
+        confs = probs[range(len(texts)), idx]
+        return [(str(label), float(conf)) for label, conf in zip(labels, confs)]
@@ -15,3 +15,11 @@ class AnalyzeResponse(BaseModel):
     recommended_action: str
     explanation: str
     suspected_param: str | None = None
+
+
+class AnalyzeBatchRequest(BaseModel):
+    items: list[AnalyzeRequest]
+
+
+class AnalyzeBatchResponse(BaseModel):
+    results: list[AnalyzeResponse]
@@ -8,6 +8,15 @@ class Settings(BaseSettings):
     threshold_block: float = 0.6  # Понижен для демонстрации ML
     threshold_rate_limit: float = 0.4
     sample_limit: int = 256
+    # Микробатчинг /analyze: одиночные запросы копятся до batch_max_items или batch_max_wait_ms
+    micro_batching: bool = True
+    batch_max_items: int = 64
+    batch_max_wait_ms: float = 2.0
+    batch_request_limit: int = 256  # максимум элементов в /analyze/batch
+    # Хэшированные n-граммы + веса в .npy (mmap) вместо TfidfVectorizer; включается,
+    # только если на обучающем наборе метки совпадают со sklearn
+    fast_scorer: bool = False
+    fast_model_dir: Path = Path("/data/ml_artifacts/model_fast")
 
     class Config:
         env_file = ".env"
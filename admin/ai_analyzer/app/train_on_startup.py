@@ -5,7 +5,7 @@ from .settings import settings
 
 
 def ensure_model() -> AnalyzerModel:
-    model = AnalyzerModel(settings.model_path)
+    model = AnalyzerModel(settings.model_path, settings.fast_model_dir if settings.fast_scorer else None)
     if model.exists():
         model.load()
     else:
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Any, Deque, Dict, Tuple
+
+from . import bot_runner
+from .settings import settings
+from .templates import format_digest_message, format_event_message
+
+GroupKey = Tuple[str, str, str]  # (license_hash, client_ip, category)
+
+
+def _bump(counter: Counter, value: Any) -> None:
+    """Счетчик с ограниченным числом различных значений"""
+    if not value:
+        return
+    if value in counter or len(counter) < settings.alert_digest_max_values:
+        counter[value] += 1
+    else:
+        counter["…"] += 1
+
+
+class _Group:
+    __slots__ = ("chat_id", "event", "count", "paths", "rules", "started", "timer")
+
+    def __init__(self, chat_id: int, event: dict[str, Any]) -> None:
+        self.chat_id = chat_id
+        self.event = event
+        self.count = 0
+        self.paths: Counter = Counter()
+        self.rules: Counter = Counter()
+        self.started = time.time()
+        self.timer: asyncio.TimerHandle | None = None
+
+    def add(self, event: dict[str, Any]) -> None:
+        self.event = event
+        self.count += 1
+        _bump(self.paths, event.get("endpoint"))
+        for rule_id in event.get("rule_ids") or ():
+            _bump(self.rules, rule_id)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    async def take(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ChatPacer:
+    """Очередь исходящих сообщений на чат с токен-бакетом.
+
+    Telegram ограничивает частоту сообщений в один чат, поэтому сообщения
+    уходят не быстрее chat_rate_per_sec (с запасом chat_burst). Очередь чата
+    ограничена chat_queue_size, лишние сообщения отбрасываются со счетчиком.
+    """
+
+    def __init__(self) -> None:
+        self.queues: Dict[int, Deque[Tuple[str, dict[str, Any]]]] = {}
+        self.buckets: Dict[int, TokenBucket] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.sent = 0
+        self.dropped = 0
+
+    def submit(self, chat_id: int, text: str, event: dict[str, Any]) -> None:
+        queue = self.queues.setdefault(chat_id, deque())
+        if len(queue) >= settings.chat_queue_size:
+            self.dropped += 1
+            return
+        queue.append((text, event))
+        if chat_id not in self.tasks:
+            self.tasks[chat_id] = asyncio.create_task(self._drain(chat_id))
+
+    async def _drain(self, chat_id: int) -> None:
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.buckets[chat_id] = TokenBucket(settings.chat_rate_per_sec, settings.chat_burst)
+        queue = self.queues[chat_id]
+        try:
+            while queue:
+                await bucket.take()
+                text, event = queue.popleft()
+                try:
+                    await bot_runner.send_message(chat_id, text, event)
+                    self.sent += 1
+                except Exception as exc:  # noqa: BLE001
+                    print(f"[alerts] send failed for chat_id={chat_id}: {exc}", file=sys.stderr)
+        finally:
+            del self.tasks[chat_id]
+            if not queue:
+                del self.queues[chat_id]
+
+    async def drain(self, timeout: float) -> None:
+        """Ждет отправки очередей всех чатов не дольше timeout, остаток отменяет"""
+        tasks = list(self.tasks.values())
+        if not tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout)
+        except asyncio.TimeoutError:
+            left = sum(len(q) for q in self.queues.values())
+            print(f"[alerts] drain timed out, {left} messages not sent", file=sys.stderr)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "queued": sum(len(q) for q in self.queues.values()),
+        }
+
+
+class AlertAggregator:
+    """Сворачивает шторм событий в дайджесты.
+
+    События группируются по (лицензия, IP, категория). Первое событие группы
+    отправляется сразу. Следующие за alert_window_sec только считаются
+    (пути и id правил), а по таймеру окна уходит один дайджест. Если за
+    окно пришли новые события, окно продлевается, если нет - группа
+    удаляется. Групп не больше alert_max_groups: при переполнении самая
+    старая сбрасывается досрочно.
+    """
+
+    def __init__(self, pacer: ChatPacer) -> None:
+        self.pacer = pacer
+        self.groups: "OrderedDict[GroupKey, _Group]" = OrderedDict()
+        self.events = 0
+        self.digests = 0
+
+    def add(self, license_hash: str, chat_id: int, event: dict[str, Any]) -> None:
+        self.events += 1
+        if not settings.alert_aggregation:
+            self.pacer.submit(chat_id, format_event_message(event), event)
+            return
+        key = (license_hash, str(event.get("client_ip") or ""), str(event.get("category") or ""))
+        group = self.groups.get(key)
+        if group is not None:
+            group.add(event)
+            return
+        self.pacer.submit(chat_id, format_event_message(event), event)
+        self._open(key, _Group(chat_id, event))
+        while len(self.groups) > settings.alert_max_groups:
+            self._flush(next(iter(self.groups)), reopen=False)
+
+    def _open(self, key: GroupKey, group: _Group) -> None:
+        loop = asyncio.get_running_loop()
+        group.timer = loop.call_later(settings.alert_window_sec, self._flush, key)
+        self.groups[key] = group
+
+    def _flush(self, key: GroupKey, reopen: bool = True) -> None:
+        group = self.groups.pop(key)
+        if group.timer is not None:
+            group.timer.cancel()
+        if group.count == 0:
+            return
+        self.digests += 1
+        text = format_digest_message(
+            group.event,
+            group.count,
+            time.time() - group.started,
+            group.paths.most_common(settings.alert_digest_top),
+            group.rules.most_common(settings.alert_digest_top),
+        )
+        self.pacer.submit(group.chat_id, text, group.event)
+        if reopen:
+            # шторм продолжается - следующее окно тоже копится в дайджест
+            self._open(key, _Group(group.chat_id, group.event))
+
+    async def flush_all(self) -> None:
+        """Сбрасывает все открытые дайджесты и ждет их отправки (при остановке)"""
+        for key in list(self.groups):
+            self._flush(key, reopen=False)
+        await self.pacer.drain(settings.alert_drain_sec)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "events": self.events,
+            "digests": self.digests,
+            "groups": len(self.groups),
+            "pacer": self.pacer.stats(),
+        }
+
+
+aggregator = AlertAggregator(ChatPacer())
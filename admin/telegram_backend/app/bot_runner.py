@@ -20,6 +20,7 @@ from .commands import enqueue_command
 
 application: Application | None = None
 _loop: asyncio.AbstractEventLoop | None = None
+_send_slots: asyncio.Semaphore | None = None
 
 
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -211,6 +212,13 @@ async def _send_impl(chat_id: int, text: str, event: dict[str, Any]) -> None:
 
 
 async def send_message(chat_id: int, text: str, event: dict[str, Any]) -> None:
+    """Отправка через loop бота без блокировки loop FastAPI.
+
+    Корутина запускается в потоке бота, а вызывающий ждет ее через
+    asyncio.wrap_future. Одновременных отправок не больше
+    bot_send_concurrency.
+    """
+    global _send_slots
     print(f"[bot] send_message called for chat_id={chat_id}", file=sys.stderr)
     
     if _loop is None:
@@ -218,11 +226,15 @@ async def send_message(chat_id: int, text: str, event: dict[str, Any]) -> None:
         await _send_impl(chat_id, text, event)
         return
     
-    fut = asyncio.run_coroutine_threadsafe(_send_impl(chat_id, text, event), _loop)
-    try:
-        fut.result(timeout=10.0)
-    except Exception as e:
-        print(f"[bot] future error: {e}", file=sys.stderr)
+    if _send_slots is None:
+        _send_slots = asyncio.Semaphore(settings.bot_send_concurrency)
+    async with _send_slots:
+        fut = asyncio.run_coroutine_threadsafe(_send_impl(chat_id, text, event), _loop)
+        try:
+            # при таймауте wait_for отменяет и корутину в loop бота
+            await asyncio.wait_for(asyncio.wrap_future(fut), settings.bot_send_timeout_sec)
+        except Exception as e:
+            print(f"[bot] future error: {e!r}", file=sys.stderr)
 
 
 def _run_polling() -> None:
@@ -258,7 +270,10 @@ def start_bot() -> None:
     
     print(f"[bot] starting with token {settings.bot_token[:10]}...", file=sys.stderr)
     
-    application = ApplicationBuilder().token(settings.bot_token).build()
+    builder = ApplicationBuilder().token(settings.bot_token)
+    if settings.telegram_api_url:
+        builder = builder.base_url(settings.telegram_api_url)
+    application = builder.build()
     application.add_handler(CommandHandler("start", cmd_start))
     application.add_handler(CommandHandler("activate", cmd_activate))
     application.add_handler(CommandHandler("status", cmd_status))
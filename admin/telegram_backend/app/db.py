@@ -1,19 +1,196 @@
 from __future__ import annotations
 
+import asyncio
+import sys
 import aiosqlite
 from pathlib import Path
-from typing import AsyncIterator
+from typing import Any, Awaitable, Callable, List, Tuple
 
 from .settings import settings
 
+Job = Callable[[aiosqlite.Connection], Awaitable[Any]]
 
-async def get_db() -> AsyncIterator[aiosqlite.Connection]:
-    db = await aiosqlite.connect(settings.db_path)
+
+async def _connect(readonly: bool) -> aiosqlite.Connection:
+    # isolation_level=None: транзакциями управляем сами (BEGIN/COMMIT в writer)
+    db = await aiosqlite.connect(
+        settings.db_path,
+        isolation_level=None,
+        cached_statements=settings.db_statement_cache,
+    )
     db.row_factory = aiosqlite.Row
-    try:
-        yield db
-    finally:
-        await db.close()
+    # executescript дочитывает результаты PRAGMA - недочитанный оператор держал бы блокировку
+    await db.executescript(
+        f"PRAGMA busy_timeout = {settings.db_busy_timeout_ms};"
+        f"PRAGMA cache_size = -{settings.db_cache_kb};"
+        "PRAGMA temp_store = MEMORY;"
+        f"PRAGMA synchronous = {settings.db_synchronous};"
+        + ("PRAGMA query_only = ON;" if readonly else "PRAGMA journal_mode = WAL;")
+    )
+    return db
+
+
+class Database:
+    """Постоянные соединения с SQLite на весь процесс.
+
+    База в режиме WAL: читатели не ждут писателя. Чтения идут через пул из
+    db_readers соединений (read(job)). Все записи идут через одно соединение
+    писателя: write(job) ставит корутину в очередь, а задача писателя
+    выполняет накопившиеся задания в одной транзакции (каждое под своим
+    SAVEPOINT, чтобы ошибка одного не откатывала остальные) и делает
+    один COMMIT на пачку. Подготовленные запросы кэширует sqlite3
+    (cached_statements) на каждом соединении. Вызовы из loop потока бота
+    переносятся в loop, где база открыта.
+    """
+
+    def __init__(self) -> None:
+        self.writer: aiosqlite.Connection | None = None
+        self.readers: asyncio.Queue[aiosqlite.Connection] | None = None
+        # None в очереди - сигнал писателю завершиться после уже поставленных заданий
+        self.jobs: asyncio.Queue[Tuple[Job, asyncio.Future] | None] | None = None
+        self.task: asyncio.Task | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.all: List[aiosqlite.Connection] = []
+        self.commits = 0
+        self.writes = 0
+
+    async def open(self) -> None:
+        if self.writer is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.writer = await _connect(readonly=False)
+        self.readers = asyncio.Queue()
+        self.all = [self.writer]
+        for _ in range(settings.db_readers):
+            db = await _connect(readonly=True)
+            self.readers.put_nowait(db)
+            self.all.append(db)
+        self.jobs = asyncio.Queue()
+        self.task = asyncio.create_task(self._writer_loop())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            # писатель дописывает очередь и текущий COMMIT, а потом выходит сам:
+            # отмена посреди пачки откатила бы ее, оставив ждущих без ответа
+            self.jobs.put_nowait(None)
+            await self.task
+            self.task = None
+            while not self.jobs.empty():
+                item = self.jobs.get_nowait()
+                if item is not None and not item[1].done():
+                    item[1].set_exception(RuntimeError("database closed"))
+        for db in self.all:
+            await db.close()
+        self.all = []
+        self.writer = None
+        self.readers = None
+        self.jobs = None
+        self.loop = None
+
+    def _foreign(self) -> bool:
+        return asyncio.get_running_loop() is not self.loop
+
+    async def _bridge(self, method: Callable[[Job], Awaitable[Any]], job: Job) -> Any:
+        """Вызов из другого loop (поток бота) выполняется в loop базы"""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(method(job), self.loop))
+
+    async def read(self, job: Job) -> Any:
+        """Выполняет job(conn) на свободном соединении-читателе"""
+        if self.readers is None:
+            await self.open()
+        if self._foreign():
+            return await self._bridge(self.read, job)
+        db = await self.readers.get()
+        try:
+            return await job(db)
+        finally:
+            self.readers.put_nowait(db)
+
+    async def write(self, job: Job) -> Any:
+        """Выполняет job(conn) на соединении писателя; результат - после COMMIT"""
+        if self.jobs is None:
+            await self.open()
+        if self._foreign():
+            return await self._bridge(self.write, job)
+        fut = self.loop.create_future()
+        self.jobs.put_nowait((job, fut))
+        return await fut
+
+    async def execute(self, sql: str, params: Tuple[Any, ...] = ()) -> int:
+        """Одиночная запись; возвращает lastrowid"""
+        async def job(db: aiosqlite.Connection) -> int:
+            cur = await db.execute(sql, params)
+            return cur.lastrowid
+        return await self.write(job)
+
+    async def executemany(self, sql: str, rows: List[Tuple[Any, ...]]) -> None:
+        async def job(db: aiosqlite.Connection) -> None:
+            await db.executemany(sql, rows)
+        await self.write(job)
+
+    async def _writer_loop(self) -> None:
+        stop = False
+        while not stop:
+            first = await self.jobs.get()
+            if first is None:
+                return
+            batch = [first]
+            while len(batch) < settings.db_group_commit_max and not self.jobs.empty():
+                item = self.jobs.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                results = await self._run(batch)
+            except Exception as exc:  # noqa: BLE001
+                print(f"[db] group commit failed: {exc!r}", file=sys.stderr)
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                continue
+            for (_, fut), (ok, value) in zip(batch, results):
+                if fut.done():
+                    continue
+                if ok:
+                    fut.set_result(value)
+                else:
+                    fut.set_exception(value)
+
+    async def _run(self, batch: List[Tuple[Job, asyncio.Future]]) -> List[Tuple[bool, Any]]:
+        db = self.writer
+        results: List[Tuple[bool, Any]] = []
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            for job, _ in batch:
+                await db.execute("SAVEPOINT job")
+                try:
+                    value = await job(db)
+                except Exception as exc:  # noqa: BLE001
+                    await db.execute("ROLLBACK TO job")
+                    results.append((False, exc))
+                else:
+                    results.append((True, value))
+                await db.execute("RELEASE job")
+            await db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:
+                await db.execute("ROLLBACK")
+            raise
+        self.commits += 1
+        self.writes += len(batch)
+        return results
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "commits": self.commits,
+            "writes": self.writes,
+            "avg_group": round(self.writes / self.commits, 2) if self.commits else 0.0,
+            "queued": self.jobs.qsize() if self.jobs is not None else 0,
+        }
+
+
+database = Database()
 
 
 async def init_db() -> None:
@@ -24,3 +201,8 @@ async def init_db() -> None:
     await db.executescript(sql)
     await db.commit()
     await db.close()
+    await database.open()
+
+
+async def close_db() -> None:
+    await database.close()
@@ -8,22 +8,34 @@ from typing import Any
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import JSONResponse
 
+from .alerts import aggregator
 from .hmac_security import verify_hmac
 from .licenses import get_chat_for_license
-from .templates import format_event_message
-from .db import get_db
-from . import bot_runner
+from .db import database
+from .settings import settings
 
 router = APIRouter()
 
 
 async def log_audit(action: str, details: str) -> None:
-    async for db in get_db():
-        await db.execute(
-            "INSERT INTO audit (action, details, created_at) VALUES (?, ?, ?)",
-            (action, details[:500], time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())),
-        )
-        await db.commit()
+    await log_audit_many([(action, details)])
+
+
+async def log_audit_many(rows: list[tuple[str, str]]) -> None:
+    """Несколько записей аудита одной транзакцией"""
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    await database.executemany(
+        "INSERT INTO audit (action, details, created_at) VALUES (?, ?, ?)",
+        [(action, details[:500], now) for action, details in rows],
+    )
+
+
+def audit_details(license_hash: str, payload: dict[str, Any]) -> str:
+    return json.dumps({
+        "license_hash": license_hash[:16],
+        "request_id": payload.get("request_id", ""),
+        "decision": payload.get("decision", ""),
+    })
 
 
 @router.post("/api/v1/event")
@@ -56,16 +68,49 @@ async def ingest_event(request: Request) -> JSONResponse:
         print("[events] license not activated - no chat_id", file=sys.stderr)
         raise HTTPException(status_code=401, detail="license not activated")
     
-    await log_audit("event", json.dumps({
-        "license_hash": license_hash[:16],
-        "request_id": payload.get("request_id", ""),
-        "decision": payload.get("decision", ""),
-    }))
-    
-    text = format_event_message(payload)
-    print(f"[events] sending to chat_id={chat_id}: {text[:100]}...", file=sys.stderr)
+    await log_audit("event", audit_details(license_hash, payload))
     
-    await bot_runner.send_message(chat_id, text, payload)
+    aggregator.add(license_hash, chat_id, payload)
     
-    print("[events] message sent successfully", file=sys.stderr)
+    print("[events] event queued", file=sys.stderr)
     return JSONResponse({"status": "ok"})
+
+
+@router.post("/api/v1/events/batch")
+async def ingest_events_batch(request: Request) -> JSONResponse:
+    """Пачка событий: одна подпись, один поиск лицензии, аудит одной транзакцией.
+
+    Тело: {"license_key_hash": ..., "events": [event, ...]}
+    """
+    raw = await request.body()
+    await verify_hmac(request, raw)
+
+    try:
+        payload: dict[str, Any] = json.loads(raw.decode())
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="bad json")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="bad json")
+
+    license_hash = payload.get("license_key_hash")
+    events = payload.get("events")
+    if not license_hash:
+        raise HTTPException(status_code=400, detail="missing license")
+    if not isinstance(events, list):
+        raise HTTPException(status_code=400, detail="missing events")
+    if len(events) > settings.max_batch_events:
+        raise HTTPException(status_code=413, detail=f"batch larger than {settings.max_batch_events}")
+    if not all(isinstance(event, dict) for event in events):
+        raise HTTPException(status_code=400, detail="events must be objects")
+
+    chat_id = await get_chat_for_license(license_hash)
+    if chat_id is None:
+        raise HTTPException(status_code=401, detail="license not activated")
+
+    await log_audit_many([("event", audit_details(license_hash, event)) for event in events])
+    print(f"[events] batch of {len(events)} events for chat_id={chat_id}", file=sys.stderr)
+
+    for event in events:
+        aggregator.add(license_hash, chat_id, event)
+
+    return JSONResponse({"status": "ok", "accepted": len(events)})
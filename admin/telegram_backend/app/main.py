@@ -5,10 +5,11 @@ from fastapi import FastAPI, Depends
 from fastapi.responses import JSONResponse
 
 from .settings import settings
-from .db import init_db
+from .db import close_db, database, init_db
 from .events import router as events_router
 from .commands import pull_commands, ack_commands
 from .licenses import hash_license
+from .alerts import aggregator
 from . import bot_runner
 
 app = FastAPI(title="Telegram Backend")
@@ -21,11 +22,22 @@ async def startup() -> None:
     bot_runner.start_bot()
 
 
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await aggregator.flush_all()
+    await close_db()
+
+
 @app.get("/health")
 async def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics() -> dict[str, object]:
+    return {"alerts": aggregator.stats(), "db": database.stats()}
+
+
 @app.get("/api/v1/commands/pull")
 async def api_pull(license_key_hash: str, cursor: int | None = None) -> dict[str, object]:
     items, next_cursor = await pull_commands(license_key_hash, cursor)
@@ -7,9 +7,28 @@ class Settings(BaseSettings):
     bot_token: str = Field(default="", alias="TELEGRAM_BOT_TOKEN")
     hmac_secret: str = Field(default="", alias="CONTROL_PLANE_HMAC_SECRET")
     db_path: Path = Path("/data/telegram.sqlite")
+    db_readers: int = 4  # соединений-читателей в пуле
+    db_group_commit_max: int = 256  # записей в одной транзакции писателя
+    db_synchronous: str = "NORMAL"  # в WAL NORMAL не теряет целостность, только последние коммиты при сбое питания
+    db_cache_kb: int = 16_384
+    db_busy_timeout_ms: int = 5000
+    db_statement_cache: int = 128
     waf_license_key_hash: str = Field(default="", alias="WAF_LICENSE_KEY_HASH")
     max_nonce_age_sec: int = 300
     timestamp_skew_sec: int = 300
+    max_batch_events: int = 500  # максимум событий в /api/v1/events/batch
+    telegram_api_url: str = ""  # свой Bot API сервер, например http://bot-api:8081/bot
+    alert_aggregation: bool = True  # сворачивать шторм событий в дайджесты
+    alert_window_sec: float = 60.0
+    alert_max_groups: int = 10_000  # групп (лицензия, IP, категория) в памяти
+    alert_digest_top: int = 5  # сколько путей и правил показывать в дайджесте
+    alert_digest_max_values: int = 256  # различных путей/правил на группу
+    chat_rate_per_sec: float = 1.0  # лимит Telegram - около сообщения в секунду на чат
+    chat_burst: int = 3
+    chat_queue_size: int = 100
+    alert_drain_sec: float = 5.0  # сколько при остановке ждать отправки очередей чатов
+    bot_send_concurrency: int = 16  # одновременных вызовов Bot API
+    bot_send_timeout_sec: float = 10.0
 
     class Config:
         env_file = ".env"
@@ -46,3 +46,31 @@ def format_event_message(event: dict[str, Any]) -> str:
     lines.append(f"Детекция: {detection}")
     
     return "\n".join(lines)
+
+
+def format_digest_message(
+    event: dict[str, Any],
+    count: int,
+    window_sec: float,
+    top_paths: list[tuple[str, int]],
+    top_rules: list[tuple[str, int]],
+) -> str:
+    """Сводка по событиям одной группы (IP + категория) за окно"""
+    category = event.get("category", "unknown")
+    category_name = CATEGORY_NAMES.get(category, category)
+
+    lines = [
+        f"🚨 ЕЩЕ {count} АТАК ЗА {window_sec:.0f} С",
+        "",
+        f"Тип: {category_name}",
+        f"IP: {event.get('client_ip', '')}",
+    ]
+
+    if top_paths:
+        lines.append("Endpoint:")
+        lines.extend(f"  {path} — {n}" for path, n in top_paths)
+
+    if top_rules:
+        lines.append("Правила: " + ", ".join(f"{rule} ({n})" for rule, n in top_rules))
+
+    return "\n".join(lines)
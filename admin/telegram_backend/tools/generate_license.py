@@ -7,7 +7,7 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from app.db import init_db
+from app.db import close_db, init_db
 from app.licenses import hash_license, insert_license
 
 
@@ -17,6 +17,7 @@ async def main() -> None:
     key = "".join(secrets.choice(string.ascii_letters + string.digits) for _ in range(24))
     license_hash = hash_license(key)
     await insert_license(license_hash)
+    await close_db()
     
     print("")
     print("=" * 50)
@@ -0,0 +1,229 @@
+"""Нагрузочный тест отправки в Telegram с медленным Bot API.
+
+Поднимает поддельный Bot API (uvicorn в отдельном процессе, sendMessage
+отвечает через --delay секунд) и запускает настоящий bot_runner с
+telegram_api_url на него. Затем шлет подписанные события в
+/api/v1/event telegram_backend (в этом же процессе, httpx.ASGITransport)
+от --chats лицензий и ждет, пока все сообщения дойдут до Bot API.
+
+Для каждого bot_send_concurrency печатает скорость приема, скорость
+отправки, максимум одновременных sendMessage и наибольшую задержку loop
+FastAPI (если отправка блокирует loop, она растет до --delay). Потолок
+отправки - cap / delay сообщений в секунду, пока хватает CPU на разбор
+запросов python-telegram-bot.
+
+    python3 tests/bench/bench_bot_send.py [--delay 0.2] [--chats 100] [--caps 1,16,64]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import hmac
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from hashlib import sha256
+from pathlib import Path
+from urllib.parse import parse_qsl
+
+import httpx
+import orjson
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+SECRET = "bench-secret"
+TOKEN = "123456:bench"
+
+
+class FakeBotAPI:
+    """Минимальный Bot API: getMe, deleteWebhook, getUpdates и медленный sendMessage; /stats - счетчики"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.sent = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.app = Starlette(routes=[
+            Route("/stats", self.stats),
+            Route("/bot{token}/{method}", self.handle, methods=["GET", "POST"]),
+        ])
+
+    async def stats(self, request: Request) -> JSONResponse:
+        out = {"sent": self.sent, "max_in_flight": self.max_in_flight}
+        if "reset" in request.query_params:
+            self.max_in_flight = 0
+        return JSONResponse(out)
+
+    async def handle(self, request: Request) -> JSONResponse:
+        method = request.path_params["method"]
+        body = await request.body()
+        if request.headers.get("content-type", "").startswith("application/json"):
+            params = json.loads(body)
+        else:
+            params = dict(parse_qsl(body.decode()))
+        if method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            await asyncio.sleep(1)
+            result = []
+        elif method == "sendMessage":
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(self.delay)
+            finally:
+                self.in_flight -= 1
+            self.sent += 1
+            chat_id = int(params["chat_id"])
+            result = {"message_id": self.sent, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                      "text": params.get("text", "")}
+        else:
+            result = True
+        return JSONResponse({"ok": True, "result": result})
+
+
+def serve_fake(port: int, delay: float) -> None:
+    # отдельный процесс: разбор запросов Bot API не делит GIL с замеряемым бэкендом
+    # keep-alive длиннее пауз между прогонами: иначе сервер закрывает соединение, которое клиент берет из пула
+    uvicorn.run(FakeBotAPI(delay).app, port=port, log_level="warning", lifespan="off", timeout_keep_alive=120)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def sign(body: bytes) -> dict:
+    timestamp = str(int(time.time()))
+    nonce = uuid.uuid4().hex
+    signature = hmac.new(SECRET.encode(), f"{timestamp}\n{nonce}\n".encode() + body, sha256).hexdigest()
+    return {"X-Timestamp": timestamp, "X-Nonce": nonce, "X-Signature": signature, "Content-Type": "application/json"}
+
+
+async def loop_lag(stop: asyncio.Event, out: list) -> None:
+    """Наибольшее опоздание asyncio.sleep(0.01) - насколько loop был занят"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        out[0] = max(out[0], time.perf_counter() - start - 0.01)
+
+
+async def run_cap(client: httpx.AsyncClient, bot_api: httpx.AsyncClient, licenses: list, cap: int, events: int,
+                  delay: float) -> None:
+    from telegram_backend.app import bot_runner
+    from telegram_backend.app.settings import settings
+
+    settings.bot_send_concurrency = cap
+    bot_runner._send_slots = None
+    sent_before = (await bot_api.get("/stats?reset=1")).json()["sent"]
+    bodies = [
+        orjson.dumps({"request_id": uuid.uuid4().hex, "decision": "block", "category": "SQLI",
+                      "client_ip": f"10.0.0.{n % 250}", "endpoint": "/login",
+                      "license_key_hash": licenses[n % len(licenses)]})
+        for n in range(events)
+    ]
+    sem = asyncio.Semaphore(32)
+
+    async def one(body: bytes) -> None:
+        async with sem:
+            resp = await client.post("/api/v1/event", content=body, headers=sign(body))
+            resp.raise_for_status()
+
+    stop, lag = asyncio.Event(), [0.0]
+    probe = asyncio.create_task(loop_lag(stop, lag))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(body) for body in bodies))
+    ingest = time.perf_counter() - start
+    # отправка, не уложившаяся в bot_send_timeout_sec, теряется - ждем не бесконечно
+    deadline = start + events * delay / cap + 30
+    while True:
+        stats = (await bot_api.get("/stats")).json()
+        sent = stats["sent"] - sent_before
+        if sent >= events or time.perf_counter() > deadline:
+            break
+        await asyncio.sleep(0.01)
+    delivered = time.perf_counter() - start
+    stop.set()
+    await probe
+    print(f"cap {cap:>3}: {events} events  ingest {events / ingest:>7,.0f} events/s ({ingest:.2f}s)  "
+          f"delivered {sent}: {sent / delivered:>6,.1f} msg/s ({delivered:.1f}s)  "
+          f"max concurrent sendMessage {stats['max_in_flight']}  max loop lag {lag[0] * 1000:.0f} ms")
+
+
+async def run(args: argparse.Namespace, bot_api_url: str) -> None:
+    from telegram_backend.app import bot_runner
+    from telegram_backend.app.db import close_db, init_db
+    from telegram_backend.app.licenses import activate_license, hash_license, insert_license
+    from telegram_backend.app.main import app
+
+    await init_db()
+    licenses = []
+    for chat_id in range(1, args.chats + 1):
+        key = f"bench-license-{chat_id}"
+        await insert_license(hash_license(key))
+        await activate_license(key, chat_id)
+        licenses.append(hash_license(key))
+
+    bot_runner.start_bot()
+    while bot_runner.application is None or not bot_runner.application.running:
+        await asyncio.sleep(0.05)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://backend") as client, \
+            httpx.AsyncClient(base_url=bot_api_url) as bot_api:
+        for cap in args.caps:
+            # примерно одинаковая длительность прогонов: по 10 вызовов Bot API на слот
+            await run_cap(client, bot_api, licenses, cap, max(args.chats, cap * 10), args.delay)
+    await close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--delay", type=float, default=0.2, help="ответ sendMessage, секунд")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--caps", type=lambda s: [int(x) for x in s.split(",")], default=[1, 16, 64])
+    args = parser.parse_args()
+
+    port = free_port()
+    bot_api_url = f"http://127.0.0.1:{port}"
+    fake = multiprocessing.Process(target=serve_fake, args=(port, args.delay), daemon=True)
+    fake.start()
+    while True:
+        try:
+            httpx.get(f"{bot_api_url}/stats", timeout=1)
+            break
+        except httpx.HTTPError:
+            time.sleep(0.1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # настройки бэкенда читаются при импорте
+        os.environ.update({
+            "DB_PATH": str(Path(tmp) / "telegram.sqlite"),
+            "CONTROL_PLANE_HMAC_SECRET": SECRET,
+            "TELEGRAM_BOT_TOKEN": TOKEN,
+            "TELEGRAM_API_URL": f"{bot_api_url}/bot",
+            # без дайджестов и лимита на чат: каждое событие - отдельный sendMessage
+            "ALERT_AGGREGATION": "false",
+            "CHAT_RATE_PER_SEC": "1000",
+            "CHAT_BURST": "1000",
+            "CHAT_QUEUE_SIZE": "100000",
+        })
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+            asyncio.run(run(args, bot_api_url))
+    fake.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Пропускная способность приема событий: /api/v1/event по одному против /api/v1/events/batch.
+
+Приложение telegram_backend работает в этом же процессе (httpx.ASGITransport)
+на временной базе; подпись и тело запроса собираются так же, как в
+waf_gateway.telegram_client. Бот не настроен, поэтому время отправки в
+Telegram в замер не входит - меряется именно прием: HMAC, nonce, поиск
+лицензии и аудит.
+
+    python3 tests/bench/bench_events_batch.py [--events 5000] [--batch 100] [--concurrency 16]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import hmac
+import os
+import sys
+import tempfile
+import time
+import uuid
+from hashlib import sha256
+from pathlib import Path
+
+import httpx
+import orjson
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+SECRET = "bench-secret"
+LICENSE = "bench-license"
+
+
+def sign(body: bytes) -> dict:
+    timestamp = str(int(time.time()))
+    nonce = uuid.uuid4().hex
+    signature = hmac.new(SECRET.encode(), f"{timestamp}\n{nonce}\n".encode() + body, sha256).hexdigest()
+    return {"X-Timestamp": timestamp, "X-Nonce": nonce, "X-Signature": signature, "Content-Type": "application/json"}
+
+
+def make_event(n: int) -> dict:
+    return {
+        "request_id": uuid.uuid4().hex,
+        "decision": "block",
+        "category": "SQLI",
+        "endpoint": f"/item/{n % 50}",
+        "client_ip": f"10.0.{n % 4}.{n % 250}",
+        "reason": "Regex: {'SQLI'}",
+        "rule_ids": ["sqli-union"],
+        "stage": "regex",
+    }
+
+
+async def send_all(client: httpx.AsyncClient, bodies: list, url: str, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(body: bytes) -> None:
+        async with sem:
+            resp = await client.post(url, content=body, headers=sign(body))
+            resp.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(body) for body in bodies))
+    return time.perf_counter() - start
+
+
+async def run(args: argparse.Namespace) -> None:
+    from telegram_backend.app.db import close_db, database, init_db
+    from telegram_backend.app.licenses import activate_license, hash_license, insert_license
+    from telegram_backend.app.main import app
+
+    await init_db()
+    license_hash = hash_license(LICENSE)
+    await insert_license(license_hash)
+    await activate_license(LICENSE, 1)
+
+    events = [make_event(n) for n in range(args.events)]
+    single = [orjson.dumps(dict(event, license_key_hash=license_hash)) for event in events]
+    batches = [
+        orjson.dumps({"license_key_hash": license_hash, "events": events[i : i + args.batch]})
+        for i in range(0, len(events), args.batch)
+    ]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://backend") as client:
+        # события печатают по строке в stderr - в замер это входит, на экран нет
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+            writes = database.writes
+            single_sec = await send_all(client, single, "/api/v1/event", args.concurrency)
+            single_writes = database.writes - writes
+            writes = database.writes
+            batch_sec = await send_all(client, batches, "/api/v1/events/batch", args.concurrency)
+            batch_writes = database.writes - writes
+    await close_db()
+
+    n = args.events
+    print(f"single: {n} events in {single_sec:.2f}s  {n / single_sec:>9,.0f} events/s  {single_writes} DB write jobs")
+    print(f"batch:  {n} events in {batch_sec:.2f}s  {n / batch_sec:>9,.0f} events/s  {batch_writes} DB write jobs"
+          f"  ({len(batches)} requests of {args.batch})")
+    print(f"speedup x{single_sec / batch_sec:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        # настройки бэкенда читаются при импорте
+        os.environ["DB_PATH"] = str(Path(tmp) / "telegram.sqlite")
+        os.environ["CONTROL_PLANE_HMAC_SECRET"] = SECRET
+        os.environ["TELEGRAM_BOT_TOKEN"] = ""
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Стресс RateLimiter: N разных IP (по умолчанию 10M), пиковый RSS и скорость.
+
+Каждый IP приходит один раз, как при флуде с подменой адресов: без
+ограничения по ключам таблица бакетов росла бы на каждый адрес. Потолок
+задает rate_limit_max_keys (--max-keys), лишние бакеты вытесняются. При
+настройках по умолчанию бакет восстанавливается за 0.1 с и уходит как
+простаивающий; с маленьким --refill работает принудительное вытеснение.
+
+    python3 tests/bench/bench_rate_limit.py [--ips 10000000] [--max-keys 1000000] [--refill 10]
+"""
+from __future__ import annotations
+
+import argparse
+import resource
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from waf_gateway.app.rate_limit import RateLimiter  # noqa: E402
+from waf_gateway.app.settings import settings  # noqa: E402
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ips", type=int, default=10_000_000)
+    parser.add_argument("--max-keys", type=int, default=settings.rate_limit_max_keys)
+    parser.add_argument("--refill", type=float, default=settings.rate_limit_refill_per_sec)
+    args = parser.parse_args()
+
+    settings.rate_limit_max_keys = args.max_keys
+    settings.rate_limit_refill_per_sec = args.refill
+    limiter = RateLimiter()
+    base = rss_mb()
+    start = time.perf_counter()
+    for n in range(args.ips):
+        limiter.allow(f"{10 + (n >> 24)}.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}")
+        if n and n % 2_000_000 == 0:
+            print(f"  {n:>11,} ips  rss {rss_mb():7.0f} MB", flush=True)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    stats = limiter.stats()
+    print(f"{args.ips:,} distinct IPs in {elapsed:.1f}s ({args.ips / elapsed:,.0f} allow/s)")
+    print(f"rss before {base:.0f} MB, peak {peak:.0f} MB")
+    print(f"tracked {stats['tracked_keys']:,} / {stats['max_keys']:,}, "
+          f"evicted idle {stats['evicted_idle']:,}, forced {stats['evicted_forced']:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Время RegexEngine.analyze на запрос: прогон каждого правила против общего матчера.
+
+Корпус - запросы из ai_analyzer dataset_synth.build_dataset(), каждый
+разбирается как у шлюза (canonical_query). Заодно проверяется, что оба пути
+дают одинаковые hits, score и suspected_param.
+
+    python3 tests/bench/bench_regex_engine.py [--rounds 200]
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+import urllib.parse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from ai_analyzer.app.dataset_synth import build_dataset  # noqa: E402
+from waf_gateway.app.normalization import canonical_query  # noqa: E402
+from waf_gateway.app.regex_engine import RegexEngine  # noqa: E402
+from waf_gateway.app.settings import settings  # noqa: E402
+
+
+def corpus() -> list:
+    reqs = []
+    for text in build_dataset()[0]:
+        method, _, rest = text.partition(" ")
+        path, _, query = rest.partition(" ")
+        canon, params = canonical_query(urllib.parse.quote(query, safe="=&"))
+        reqs.append({"method": method, "path": path, "query": canon, "params": params, "body": "", "headers": {}})
+    return reqs
+
+
+def per_request_us(fn, reqs: list, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for req in reqs:
+            fn(req)
+    return (time.perf_counter() - start) / (rounds * len(reqs)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    reqs = corpus()
+    engine = RegexEngine()
+    for req in reqs:
+        simple = engine.analyze_simple(req)
+        compiled = engine.analyze_compiled(req)
+        assert [h["id"] for h in simple[1]] == [h["id"] for h in compiled[1]], req
+        assert simple[0] == compiled[0] and simple[2] == compiled[2], req
+
+    print(f"{len(reqs)} requests x {args.rounds} rounds, {len(engine.rules)} rules")
+    base = per_request_us(engine.analyze_simple, reqs, args.rounds)
+    print(f"  per-rule loop          {base:8.1f} us/request")
+    for prefilter in (False, True):
+        settings.regex_prefilter = prefilter
+        engine = RegexEngine()
+        us = per_request_us(engine.analyze_compiled, reqs, args.rounds)
+        name = "compiled + prefilter" if prefilter else "compiled"
+        print(f"  {name:<22} {us:8.1f} us/request  x{base / us:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Нагрузочный тест шлюза с uvicorn --workers N: лимит и блокировки общие для всех воркеров.
+
+Поднимает шлюз на свободном порту (upstream недоступен - пропущенный лимитом
+запрос получает 502), шлет --requests запросов с одного IP и считает,
+сколько прошло лимит. С state_backend=sqlite должно пройти ровно
+RATE_LIMIT_BURST, с memory - до N * RATE_LIMIT_BURST. Затем IP блокируется
+через админскую ручку одного воркера, и все следующие запросы должны
+получить 403.
+
+    python3 tests/bench/bench_shared_state.py [--workers 4] [--requests 2000] [--burst 100]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+ADMIN = Path(__file__).resolve().parents[2]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gateway(backend: str, workers: int, burst: int, tmp: Path) -> tuple:
+    port = free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(ADMIN),
+        STATE_BACKEND=backend,
+        STATE_PATH=str(tmp / f"{backend}.sqlite"),
+        LOG_PATH=str(tmp / backend / "waf_events.jsonl"),
+        HASH_STATE_PATH=str(tmp / backend / "hash_state.json"),
+        RATE_LIMIT_BURST=str(burst),
+        RATE_LIMIT_REFILL_PER_SEC="0.001",
+        UPSTREAM_URL=f"http://127.0.0.1:{free_port()}",
+        TELEGRAM_BACKEND_URL="",
+        LICENSE_KEY_HASH="",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "waf_gateway.app.main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env=env, cwd=ADMIN, start_new_session=True,
+        stdout=subprocess.DEVNULL, stderr=open(tmp / f"{backend}.stderr", "w"),
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return proc, f"http://127.0.0.1:{port}"
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    os.killpg(proc.pid, signal.SIGTERM)
+    raise RuntimeError(f"gateway did not start, see {tmp / f'{backend}.stderr'}")
+
+
+async def hammer(url: str, count: int, concurrency: int = 64) -> tuple:
+    statuses: collections.Counter = collections.Counter()
+    sem = asyncio.Semaphore(concurrency)
+    # без keep-alive: каждое соединение заново распределяется между воркерами
+    limits = httpx.Limits(max_keepalive_connections=0)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def one(n: int) -> None:
+            async with sem:
+                resp = await client.get(f"{url}/page?n={n}")
+                statuses[resp.status_code] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(n) for n in range(count)))
+        return statuses, time.perf_counter() - start
+
+
+def run(backend: str, args: argparse.Namespace, tmp: Path) -> None:
+    proc, url = start_gateway(backend, args.workers, args.burst, tmp)
+    try:
+        statuses, elapsed = asyncio.run(hammer(url, args.requests))
+        passed = sum(n for code, n in statuses.items() if code != 429)
+        logs = sorted(p.name for p in (tmp / backend).glob("waf_events*.jsonl"))
+        print(f"{backend:>6}: {args.requests} requests in {elapsed:.1f}s ({args.requests / elapsed:,.0f} req/s), "
+              f"passed the limit {passed} (burst {args.burst}), statuses {dict(statuses)}")
+        print(f"        worker logs: {', '.join(logs)}")
+        if backend == "sqlite":
+            assert passed == args.burst, "limit is not global"
+            httpx.post(f"{url}/waf/block/127.0.0.1?ttl=60", timeout=10).raise_for_status()
+            statuses, _ = asyncio.run(hammer(url, 200))
+            print(f"        after blocking 127.0.0.1 on one worker: {dict(statuses)}")
+            assert statuses == {403: 200}, "block is not global"
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--burst", type=int, default=100)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("memory", "sqlite"):
+            run(backend, args, Path(tmp))
+
+
+if __name__ == "__main__":
+    main()
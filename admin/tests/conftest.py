@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# сервисы импортируются как waf_gateway.app, telegram_backend.app и т.д.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# пути по умолчанию указывают в /data - для тестов во временный каталог
+_tmp = Path(tempfile.mkdtemp(prefix="waf-tests-"))
+os.environ.setdefault("LOG_PATH", str(_tmp / "waf_events.jsonl"))
+os.environ.setdefault("HASH_STATE_PATH", str(_tmp / "hash_state.json"))
+os.environ.setdefault("STATE_PATH", str(_tmp / "waf_state.sqlite"))
+os.environ.setdefault("DB_PATH", str(_tmp / "telegram.sqlite"))
+# анализатор недоступен - ML в тестах сразу уходит в режим деградации
+os.environ.setdefault("AI_URL", "http://127.0.0.1:9/analyze")
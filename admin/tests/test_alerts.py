@@ -0,0 +1,48 @@
+import asyncio
+
+from telegram_backend.app import alerts
+from telegram_backend.app.settings import settings
+
+
+def test_flush_all_waits_for_digests(monkeypatch):
+    sent = []
+
+    async def send_message(chat_id, text, event):
+        await asyncio.sleep(0.01)
+        sent.append((chat_id, text))
+
+    monkeypatch.setattr(alerts.bot_runner, "send_message", send_message)
+    monkeypatch.setattr(settings, "alert_aggregation", True)
+
+    async def scenario():
+        aggregator = alerts.AlertAggregator(alerts.ChatPacer())
+        for chat_id in (1, 2):
+            for _ in range(3):
+                aggregator.add(f"lic{chat_id}", chat_id, {"client_ip": "203.0.113.7", "category": "SQLI"})
+        await aggregator.flush_all()
+        return aggregator
+
+    aggregator = asyncio.run(scenario())
+    # на чат: первое событие сразу и дайджест по остальным двум
+    assert len(sent) == 4
+    assert aggregator.pacer.stats()["queued"] == 0
+    assert not aggregator.groups
+
+
+def test_flush_all_is_bounded(monkeypatch):
+    async def send_message(chat_id, text, event):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(alerts.bot_runner, "send_message", send_message)
+    monkeypatch.setattr(settings, "alert_drain_sec", 0.05)
+
+    async def scenario():
+        aggregator = alerts.AlertAggregator(alerts.ChatPacer())
+        aggregator.add("lic", 1, {"client_ip": "203.0.113.7", "category": "SQLI"})
+        start = asyncio.get_running_loop().time()
+        await aggregator.flush_all()
+        return asyncio.get_running_loop().time() - start, aggregator
+
+    elapsed, aggregator = asyncio.run(scenario())
+    assert elapsed < 1
+    assert not aggregator.pacer.tasks
@@ -0,0 +1,36 @@
+import asyncio
+
+import aiosqlite
+
+from telegram_backend.app.db import Database
+from telegram_backend.app.settings import settings
+
+
+def test_close_waits_for_in_flight_group_commit(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "db_path", str(tmp_path / "bot.sqlite"))
+
+    async def scenario():
+        db = Database()
+        await db.open()
+        await db.execute("CREATE TABLE t (n INTEGER)")
+        started = asyncio.Event()
+
+        def insert(n):
+            async def job(conn: aiosqlite.Connection) -> int:
+                started.set()
+                await asyncio.sleep(0.01)  # пачка еще не закоммичена, когда вызывается close
+                cur = await conn.execute("INSERT INTO t (n) VALUES (?)", (n,))
+                return cur.lastrowid
+            return job
+
+        writes = [asyncio.create_task(db.write(insert(n))) for n in range(20)]
+        await started.wait()
+        await asyncio.wait_for(db.close(), 5)
+        results = await asyncio.wait_for(asyncio.gather(*writes), 5)
+        assert sorted(results) == list(range(1, 21))
+
+        async with aiosqlite.connect(settings.db_path) as check:
+            (count,) = await (await check.execute("SELECT COUNT(*) FROM t")).fetchone()
+        assert count == 20
+
+    asyncio.run(scenario())
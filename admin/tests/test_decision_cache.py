@@ -0,0 +1,42 @@
+import asyncio
+
+from starlette.requests import Request
+
+from waf_gateway.app.decision_engine import DecisionEngine
+from waf_gateway.app.regex_engine import RegexRule
+
+
+def make_request(path: str, headers: dict[str, str], client_ip: str) -> Request:
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": (client_ip, 1234),
+        "server": ("test", 80),
+        "scheme": "http",
+    }
+    return Request(scope)
+
+
+async def evaluate(engine: DecisionEngine, path: str, headers: dict[str, str], client_ip: str = "203.0.113.7") -> str:
+    decision, _, _ = await engine.evaluate(make_request(path, headers, client_ip), client_ip, b"")
+    return decision
+
+
+def test_cache_respects_added_header_rule():
+    async def scenario():
+        engine = DecisionEngine()
+        assert await evaluate(engine, "/page", {"user-agent": "curl"}) == "allow"
+        engine.regex_engine.add_rule(RegexRule({
+            "id": "CMD_evilbot", "category": "XSS", "target": "headers",
+            "pattern": "evilbot", "ignore_case": True, "weight": 5,
+        }))
+        assert await evaluate(engine, "/page", {"user-agent": "evilbot"}) == "block"
+        assert await evaluate(engine, "/page2", {"user-agent": "evilbot"}) == "block"
+        assert await evaluate(engine, "/page", {"user-agent": "curl"}) == "allow"
+        await engine.ml.close()
+
+    asyncio.run(scenario())
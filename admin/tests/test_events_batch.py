@@ -0,0 +1,50 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from telegram_backend.app import events
+from telegram_backend.app.settings import settings
+
+
+def make_request(body: bytes) -> Request:
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {"type": "http", "method": "POST", "path": "/api/v1/events/batch", "headers": [], "query_string": b""}
+    return Request(scope, receive)
+
+
+@pytest.fixture(autouse=True)
+def no_hmac(monkeypatch):
+    async def verify_hmac(request, raw):
+        return None
+
+    async def get_chat_for_license(license_hash):
+        raise AssertionError("validation must reject the batch first")
+
+    monkeypatch.setattr(events, "verify_hmac", verify_hmac)
+    monkeypatch.setattr(events, "get_chat_for_license", get_chat_for_license)
+
+
+def post(payload) -> int:
+    request = make_request(json.dumps(payload).encode())
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(events.ingest_events_batch(request))
+    return exc.value.status_code
+
+
+@pytest.mark.parametrize("bad", [[{"decision": "block"}, "oops"], [None], [[1, 2]], [42]])
+def test_batch_rejects_non_object_events(bad):
+    assert post({"license_key_hash": "x", "events": bad}) == 400
+
+
+def test_batch_rejects_non_object_payload():
+    assert post([{"license_key_hash": "x"}]) == 400
+
+
+def test_batch_size_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, "max_batch_events", 3)
+    assert post({"license_key_hash": "x", "events": [{}] * 4}) == 413
@@ -0,0 +1,64 @@
+import random
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+
+from ai_analyzer.app.dataset_synth import build_dataset
+from ai_analyzer.app.fast_model import FastScorer, export_fast
+
+NOISE = [" ", "  ", "\t", "\n \n", "%27", "'", "--", "<", ">", "é", "Ü", "İ", "ß", "∑", "😀", " ", "Ω"]
+
+
+def fuzz(texts, count, seed=7):
+    """Мутации обучающих строк: вставки, удаления, регистр, пробельные серии, не-ASCII"""
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789=&/?;()'\"<>-_ "
+    out = []
+    for _ in range(count):
+        chars = list(rng.choice(texts))
+        for _ in range(rng.randint(1, 6)):
+            op = rng.random()
+            pos = rng.randint(0, len(chars))
+            if op < 0.4:
+                chars[pos:pos] = rng.choice(NOISE)
+            elif op < 0.6 and chars:
+                del chars[min(pos, len(chars) - 1)]
+            elif op < 0.8:
+                chars[pos:pos] = rng.choice(alphabet)
+            else:
+                chars = list("".join(chars).swapcase())
+        out.append("".join(chars))
+    out += ["", "a", "ab", "   ", "".join(rng.choice(alphabet) for _ in range(2000))]
+    return out
+
+
+@pytest.fixture(scope="module")
+def models(tmp_path_factory):
+    texts, labels = build_dataset()
+    vectorizer = TfidfVectorizer(analyzer="char", ngram_range=(3, 5), min_df=1)
+    clf = LogisticRegression(max_iter=200).fit(vectorizer.fit_transform(texts), labels)
+    out_dir = tmp_path_factory.mktemp("fast")
+    export_fast(vectorizer, clf, out_dir)
+    return vectorizer, clf, FastScorer(out_dir), texts
+
+
+def test_fast_scorer_matches_sklearn_on_fuzzed_corpus(models):
+    vectorizer, clf, fast, texts = models
+    corpus = fuzz(texts, 2000)
+    expected = clf.predict_proba(vectorizer.transform(corpus))
+    got = np.array([fast.predict_proba(text) for text in corpus])
+
+    assert [str(c) for c in clf.classes_] == fast.classes
+    # веса хранятся во float32
+    np.testing.assert_allclose(got, expected, atol=1e-5)
+    labels = [label for label, _ in fast.predict_batch(corpus)]
+    assert labels == [str(label) for label in clf.classes_[expected.argmax(axis=1)]]
+
+
+def test_fast_scorer_ignores_unknown_ngrams(models):
+    vectorizer, clf, fast, _ = models
+    text = "zzqx ЖЖЖ 😀😀😀"
+    assert not vectorizer.transform([text]).nnz
+    np.testing.assert_allclose(fast.predict_proba(text), clf.predict_proba(vectorizer.transform([text]))[0], atol=1e-6)
@@ -0,0 +1,48 @@
+import hashlib
+import json
+
+from waf_gateway.app.integrity_chain import GENESIS, IntegrityChain
+
+
+def write_entries(path, count):
+    prev = GENESIS
+    lines = []
+    for n in range(count):
+        payload = json.dumps({"n": n}).encode()
+        entry = hashlib.sha256(prev.encode() + payload).hexdigest()
+        lines.append(json.dumps({"n": n, "prev_hash": prev, "entry_hash": entry}) + "\n")
+        prev = entry
+    path.write_text("".join(lines))
+    return prev
+
+
+def test_recovery_truncates_partial_trailing_line(tmp_path):
+    log = tmp_path / "waf_events.jsonl"
+    head = write_entries(log, 3)
+    complete = log.read_bytes()
+    with log.open("ab") as f:
+        f.write(b'{"n": 3, "prev_hash": "' + head[:20].encode())
+
+    chain = IntegrityChain(tmp_path / "hash_state.json", log)
+
+    assert chain.prev_hash == head
+    assert log.read_bytes() == complete
+
+
+def test_recovery_keeps_complete_file(tmp_path):
+    log = tmp_path / "waf_events.jsonl"
+    head = write_entries(log, 2)
+    complete = log.read_bytes()
+
+    assert IntegrityChain(tmp_path / "hash_state.json", log).prev_hash == head
+    assert log.read_bytes() == complete
+
+
+def test_recovery_of_single_torn_line(tmp_path):
+    log = tmp_path / "waf_events.jsonl"
+    log.write_bytes(b'{"n": 0, "prev_')
+
+    chain = IntegrityChain(tmp_path / "hash_state.json", log)
+
+    assert chain.prev_hash == GENESIS
+    assert log.read_bytes() == b""
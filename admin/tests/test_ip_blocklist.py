@@ -0,0 +1,27 @@
+from waf_gateway.app import ip_blocklist
+from waf_gateway.app.ip_blocklist import IPBlocklist
+
+
+def test_trie_is_rebuilt_after_prefix_churn(monkeypatch):
+    monkeypatch.setattr(ip_blocklist, "TRIE_REBUILD_MIN", 16)
+    blocklist = IPBlocklist()
+    blocklist.block("198.51.100.0/24")
+    sizes = []
+    for round_ in range(20):
+        feed = [f"10.{round_}.{n}.0/24" for n in range(50)]
+        blocklist.bulk_load(feed)
+        for net in feed:
+            blocklist.unblock(net)
+        sizes.append(len(blocklist.tries[32].left))
+    # без пересборки trie рос бы на каждом раунде
+    assert max(sizes) < 2 * sizes[0]
+    assert blocklist.is_blocked("198.51.100.7")
+    assert not blocklist.is_blocked("10.3.4.5")
+
+
+def test_bulk_load_skips_non_strings():
+    blocklist = IPBlocklist()
+    loaded = blocklist.bulk_load(["203.0.113.0/24", None, 42, {"ip": "1.2.3.4"}, " # comment", "", "192.0.2.1"])
+    assert loaded == 2
+    assert blocklist.is_blocked("203.0.113.9")
+    assert blocklist.is_blocked("192.0.2.1")
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import time
+
+import joblib
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+
+from waf_gateway.app import local_model
+from waf_gateway.app.local_model import LocalModel
+
+TEXTS = ["GET /item id=1", "GET /search q=shoes", "GET /item id=1' OR 1=1 --", "GET /item id=1 UNION SELECT pass"]
+LABELS = ["BENIGN", "BENIGN", "SQLI", "SQLI"]
+
+
+def dump_model(path):
+    vectorizer = TfidfVectorizer(analyzer="char", ngram_range=(3, 5))
+    clf = LogisticRegression(max_iter=1000).fit(vectorizer.fit_transform(TEXTS), LABELS)
+    joblib.dump({"vectorizer": vectorizer, "clf": clf}, path)
+
+
+async def wait_ready(model, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not model.ready():
+        assert time.monotonic() < deadline, "model did not warm up"
+        await asyncio.sleep(0.05)
+
+
+def test_ready_only_after_every_worker_loaded_the_version(tmp_path):
+    path = tmp_path / "model.joblib"
+    dump_model(path)
+
+    async def scenario():
+        model = LocalModel(path, 2)
+        model.start()
+        try:
+            # воркеры еще поднимаются: запросы должны идти в удаленный анализатор
+            assert not model.ready()
+            await wait_ready(model)
+            assert model.warm_version == model.version
+
+            # прогревочные задания расходятся по разным процессам
+            loop = asyncio.get_running_loop()
+            pids = await asyncio.gather(*(
+                loop.run_in_executor(model.pool, local_model._warm, str(path), model.version, 10) for _ in range(2)
+            ))
+            assert len(set(pids)) == 2
+
+            # горячая перезагрузка: до прогрева новой версии - снова удаленный путь
+            stat = path.stat()
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            model._check()
+            assert not model.ready()
+            model._ensure_warm()
+            await wait_ready(model)
+
+            results = await model.predict([{"method": "get", "path": "/item", "query": "id=1 UNION SELECT pass"}])
+            assert results[0]["label"] == "SQLI"
+        finally:
+            model.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from waf_gateway.app import log_jsonl
+from waf_gateway.app.integrity_chain import IntegrityChain
+from waf_gateway.app.settings import settings
+
+
+@pytest.fixture
+def logger(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "log_path", tmp_path / "waf_events.jsonl")
+    monkeypatch.setattr(settings, "hash_state_path", tmp_path / "hash_state.json")
+    monkeypatch.setattr(settings, "log_merkle_batches", False)
+    monkeypatch.setattr(settings, "log_checkpoint_entries", 10_000)
+    lg = log_jsonl.JsonlLogger()
+    yield lg
+    lg.slot_lock.close()
+
+
+class BrokenFile:
+    def write(self, data):
+        raise OSError(28, "No space left on device")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_failed_write_keeps_chain_head(logger):
+    logger._write_batch([{"n": 1}])
+    head = logger.chain.prev_hash
+    logger.file.close()
+    logger.file = BrokenFile()
+    with pytest.raises(OSError):
+        logger._write_batch([{"n": 2}])
+    assert logger.chain.prev_hash == head
+    logger._write_batch([{"n": 3}])
+    logger.file.close()
+    records = [json.loads(line) for line in settings.log_path.read_text().splitlines()]
+    assert [r["n"] for r in records] == [1, 3]
+    assert records[1]["prev_hash"] == records[0]["entry_hash"]
+    assert IntegrityChain(settings.hash_state_path, settings.log_path).prev_hash == records[1]["entry_hash"]
+
+
+def test_block_policy_does_not_stall_event_loop(logger, monkeypatch):
+    monkeypatch.setattr(settings, "log_overflow_policy", "block")
+    monkeypatch.setattr(settings, "log_block_timeout_ms", 200)
+    logger.thread = object()  # писатель не запущен, очередь не разбирается
+    logger.queue.maxsize = 1
+    logger.queue.put_nowait({"n": 0})
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        await logger.write({"n": 1})
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(scenario()) >= 5
+    assert logger.dropped == 1
+
+
+@pytest.mark.parametrize("merkle", [False, True])
+def test_unserializable_event_is_rejected_alone(logger, monkeypatch, merkle):
+    monkeypatch.setattr(settings, "log_merkle_batches", merkle)
+    logger.start()
+
+    async def scenario():
+        await logger.write({"n": 1})
+        await logger.write({"n": 2, "body": object()})
+        await logger.write({"n": 3})
+
+    asyncio.run(scenario())
+    start = time.monotonic()
+    logger.close()
+    assert time.monotonic() - start < 2
+    assert logger.rejected == 1 and logger.written == 2
+    records = [json.loads(line) for line in settings.log_path.read_text().splitlines()]
+    assert [r["n"] for r in records if "n" in r] == [1, 3]
+
+
+def test_writer_survives_unexpected_error(logger, monkeypatch):
+    calls = []
+    original = logger._open
+
+    def flaky_open():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError("boom")
+        return original()
+
+    monkeypatch.setattr(logger, "_open", flaky_open)
+    head = logger.chain.prev_hash
+    logger.start()
+    asyncio.run(logger.write({"n": 1}))
+    deadline = time.monotonic() + 2
+    while not calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    asyncio.run(logger.write({"n": 2}))
+    while logger.written < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert logger.stats()["alive"]
+    logger.close()
+    records = [json.loads(line) for line in settings.log_path.read_text().splitlines()]
+    assert [r["n"] for r in records] == [2]
+    assert records[0]["prev_hash"] == head
@@ -0,0 +1,54 @@
+import importlib.util
+import tracemalloc
+from pathlib import Path
+
+import orjson
+
+TOOL = Path(__file__).resolve().parents[2] / "server" / "tools" / "log_stats.py"
+spec = importlib.util.spec_from_file_location("log_stats", TOOL)
+log_stats = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(log_stats)
+
+
+def lines(count, distinct_paths):
+    return [
+        orjson.dumps({
+            "decision": "allow",
+            "client_ip": "203.0.113.7",
+            "timestamp_utc": "2026-10-17T10:00:00Z",
+            "endpoint": f"/item/{n % distinct_paths}" if distinct_paths else "/item",
+            "latency_ms": n % 50,
+        })
+        for n in range(count)
+    ]
+
+
+def peak_bytes(feed):
+    agg = log_stats.Aggregator()
+    tracemalloc.start()
+    for start in range(0, len(feed), 5_000):
+        agg.add_chunk(feed[start:start + 5_000])
+    result = agg.result()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, result
+
+
+def test_latency_memory_is_proportional_to_hits_not_bins():
+    feed = lines(20_000, 20_000)
+    peak, result = peak_bytes(feed)
+    assert len(result["latency"]) == 20_000
+    # плотная матрица заняла бы 20000 * LAT_BINS * 8 байт (~290 МБ)
+    dense = 20_000 * log_stats.LAT_BINS * 8
+    assert peak < dense / 20
+    # на путь - порядка сотен байт, а не LAT_BINS корзин
+    assert peak / 20_000 < 2_000
+
+
+def test_latency_percentiles_survive_merge():
+    _, first = peak_bytes(lines(1_000, 0))
+    _, second = peak_bytes(lines(1_000, 0))
+    rep = log_stats.report(log_stats.merge([first, second]), 10, 30)
+    row = rep["latency_ms"]["/item"]
+    assert row["count"] == 2_000
+    assert (row["p50"], row["p95"], row["p99"]) == (24.0, 47.0, 49.0)
@@ -0,0 +1,37 @@
+from waf_gateway.app.rate_limit import RateLimiter, limiter_key
+from waf_gateway.app.settings import settings
+
+
+def normalized(api_key):
+    return {"path": "/api", "headers": {"x-api-key": api_key} if api_key else {}}
+
+
+def test_rotating_unknown_api_keys_share_the_ip_bucket(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_key", "api_key")
+    monkeypatch.setattr(settings, "rate_limit_api_keys", {"partner-1"})
+    monkeypatch.setattr(settings, "rate_limit_burst", 5)
+    monkeypatch.setattr(settings, "rate_limit_refill_per_sec", 0.001)
+    limiter = RateLimiter()
+
+    allowed = [limiter.allow(limiter_key("203.0.113.7", normalized(f"random-{n}"))) for n in range(20)]
+    assert sum(allowed) == 5
+
+
+def test_known_api_key_gets_its_own_bucket(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_key", "api_key")
+    monkeypatch.setattr(settings, "rate_limit_api_keys", {"partner-1"})
+    assert limiter_key("203.0.113.7", normalized("partner-1")) == "key|partner-1"
+    assert limiter_key("198.51.100.1", normalized("partner-1")) == "key|partner-1"
+    assert limiter_key("203.0.113.7", normalized("guess")) == "203.0.113.7"
+    assert limiter_key("203.0.113.7", normalized(None)) == "203.0.113.7"
+
+
+def test_tracked_keys_stay_within_budget(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_max_keys", 1_000)
+    monkeypatch.setattr(settings, "rate_limit_refill_per_sec", 0.0001)  # бакеты не успевают восстановиться
+    limiter = RateLimiter()
+    for n in range(50_000):
+        limiter.allow(f"10.{n >> 16}.{(n >> 8) & 255}.{n & 255}")
+    stats = limiter.stats()
+    assert stats["tracked_keys"] <= 1_000
+    assert stats["evicted_forced"] >= 49_000
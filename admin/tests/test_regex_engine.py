@@ -0,0 +1,47 @@
+import pytest
+
+from waf_gateway.app.normalization import canonical_query
+from waf_gateway.app.regex_engine import RegexEngine
+from waf_gateway.app.settings import settings
+
+
+def make_req(query: str) -> dict:
+    canon, params = canonical_query(query)
+    return {"method": "GET", "path": "/", "query": canon, "params": params, "body": "", "headers": {}}
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return RegexEngine()
+
+
+@pytest.mark.parametrize("query", ["a=<scrİpt>", "a=javascrİpt:", "u=İd", "a=<SCRİPT>", "a=<ſcript>"])
+def test_compiled_matches_simple_on_unicode_case_folding(engine, query, monkeypatch):
+    monkeypatch.setattr(settings, "regex_prefilter", True)
+    req = make_req(query)
+    simple_score, simple_hits, _ = engine.analyze_simple(req)
+    score, hits, _ = engine.analyze_compiled(req)
+    assert simple_hits
+    assert [h["id"] for h in hits] == [h["id"] for h in simple_hits]
+    assert score == simple_score
+
+
+def test_prefilter_counters_accumulate(monkeypatch):
+    monkeypatch.setattr(settings, "regex_prefilter", True)
+    queries = ["a=<script>alert(1)</script>", "", "page=2", "q=hello", "id=1 union select 1", ""]
+    single = []
+    for query in queries:
+        engine = RegexEngine()
+        engine.analyze_compiled(make_req(query))
+        single.append(engine.prefilter_stats())
+
+    engine = RegexEngine()
+    for query in queries:
+        engine.analyze_compiled(make_req(query))
+    stats = engine.prefilter_stats()
+    assert stats["requests"] == len(queries)
+    assert stats["requests_clean"] == sum(s["requests_clean"] for s in single)
+    assert stats["rule_checks"] == sum(s["rule_checks"] for s in single)
+    assert stats["rule_checks_skipped"] == sum(s["rule_checks_skipped"] for s in single)
+    assert stats["requests_clean"] == 2
+    assert 0 < stats["rule_checks_skipped"] < stats["rule_checks"]
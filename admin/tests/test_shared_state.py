@@ -0,0 +1,108 @@
+import asyncio
+import sqlite3
+
+from waf_gateway.app.decision_engine import DecisionEngine
+from waf_gateway.app.settings import settings
+
+from test_decision_cache import evaluate
+
+
+def test_locked_state_file_falls_back_to_process_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "state_backend", "sqlite")
+    monkeypatch.setattr(settings, "state_path", tmp_path / "state.sqlite")
+    monkeypatch.setattr(settings, "state_busy_timeout_ms", 50)
+
+    async def scenario():
+        engine = DecisionEngine()
+        engine.blocklist.block("203.0.113.7", 60)
+        other = sqlite3.connect(settings.state_path, isolation_level=None)
+        other.execute("BEGIN EXCLUSIVE")  # другой воркер держит файл
+        try:
+            assert await evaluate(engine, "/page", {"user-agent": "curl"}) == "block"
+            assert await evaluate(engine, "/page", {"user-agent": "curl"}, "198.51.100.1") == "allow"
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        assert engine.state.errors > 0
+        assert await evaluate(engine, "/page", {"user-agent": "curl"}) == "block"
+        await engine.ml.close()
+
+    asyncio.run(scenario())
+
+
+def test_admin_paths_survive_locked_state_file(tmp_path, monkeypatch):
+    from waf_gateway.app.command_polling import CommandPoller
+
+    monkeypatch.setattr(settings, "state_backend", "sqlite")
+    monkeypatch.setattr(settings, "state_path", tmp_path / "state.sqlite")
+    monkeypatch.setattr(settings, "state_busy_timeout_ms", 50)
+
+    async def scenario():
+        engine = DecisionEngine()
+        poller = CommandPoller(engine.regex_engine, engine.blocklist, engine.run_state)
+        other = sqlite3.connect(settings.state_path, isolation_level=None)
+        other.execute("BEGIN EXCLUSIVE")
+        try:
+            await poller.apply_command({"command_type": "block_ip", "payload": {"ip": "192.0.2.9", "ttl": 60}})
+            await engine.run_state(engine.blocklist.bulk_load, ["198.51.100.0/24"])
+            active = await engine.run_state(engine.blocklist.active)
+            assert {"192.0.2.9", "198.51.100.0/24"} <= set(active)
+            await engine.run_state(engine.cache.stats)
+            await engine.run_state(engine.rate_limiter.stats)
+            assert await evaluate(engine, "/page", {"user-agent": "curl"}, "198.51.100.20") == "block"
+            await poller.apply_command({"command_type": "unblock_ip", "payload": {"ip": "192.0.2.9"}})
+            assert await evaluate(engine, "/page", {"user-agent": "curl"}, "192.0.2.9") == "allow"
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        assert engine.state.errors > 0
+        assert len(engine.blocklist.pending) == 3
+        # очистка дописывает отложенные изменения в файл для остальных воркеров
+        await engine.run_state(engine.blocklist.purge_expired)
+        assert not engine.blocklist.pending
+        assert set(await engine.run_state(engine.blocklist.active)) == {"198.51.100.0/24"}
+        await engine.ml.close()
+
+    asyncio.run(scenario())
+
+
+def test_command_polling_survives_errors(monkeypatch):
+    from waf_gateway.app import command_polling
+
+    calls = 0
+
+    async def scenario():
+        poller = command_polling.CommandPoller(None, None)
+
+        async def poll_once():
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise sqlite3.OperationalError("database is locked")
+            poller.running = False
+
+        async def no_sleep(_):
+            return None
+
+        monkeypatch.setattr(poller, "poll_once", poll_once)
+        monkeypatch.setattr(command_polling.asyncio, "sleep", no_sleep)
+        await poller.run_forever()
+
+    asyncio.run(scenario())
+    assert calls == 2
+
+
+def test_prefix_from_other_worker_applies_immediately(tmp_path, monkeypatch):
+    from waf_gateway.app.shared_state import SharedBlocklist, StateDB
+
+    monkeypatch.setattr(settings, "state_path", tmp_path / "state.sqlite")
+    first, second = SharedBlocklist(StateDB()), SharedBlocklist(StateDB())
+    assert not second.is_blocked("10.1.2.3")
+
+    first.block("10.0.0.0/8", 60)
+    assert second.is_blocked("10.1.2.3")
+
+    first.unblock("10.0.0.0/8")
+    first.bulk_load(["2001:db8::/32"])
+    assert not second.is_blocked("10.1.2.3")
+    assert second.is_blocked("2001:db8::1")
@@ -0,0 +1,90 @@
+import asyncio
+
+import httpx
+import pytest
+
+from waf_gateway.app.upstream_pool import UpstreamClient
+
+
+class Body(httpx.AsyncByteStream):
+    def __init__(self, fail: bool) -> None:
+        self.fail = fail
+
+    async def __aiter__(self):
+        yield b"a" * 10
+        if self.fail:
+            raise httpx.ReadError("upstream reset")
+        yield b"b" * 10
+
+
+def make_client(fail: bool = False) -> UpstreamClient:
+    client = UpstreamClient("http://upstream", max_connections=2)
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, stream=Body(fail)))
+    client.client = httpx.AsyncClient(transport=transport)
+    return client
+
+
+async def drain(client: UpstreamClient, resp: httpx.Response) -> bytes:
+    return b"".join([chunk async for chunk in client.stream_body(resp)])
+
+
+def test_stream_released_after_full_read():
+    async def scenario():
+        client = make_client()
+        resp = await client.open_stream("GET", "http://upstream/")
+        assert client.in_use == 1
+        assert await drain(client, resp) == b"a" * 10 + b"b" * 10
+        # фоновая задача StreamingResponse вызывает close_stream еще раз
+        await client.close_stream(resp)
+        assert client.in_use == 0
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_stream_released_on_upstream_error():
+    async def scenario():
+        client = make_client(fail=True)
+        resp = await client.open_stream("GET", "http://upstream/")
+        with pytest.raises(httpx.ReadError):
+            await drain(client, resp)
+        assert client.in_use == 0
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_stream_released_on_client_disconnect():
+    async def scenario():
+        client = make_client()
+        resp = await client.open_stream("GET", "http://upstream/")
+        body = client.stream_body(resp)
+        await body.__anext__()
+        # StreamingResponse при обрыве клиента бросает чтение на середине
+        await body.aclose()
+        assert client.in_use == 0
+        assert resp.is_closed
+        # слот действительно свободен: оба можно занять снова
+        for _ in range(2):
+            await client.open_stream("GET", "http://upstream/")
+        assert client.in_use == 2
+        await client.close()
+
+    asyncio.run(scenario())
+
+
+def test_acquire_times_out_when_pool_is_full(monkeypatch):
+    from waf_gateway.app.settings import settings
+
+    monkeypatch.setattr(settings, "upstream_pool_timeout_sec", 0.05)
+
+    async def scenario():
+        client = make_client()
+        for _ in range(2):
+            await client.open_stream("GET", "http://upstream/")
+        with pytest.raises(httpx.PoolTimeout):
+            await client.acquire()
+        assert client.in_use == 2
+        await client.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,83 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from waf_gateway.app import log_jsonl
+from waf_gateway.app.settings import settings
+
+TOOL = Path(__file__).resolve().parents[2] / "server" / "tools" / "verify_log_chain.py"
+spec = importlib.util.spec_from_file_location("verify_log_chain", TOOL)
+verify_log_chain = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(verify_log_chain)
+
+KEY = "checkpoint-key"
+
+
+@pytest.fixture
+def logger(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "log_path", tmp_path / "waf_events.jsonl")
+    monkeypatch.setattr(settings, "hash_state_path", tmp_path / "hash_state.json")
+    monkeypatch.setattr(settings, "log_merkle_batches", False)
+    monkeypatch.setattr(settings, "log_checkpoint_entries", 10_000)
+    monkeypatch.setattr(settings, "log_checkpoint_key", KEY)
+    lg = log_jsonl.JsonlLogger()
+    yield lg
+    if lg.file is not None:
+        lg.file.close()
+    lg.slot_lock.close()
+
+
+def write(logger, batches, size=5):
+    for b in range(batches):
+        logger._write_batch([{"n": b * size + i, "path": "/item"} for i in range(size)])
+
+
+def test_live_file_with_torn_last_line(logger):
+    write(logger, 3)
+    with settings.log_path.open("ab") as f:
+        f.write(b'{"n":15,"path":"/it')
+
+    assert verify_log_chain.verify(settings.log_path)
+
+
+def test_live_file_inside_unfinished_merkle_batch(logger, monkeypatch, capsys):
+    monkeypatch.setattr(settings, "log_merkle_batches", True)
+    write(logger, 2)
+    data = settings.log_path.read_bytes()
+    # пачка записана одним write, но читатель застал только две ее строки
+    cut = data.rstrip(b"\n").rsplit(b"\n", 4)[0] + b"\n"
+    settings.log_path.write_bytes(cut)
+
+    assert verify_log_chain.verify(settings.log_path)
+    assert "not verified yet" in capsys.readouterr().out
+
+    rotated = settings.log_path.with_name(settings.log_path.name + ".1")
+    settings.log_path.rename(rotated)
+    settings.log_path.write_bytes(b"")
+    assert not verify_log_chain.verify(settings.log_path)
+
+
+def test_truncated_head_is_rejected(logger):
+    write(logger, 3)
+    lines = settings.log_path.read_bytes().splitlines(keepends=True)
+    settings.log_path.write_bytes(b"".join(lines[2:]))
+
+    assert not verify_log_chain.verify(settings.log_path, key=KEY)
+
+
+def test_oldest_rotated_file_starts_at_signed_checkpoint(logger, monkeypatch):
+    monkeypatch.setattr(settings, "log_rotate_bytes", 1500)
+    monkeypatch.setattr(settings, "log_rotate_keep", 2)
+    write(logger, 13)
+    files = verify_log_chain.log_files(settings.log_path)
+    assert len(files) == 3 and not settings.log_path.with_name("waf_events.jsonl.3").exists()
+
+    # начало с GENESIS удалено ротацией, старейший файл начинается с подписанной точки
+    assert verify_log_chain.verify(settings.log_path, key=KEY)
+    assert not verify_log_chain.verify(settings.log_path)
+
+    oldest = files[0]
+    lines = oldest.read_bytes().splitlines(keepends=True)
+    oldest.write_bytes(b"".join(lines[1:]))
+    assert not verify_log_chain.verify(settings.log_path, key=KEY)
@@ -1,26 +1,111 @@
 from __future__ import annotations
 
+import asyncio
+import sys
 import time
+from collections import OrderedDict
 from typing import Any, Dict, Optional, Tuple
 
+from .settings import settings
+
+
+def _entry_size(key: str, value: Any) -> int:
+    """Приблизительный размер записи в байтах (ключ + значение + служебные объекты)"""
+    size = sys.getsizeof(key) + sys.getsizeof(value) + 64
+    if isinstance(value, (tuple, list)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
 
 class DecisionCache:
-    def __init__(self, max_size: int = 512, ttl: int = 300) -> None:
-        self.max_size = max_size
-        self.ttl = ttl
-        self.store: Dict[str, Tuple[float, Any]] = {}
+    """LRU-кэш с TTL: O(1) get/set, лимиты по числу записей и по байтам.
+
+    store хранит записи в порядке использования (LRU), expiry - в порядке
+    вставки; так как TTL общий, это и порядок истечения, поэтому просроченные
+    записи снимаются с головы expiry без полного обхода.
+    """
+
+    def __init__(
+        self,
+        max_size: int | None = None,
+        ttl: int | None = None,
+        max_bytes: int | None = None,
+    ) -> None:
+        self.max_size = max_size or settings.cache_max_entries
+        self.ttl = ttl or settings.cache_ttl_sec
+        self.max_bytes = max_bytes or settings.cache_max_bytes
+        self.store: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self.expiry: "OrderedDict[str, float]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
 
     def get(self, key: str) -> Optional[Any]:
+        item = self.store.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value, _ = item
+        if expires_at <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.store.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
         now = time.time()
         if key in self.store:
-            ts, value = self.store[key]
-            if now - ts <= self.ttl:
-                return value
-            del self.store[key]
-        return None
+            self._remove(key)
+        size = _entry_size(key, value)
+        self.store[key] = (now + self.ttl, value, size)
+        self.expiry[key] = now + self.ttl
+        self.bytes += size
+        # амортизированная очистка: немного просроченных на каждую вставку
+        self.purge_expired(limit=2, now=now)
+        while self.store and (len(self.store) > self.max_size or self.bytes > self.max_bytes):
+            oldest = next(iter(self.store))
+            self._remove(oldest)
+            self.evictions += 1
 
-    def set(self, key: str, value: Any) -> None:
-        if len(self.store) >= self.max_size:
-            oldest = sorted(self.store.items(), key=lambda kv: kv[1][0])[0][0]
-            self.store.pop(oldest, None)
-        self.store[key] = (time.time(), value)
+    def _remove(self, key: str) -> None:
+        _, _, size = self.store.pop(key)
+        self.expiry.pop(key, None)
+        self.bytes -= size
+
+    def purge_expired(self, limit: int | None = None, now: float | None = None) -> int:
+        now = now or time.time()
+        removed = 0
+        while self.expiry and (limit is None or removed < limit):
+            key, expires_at = next(iter(self.expiry.items()))
+            if expires_at > now:
+                break
+            self._remove(key)
+            self.expirations += 1
+            removed += 1
+        return removed
+
+    async def run_expiry(self) -> None:
+        """Фоновая очистка просроченных записей порциями, чтобы не держать event loop"""
+        while True:
+            await asyncio.sleep(settings.cache_sweep_interval_sec)
+            while self.purge_expired(limit=settings.cache_sweep_batch) == settings.cache_sweep_batch:
+                await asyncio.sleep(0)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.store),
+            "bytes": self.bytes,
+            "max_entries": self.max_size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -2,7 +2,8 @@ from __future__ import annotations
 
 import asyncio
 import json
-from typing import Any
+import sys
+from typing import Any, Awaitable, Callable
 
 import httpx
 
@@ -11,14 +12,24 @@ from .regex_engine import RegexEngine, RegexRule
 from .settings import settings
 
 
+async def _direct(fn: Callable[..., Any], *args: Any) -> Any:
+    return fn(*args)
+
+
 class CommandPoller:
-    def __init__(self, engine: RegexEngine, blocklist: IPBlocklist) -> None:
+    def __init__(
+        self,
+        engine: RegexEngine,
+        blocklist: IPBlocklist,
+        run_state: Callable[..., Awaitable[Any]] = _direct,
+    ) -> None:
         self.engine = engine
         self.blocklist = blocklist
+        # DecisionEngine.run_state: SQLite-состояние трогается только из потока StateDB
+        self.run_state = run_state
         self.running = False
 
     async def apply_command(self, cmd: dict[str, Any]) -> None:
-        import sys
         cmd_type = cmd.get("command_type")
         payload = cmd.get("payload", {})
         print(f"[command_polling] Applying: {cmd_type} {payload}", file=sys.stderr)
@@ -26,12 +37,12 @@ class CommandPoller:
             ip = payload.get("ip")
             ttl = payload.get("ttl")
             if ip:
-                self.blocklist.block(ip, ttl)
+                await self.run_state(self.blocklist.block, ip, ttl)
                 print(f"[command_polling] BLOCKED IP: {ip} for {ttl}s", file=sys.stderr)
         elif cmd_type == "unblock_ip":
             ip = payload.get("ip")
             if ip:
-                self.blocklist.unblock(ip)
+                await self.run_state(self.blocklist.unblock, ip)
                 print(f"[command_polling] UNBLOCKED IP: {ip}", file=sys.stderr)
         elif cmd_type == "add_rule":
             try:
@@ -46,7 +57,7 @@ class CommandPoller:
                         "weight": int(payload.get("weight", 2)),
                     }
                 )
-                self.engine.rules.append(rule)
+                self.engine.add_rule(rule)
             except Exception:
                 return
 
@@ -85,5 +96,9 @@ class CommandPoller:
     async def run_forever(self) -> None:
         self.running = True
         while self.running:
-            await self.poll_once()
+            try:
+                await self.poll_once()
+            except Exception as exc:  # noqa: BLE001
+                # одна ошибка не должна останавливать опрос до перезапуска процесса
+                print(f"[command_polling] poll failed: {exc!r}", file=sys.stderr)
             await asyncio.sleep(5)
@@ -1,118 +1,98 @@
 from __future__ import annotations
 
-import asyncio
 import time
 import uuid
-from typing import Any, Tuple
-
-import httpx
+from typing import Any, Callable, Tuple
 
 from .cache import DecisionCache
 from .fingerprint import build_fingerprint
 from .ip_blocklist import IPBlocklist
 from .log_jsonl import get_logger
 from .masking import mask_headers, truncate_value
+from .ml_client import MLClient, MLUnavailable
 from .normalization import normalize_request
-from .rate_limit import RateLimiter
+from .rate_limit import RateLimiter, limiter_key
 from .recommendations import map_recommendations
 from .regex_engine import RegexEngine, load_engine
 from .settings import settings
-from .telegram_client import send_event
-
-
-class MLUnavailable(Exception):
-    pass
+from .shared_state import SharedBlocklist, SharedDecisionCache, SharedRateLimiter, StateDB
+from .telegram_client import AlertDispatcher
 
 
 class DecisionEngine:
     def __init__(self) -> None:
         self.regex_engine: RegexEngine = load_engine()
-        self.rate_limiter = RateLimiter()
-        self.blocklist = IPBlocklist()
-        self.cache = DecisionCache()
+        self.state: StateDB | None = None
+        if settings.state_backend == "sqlite":
+            # общее для всех воркеров состояние в одном файле
+            self.state = StateDB()
+            self.rate_limiter = SharedRateLimiter(self.state)
+            self.blocklist = SharedBlocklist(self.state)
+            self.cache = SharedDecisionCache(self.state)
+        else:
+            self.rate_limiter = RateLimiter()
+            self.blocklist = IPBlocklist()
+            self.cache = DecisionCache()
         self.logger = get_logger()
-        self.sem = asyncio.Semaphore(settings.ml_concurrency)
-        self.pending_waiters = 0
-        self.failure_count = 0
-        self.circuit_open_until = 0.0
-
-    def _circuit_open(self) -> bool:
-        return time.time() < self.circuit_open_until
-
-    def _record_failure(self) -> None:
-        self.failure_count += 1
-        if self.failure_count >= settings.circuit_failures:
-            self.circuit_open_until = time.time() + settings.circuit_cooldown_sec
-            self.failure_count = 0
-
-    def _record_success(self) -> None:
-        self.failure_count = 0
-
-    async def call_ml(self, payload: dict[str, Any]) -> dict[str, Any]:
-        if self._circuit_open():
-            raise MLUnavailable("circuit open")
-        if self.sem.locked() and self.pending_waiters >= settings.ml_queue_limit:
-            raise MLUnavailable("queue full")
-        
-        self.pending_waiters += 1
-        try:
-            async with self.sem:
-                async with httpx.AsyncClient(timeout=settings.ml_timeout_ms / 1000) as client:
-                    resp = await client.post(settings.ai_url, json=payload)
-                if resp.status_code != 200:
-                    self._record_failure()
-                    raise MLUnavailable(f"status {resp.status_code}")
-                self._record_success()
-                return resp.json()
-        except (httpx.HTTPError, asyncio.TimeoutError) as exc:
-            self._record_failure()
-            raise MLUnavailable(str(exc))
-        finally:
-            self.pending_waiters -= 1
+        self.ml = MLClient()
+        self.alerts = AlertDispatcher()
+
+    async def run_state(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Обращение к состоянию: общий SQLite-файл - в потоке StateDB, память - сразу.
+
+        Через него же идут админские ручки, метрики и команды из Telegram.
+        """
+        if self.state is None:
+            return fn(*args)
+        return await self.state.call(fn, *args)
+
+    async def call_ml(self, payload: dict[str, Any], key: str | None = None) -> dict[str, Any]:
+        return await self.ml.analyze(payload, key)
 
     async def evaluate(self, request, client_ip: str, body_bytes: bytes) -> Tuple[str, dict[str, Any], dict[str, Any]]:
         request_id = uuid.uuid4().hex
         normalized = await normalize_request(request, body_bytes)
         headers_masked = mask_headers(normalized["headers"])
 
-        if self.blocklist.is_blocked(client_ip):
+        if await self.run_state(self.blocklist.is_blocked, client_ip):
             log_entry = self._build_log(
                 request_id, client_ip, normalized, 0, [], "blocked", "ip block",
                 "unknown", None, None, headers_masked, [], "block"
             )
             return "block", log_entry, {"reason": "ip blocked"}
 
-        if not self.rate_limiter.allow(client_ip, suspicious=False):
+        if not await self.run_state(self.rate_limiter.allow, limiter_key(client_ip, normalized), False):
             log_entry = self._build_log(
                 request_id, client_ip, normalized, 0, [], "rate_limit", "rate limit",
                 "unknown", None, None, headers_masked, [], "rate_limit"
             )
             return "rate_limit", log_entry, {}
 
-        score, hits, suspected_param = self.regex_engine.analyze(normalized)
-        categories = {h["category"] for h in hits}
-        stage = "regex"
-        ml_label: str | None = None
-        ml_conf: float | None = None
-        recommendation_ids = map_recommendations(categories)
-
         fingerprint = build_fingerprint(
             normalized["method"],
             normalized["path"],
             normalized["query"],
             normalized["content_type"],
-            normalized.get("body", ""),
+            memoryview(normalized["body_bytes"])[: settings.body_truncate],
+            self.regex_engine.cache_inputs(normalized),
         )
-        
-        cached = self.cache.get(fingerprint)
+
+        # Быстрый путь: при попадании в кэш regex и ML не запускаются
+        cached = await self.run_state(self.cache.get, fingerprint)
         if cached:
-            decision, ml_label, ml_conf, stage_cached = cached
-            stage = "cache_hit"
+            decision, ml_label, ml_conf, _, score, hits, suspected_param, recommendation_ids, reason = cached
             log_entry = self._build_log(
-                request_id, client_ip, normalized, score, hits, stage, "cache",
+                request_id, client_ip, normalized, score, hits, "cache_hit", "cache",
                 suspected_param, ml_label, ml_conf, headers_masked, recommendation_ids, decision
             )
-            return decision, log_entry, {}
+            return decision, log_entry, ({"reason": reason} if decision == "block" else {})
+
+        score, hits, suspected_param = self.regex_engine.analyze(normalized)
+        categories = {h["category"] for h in hits}
+        stage = "regex"
+        ml_label: str | None = None
+        ml_conf: float | None = None
+        recommendation_ids = map_recommendations(categories)
 
         # Двухэтапная фильтрация: regex -> ML
         # Если есть срабатывания regex (score > 0), вызываем ML и блокируем
@@ -125,7 +105,7 @@ class DecisionEngine:
                     "content_type": normalized["content_type"],
                     "body": normalized.get("body", "")[:2048],
                 }
-                ml_result = await self.call_ml(ml_payload)
+                ml_result = await self.call_ml(ml_payload, fingerprint)
                 ml_label = ml_result.get("label")
                 ml_conf = ml_result.get("confidence")
                 stage = "regex+ml"
@@ -143,7 +123,9 @@ class DecisionEngine:
                     request_id, client_ip, normalized, score, hits, stage, reason,
                     suspected_param, ml_label, ml_conf, headers_masked, recommendation_ids, decision
                 )
-                self.cache.set(fingerprint, (decision, ml_label, ml_conf, stage))
+                await self.run_state(self.cache.set, fingerprint, (
+                    decision, ml_label, ml_conf, stage, score, hits, suspected_param, recommendation_ids, reason
+                ))
                 return decision, log_entry, {"reason": reason}
                 
             except MLUnavailable as exc:
@@ -155,7 +137,9 @@ class DecisionEngine:
                     request_id, client_ip, normalized, score, hits, stage, reason,
                     suspected_param, ml_label, ml_conf, headers_masked, recommendation_ids, decision
                 )
-                self.cache.set(fingerprint, (decision, ml_label, ml_conf, stage))
+                await self.run_state(self.cache.set, fingerprint, (
+                    decision, ml_label, ml_conf, stage, score, hits, suspected_param, recommendation_ids, reason
+                ))
                 return decision, log_entry, {"reason": reason}
 
         decision = "allow"
@@ -163,7 +147,9 @@ class DecisionEngine:
             request_id, client_ip, normalized, score, hits, stage, "ok",
             suspected_param, ml_label, ml_conf, headers_masked, recommendation_ids, decision
         )
-        self.cache.set(fingerprint, (decision, ml_label, ml_conf, stage))
+        await self.run_state(self.cache.set, fingerprint, (
+            decision, ml_label, ml_conf, stage, score, hits, suspected_param, recommendation_ids, "ok"
+        ))
         return decision, log_entry, {}
 
     def _build_log(
@@ -205,7 +191,8 @@ class DecisionEngine:
             "body_len": normalized.get("body_len", 0),
         }
 
-    async def notify(self, decision: str, log_entry: dict[str, Any]) -> None:
+    def notify(self, decision: str, log_entry: dict[str, Any]) -> None:
+        """Ставит событие блокировки в очередь отправки; запрос не ждет бэкенд"""
         if decision != "block":
             return
         
@@ -224,11 +211,9 @@ class DecisionEngine:
         }
         if log_entry.get("regex_hits"):
             event["category"] = log_entry["regex_hits"][0].get("category")
+            event["rule_ids"] = [hit.get("id") for hit in log_entry["regex_hits"]]
         # Если ML определил категорию - используем её
         if log_entry.get("ml_label") and log_entry.get("ml_label") != "BENIGN":
             event["category"] = log_entry.get("ml_label")
         
-        try:
-            await send_event(event)
-        except Exception:
-            pass
+        self.alerts.submit(event)
@@ -1,8 +1,65 @@
 from __future__ import annotations
 
 import hashlib
+import os
+from typing import Callable, Dict, Iterable
 
+from .settings import settings
 
-def build_fingerprint(method: str, path: str, query: str, content_type: str, body: str) -> str:
-    canonical = "|".join([method.upper(), path, query, content_type, body])
-    return hashlib.sha256(canonical.encode()).hexdigest()
+try:
+    import xxhash
+except ImportError:  # xxhash - необязательная зависимость
+    xxhash = None
+
+Piece = bytes | memoryview
+FingerprintFunc = Callable[[Iterable[Piece]], str]
+
+# Ключ для blake2b: без явного FINGERPRINT_KEY генерируется на процесс,
+# тогда подобрать коллизию для отравления кэша снаружи нельзя
+_KEY = settings.fingerprint_key.encode()[:64] or os.urandom(32)
+
+
+def _feed(update: Callable[[Piece], None], pieces: Iterable[Piece]) -> None:
+    # Префикс длины делает разбиение на части однозначным (в отличие от join через "|")
+    for piece in pieces:
+        update(len(piece).to_bytes(4, "little"))
+        update(piece)
+
+
+def _sha256(pieces: Iterable[Piece]) -> str:
+    h = hashlib.sha256()
+    _feed(h.update, pieces)
+    return h.hexdigest()
+
+
+def _blake2b(pieces: Iterable[Piece]) -> str:
+    h = hashlib.blake2b(digest_size=16, key=_KEY)
+    _feed(h.update, pieces)
+    return h.hexdigest()
+
+
+def _xxh3(pieces: Iterable[Piece]) -> str:
+    h = xxhash.xxh3_128(seed=int.from_bytes(_KEY[:8], "little"))
+    _feed(h.update, pieces)
+    return h.hexdigest()
+
+
+FINGERPRINT_FUNCS: Dict[str, FingerprintFunc] = {
+    "sha256": _sha256,
+    "blake2b": _blake2b,
+}
+if xxhash is not None:
+    FINGERPRINT_FUNCS["xxh3"] = _xxh3
+
+
+def register_fingerprint(name: str, func: FingerprintFunc) -> None:
+    FINGERPRINT_FUNCS[name] = func
+
+
+def build_fingerprint(
+    method: str, path: str, query: str, content_type: str, body: str | Piece, extra: Iterable[Piece] = ()
+) -> str:
+    if isinstance(body, str):
+        body = body.encode()
+    func = FINGERPRINT_FUNCS.get(settings.fingerprint_algo, _sha256)
+    return func((method.upper().encode(), path.encode(), query.encode(), content_type.encode(), body, *extra))
@@ -1,32 +1,133 @@
 from __future__ import annotations
 
 import hashlib
+import hmac
 import json
+import os
+import sys
 from pathlib import Path
-from typing import Tuple
+from typing import List, Tuple
+
+GENESIS = "0" * 64
+
+
+def merkle_root(leaves: List[bytes]) -> bytes:
+    """Корень дерева sha256 по листьям; непарный узел поднимается на уровень выше без изменений"""
+    level = leaves
+    while len(level) > 1:
+        nxt = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0]
+
+
+def sign_checkpoint(key: str, head: str) -> str:
+    """HMAC-SHA256 головы цепочки для записи chain_checkpoint"""
+    return hmac.new(key.encode(), head.encode(), hashlib.sha256).hexdigest()
+
+
+def _last_entry_hash(path: Path, block_size: int = 64 * 1024) -> str | None:
+    """entry_hash последней полной записи файла, читая его с конца"""
+    if not path.exists():
+        return None
+    with path.open("rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        tail = b""
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            tail = f.read(end - start) + tail
+            end = start
+            # последняя строка может быть оборвана при сбое - берем последнюю разбираемую
+            for line in reversed(tail.split(b"\n")[1 if start else 0:]):
+                if not line.strip():
+                    continue
+                try:
+                    entry_hash = json.loads(line).get("entry_hash")
+                except ValueError:
+                    continue
+                if entry_hash:
+                    return entry_hash
+    return None
+
+
+def _truncate_torn_tail(path: Path, block_size: int = 64 * 1024) -> int:
+    """Обрезает оборванную при сбое последнюю строку до последнего перевода строки.
+
+    Иначе следующая запись приклеится к обрывку и обе строки не разберутся.
+    Возвращает число отрезанных байт.
+    """
+    if not path.exists():
+        return 0
+    with path.open("r+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            idx = f.read(end - start).rfind(b"\n")
+            if idx >= 0:
+                keep = start + idx + 1
+                break
+            end = start
+        else:
+            keep = 0
+        if keep < size:
+            f.truncate(keep)
+            print(f"[integrity_chain] truncated {size - keep} bytes of a torn record in {path}", file=sys.stderr)
+        return size - keep
 
 
 class IntegrityChain:
-    def __init__(self, state_path: Path) -> None:
+    """Цепочка хэшей журнала.
+
+    Состояние сохраняется не на каждую запись, а по checkpoint() (периодически
+    и при остановке). После сбоя prev_hash восстанавливается из хвоста
+    текущего лог-файла (или последнего ротированного), а файл состояния
+    используется, только если логов нет. Оборванная последняя строка
+    текущего файла при этом отрезается.
+    """
+
+    def __init__(self, state_path: Path, log_path: Path | None = None) -> None:
         self.state_path = state_path
-        self.prev_hash = self._load_state()
+        self.log_path = log_path
+        self.prev_hash = self._recover() or self._load_state()
+
+    def _recover(self) -> str | None:
+        if self.log_path is None:
+            return None
+        try:
+            _truncate_torn_tail(self.log_path)
+        except OSError as exc:
+            print(f"[integrity_chain] cannot repair {self.log_path}: {exc}", file=sys.stderr)
+        for path in (self.log_path, self.log_path.with_name(self.log_path.name + ".1")):
+            try:
+                entry_hash = _last_entry_hash(path)
+            except OSError:
+                continue
+            if entry_hash:
+                return entry_hash
+        return None
 
     def _load_state(self) -> str:
         if self.state_path.exists():
             try:
                 data = json.loads(self.state_path.read_text(encoding="utf-8"))
-                return data.get("prev_hash", "0" * 64)
+                return data.get("prev_hash", GENESIS)
             except Exception:
-                return "0" * 64
-        return "0" * 64
+                return GENESIS
+        return GENESIS
 
-    def _save_state(self) -> None:
+    def checkpoint(self) -> None:
         self.state_path.parent.mkdir(parents=True, exist_ok=True)
-        self.state_path.write_text(json.dumps({"prev_hash": self.prev_hash}), encoding="utf-8")
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        tmp.write_text(json.dumps({"prev_hash": self.prev_hash}), encoding="utf-8")
+        os.replace(tmp, self.state_path)
 
     def append(self, payload_bytes: bytes) -> Tuple[str, str]:
         entry_hash = hashlib.sha256(self.prev_hash.encode() + payload_bytes).hexdigest()
         prev = self.prev_hash
         self.prev_hash = entry_hash
-        self._save_state()
         return prev, entry_hash
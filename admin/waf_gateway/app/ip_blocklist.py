@@ -1,26 +1,144 @@
 from __future__ import annotations
 
+import asyncio
+import heapq
+import sys
 import time
-from typing import Dict
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 
+from .ip_trie import PrefixTrie, parse_address, parse_prefix
 from .settings import settings
 
 
+TRIE_REBUILD_MIN = 1024  # снятых префиксов, меньше которых trie не пересобирается
+
+
+def valid_items(prefixes: Iterable[Any]) -> Iterator[str]:
+    """Непустые строки фида без комментариев; не-строки пропускаются с сообщением"""
+    skipped = 0
+    for item in prefixes:
+        if not isinstance(item, str):
+            skipped += 1
+            continue
+        item = item.strip()
+        if item and not item.startswith("#"):
+            yield item
+    if skipped:
+        print(f"[ip_blocklist] bulk load skipped {skipped} non-string entries", file=sys.stderr)
+
+
 class IPBlocklist:
+    """Блокировки IP и подсетей (CIDR, IPv4/IPv6).
+
+    Отдельные адреса проверяются за O(1) по словарю, подсети - поиском по
+    бинарному trie за O(бит адреса). Истекшие записи снимает фоновая задача
+    по min-heap. Trie, в котором снятых префиксов больше, чем живых,
+    пересобирается из self.prefixes, чтобы память не росла от ротации фидов.
+    """
+
     def __init__(self) -> None:
         self.blocks: Dict[str, float] = {}
+        self.prefixes: Dict[str, float] = {}
+        self.tries = {32: PrefixTrie(32), 128: PrefixTrie(128)}
+        # (expire, ключ); устаревшие записи после повторного block/unblock пропускаются при разборе
+        self.heap: List[Tuple[float, str]] = []
 
     def block(self, ip: str, ttl: int | None = None) -> None:
         expire = time.time() + (ttl or settings.block_ttl_sec)
+        key = self._store(ip, expire)
+        heapq.heappush(self.heap, (expire, key))
+        if len(self.heap) > 2 * (len(self.blocks) + len(self.prefixes)) + 1024:
+            self._compact()
+
+    def bulk_load(self, prefixes: Iterable[str], ttl: int | None = None) -> int:
+        """Загрузка фида адресов/подсетей за один проход; heap перестраивается один раз"""
+        expire = time.time() + (ttl or settings.block_ttl_sec)
+        loaded = 0
+        for item in valid_items(prefixes):
+            self.heap.append((expire, self._store(item, expire)))
+            loaded += 1
+        heapq.heapify(self.heap)
+        return loaded
+
+    def _store(self, ip: str, expire: float) -> str:
+        if "/" in ip:
+            parsed = parse_prefix(ip)
+            if parsed is not None:
+                bits, value, prefix_len, key = parsed
+                if prefix_len < bits:
+                    self.tries[bits].insert(value, prefix_len, expire)
+                    self.prefixes[key] = expire
+                    return key
+                ip = key.split("/", 1)[0]
         self.blocks[ip] = expire
+        return ip
 
     def unblock(self, ip: str) -> None:
-        self.blocks.pop(ip, None)
+        if self.blocks.pop(ip, None) is not None:
+            return
+        parsed = parse_prefix(ip)
+        if parsed is None:
+            return
+        bits, value, prefix_len, key = parsed
+        if prefix_len == bits:
+            self.blocks.pop(key.split("/", 1)[0], None)
+        elif self.prefixes.pop(key, None) is not None:
+            trie = self.tries[bits]
+            trie.remove(value, prefix_len)
+            # узлы trie не удаляются по одному; trie из мусора пересобирается целиком
+            if trie.removed >= TRIE_REBUILD_MIN and trie.removed > trie.count:
+                self._rebuild(bits)
+
+    def _rebuild(self, bits: int) -> None:
+        trie = PrefixTrie(bits)
+        for key, expire in self.prefixes.items():
+            parsed = parse_prefix(key)
+            if parsed is not None and parsed[0] == bits:
+                trie.insert(parsed[1], parsed[2], expire)
+        self.tries[bits] = trie
+
+    def active(self) -> Dict[str, float]:
+        now = time.time()
+        result = {ip: exp for ip, exp in self.blocks.items() if exp > now}
+        result.update((net, exp) for net, exp in self.prefixes.items() if exp > now)
+        return result
 
     def is_blocked(self, ip: str) -> bool:
         now = time.time()
-        to_remove = [addr for addr, exp in self.blocks.items() if exp < now]
-        for addr in to_remove:
-            self.blocks.pop(addr, None)
         exp = self.blocks.get(ip)
-        return bool(exp and exp > now)
+        if exp is not None:
+            if exp > now:
+                return True
+            self.blocks.pop(ip, None)
+        if not self.prefixes:
+            return False
+        parsed = parse_address(ip)
+        if parsed is None:
+            return False
+        bits, value = parsed
+        return self.tries[bits].covers(value, now)
+
+    def purge_expired(self, limit: int | None = None) -> int:
+        now = time.time()
+        removed = 0
+        heap = self.heap
+        while heap and heap[0][0] <= now and (limit is None or removed < limit):
+            expire, key = heapq.heappop(heap)
+            if self.blocks.get(key) == expire:
+                del self.blocks[key]
+                removed += 1
+            elif self.prefixes.get(key) == expire:
+                self.unblock(key)
+                removed += 1
+        return removed
+
+    def _compact(self) -> None:
+        self.heap = [(exp, ip) for ip, exp in self.blocks.items()]
+        self.heap.extend((exp, net) for net, exp in self.prefixes.items())
+        heapq.heapify(self.heap)
+
+    async def run_expiry(self) -> None:
+        while True:
+            await asyncio.sleep(settings.blocklist_sweep_interval_sec)
+            while self.purge_expired(limit=settings.cache_sweep_batch) == settings.cache_sweep_batch:
+                await asyncio.sleep(0)
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import ipaddress
+import socket
+from array import array
+from typing import Iterable, Tuple
+
+
+def parse_address(ip: str) -> Tuple[int, int] | None:
+    """Адрес как (бит в адресе, целое); IPv4-mapped IPv6 сводится к IPv4"""
+    if ":" not in ip:
+        try:
+            return 32, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+        except OSError:
+            return None
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip.split("%", 1)[0]), "big")
+    except OSError:
+        return None
+    if value >> 32 == 0xFFFF:
+        return 32, value & 0xFFFFFFFF
+    return 128, value
+
+
+def parse_prefix(prefix: str) -> Tuple[int, int, int, str] | None:
+    """(бит в адресе, сеть как целое, длина префикса, каноническая запись) или None"""
+    addr, _, length = prefix.strip().partition("/")
+    if ":" not in addr and length.isdigit() and int(length) <= 32:
+        # быстрый путь для IPv4 без ipaddress: важно при загрузке больших фидов
+        parsed = parse_address(addr)
+        if parsed is None:
+            return None
+        prefix_len = int(length)
+        key = prefix_key(32, parsed[1], prefix_len)
+        return 32, parsed[1] & (((1 << prefix_len) - 1) << (32 - prefix_len)), prefix_len, key
+    try:
+        net = ipaddress.ip_network(prefix.strip(), strict=False)
+    except ValueError:
+        return None
+    if net.version == 6 and net.prefixlen >= 96 and net.network_address.ipv4_mapped:
+        net = ipaddress.ip_network(f"{net.network_address.ipv4_mapped}/{net.prefixlen - 96}")
+    bits = net.max_prefixlen
+    return bits, int(net.network_address), net.prefixlen, str(net)
+
+
+def prefix_key(bits: int, value: int, prefix_len: int) -> str:
+    """Каноническая запись сети, покрывающей адрес value, с длиной prefix_len"""
+    masked = value & (((1 << prefix_len) - 1) << (bits - prefix_len))
+    if bits == 32:
+        return f"{socket.inet_ntop(socket.AF_INET, masked.to_bytes(4, 'big'))}/{prefix_len}"
+    return str(ipaddress.IPv6Network((masked, prefix_len)))
+
+
+class PrefixTrie:
+    """Бинарный trie по битам адреса на массивах: 4+4+8 байт на узел.
+
+    Узел 0 - корень; 0 в массиве потомков означает отсутствие узла.
+    В expires у узла хранится срок блокировки префикса (0 - префикса нет).
+    remove() узлы не освобождает, а только считает снятые префиксы в removed:
+    владелец пересобирает trie, когда их накопится больше, чем живых.
+    """
+
+    def __init__(self, bits: int) -> None:
+        self.bits = bits
+        self.left = array("I", [0])
+        self.right = array("I", [0])
+        self.expires = array("d", [0.0])
+        self.count = 0
+        self.removed = 0
+
+    def insert(self, value: int, prefix_len: int, expire: float) -> None:
+        left, right = self.left, self.right
+        node = 0
+        for shift in range(self.bits - 1, self.bits - 1 - prefix_len, -1):
+            children = right if (value >> shift) & 1 else left
+            nxt = children[node]
+            if not nxt:
+                nxt = len(left)
+                left.append(0)
+                right.append(0)
+                self.expires.append(0.0)
+                children[node] = nxt
+            node = nxt
+        if not self.expires[node]:
+            self.count += 1
+        self.expires[node] = expire
+
+    def remove(self, value: int, prefix_len: int) -> None:
+        node = self._find(value, prefix_len)
+        if node is not None and self.expires[node]:
+            self.expires[node] = 0.0
+            self.count -= 1
+            self.removed += 1
+
+    def _find(self, value: int, prefix_len: int) -> int | None:
+        node = 0
+        for shift in range(self.bits - 1, self.bits - 1 - prefix_len, -1):
+            node = (self.right if (value >> shift) & 1 else self.left)[node]
+            if not node:
+                return None
+        return node
+
+    def longest_match(self, value: int, now: float) -> Tuple[int, float] | None:
+        """Самый длинный действующий префикс, покрывающий адрес: (длина, срок)"""
+        left, right, expires = self.left, self.right, self.expires
+        best = None
+        node = 0
+        if expires[0] > now:
+            best = (0, expires[0])
+        for depth, shift in enumerate(range(self.bits - 1, -1, -1), start=1):
+            node = (right if (value >> shift) & 1 else left)[node]
+            if not node:
+                break
+            if expires[node] > now:
+                best = (depth, expires[node])
+        return best
+
+    def covers(self, value: int, now: float) -> bool:
+        """Есть ли хоть один действующий префикс; выходит на первом же найденном"""
+        left, right, expires = self.left, self.right, self.expires
+        node = 0
+        if expires[0] > now:
+            return True
+        for shift in range(self.bits - 1, -1, -1):
+            node = (right if (value >> shift) & 1 else left)[node]
+            if not node:
+                return False
+            if expires[node] > now:
+                return True
+        return False
+
+    def bulk_insert(self, items: Iterable[Tuple[int, int, float]]) -> None:
+        for value, prefix_len, expire in items:
+            self.insert(value, prefix_len, expire)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Set
+
+import regex
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse  # type: ignore[no-redef]
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+if hasattr(sre_parse, "POSSESSIVE_REPEAT"):
+    _REPEATS.add(sre_parse.POSSESSIVE_REPEAT)
+# Утверждения нулевой ширины не разрывают последовательность литералов
+_ZERO_WIDTH = {sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT}
+
+
+def _ascii_fold_table() -> Dict[int, str]:
+    """Не-ASCII символы, которые regex.IGNORECASE считает равными ASCII-букве (İ, K, ſ)"""
+    chars = "".join(chr(c) for c in range(0x80, 0x10000) if not 0xD800 <= c < 0xE000)
+    table: Dict[int, str] = {}
+    for letter in "abcdefghijklmnopqrstuvwxyz":
+        for ch in regex.findall(f"(?i){letter}", chars):
+            table[ord(ch)] = letter
+    return table
+
+
+_ASCII_FOLD = _ascii_fold_table()
+
+
+def fold(text: str) -> str:
+    """Посимвольная простая свертка регистра, как у regex.IGNORECASE.
+
+    casefold() использовать нельзя: он делает полную свертку ("ß" -> "ss",
+    "İ" -> "i̇"), и префильтр расходится с правилом - это обход WAF.
+    """
+    if text.isascii():
+        return text.lower()
+    # после замены на ASCII lower() не меняет длину строки
+    return text.translate(_ASCII_FOLD).lower()
+
+
+def _better(candidate: Set[str], best: Set[str] | None) -> bool:
+    if best is None:
+        return True
+    cand_len = min(len(s) for s in candidate)
+    best_len = min(len(s) for s in best)
+    if cand_len != best_len:
+        return cand_len > best_len
+    return len(candidate) < len(best)
+
+
+def _required(seq: Iterable) -> Set[str] | None:
+    """Набор строк, хотя бы одна из которых обязана встретиться в совпадении"""
+    best: Set[str] | None = None
+    run: List[str] = []
+
+    def consider(candidate: Set[str] | None) -> None:
+        nonlocal best
+        if candidate and all(candidate) and _better(candidate, best):
+            best = candidate
+
+    for op, av in seq:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if op is sre_parse.IN and len(av) == 1 and av[0][0] is sre_parse.LITERAL:
+            run.append(chr(av[0][1]))
+            continue
+        if op in _ZERO_WIDTH:
+            continue
+        if run:
+            consider({"".join(run)})
+            run = []
+        if op is sre_parse.SUBPATTERN:
+            consider(_required(av[-1]))
+        elif op is sre_parse.BRANCH:
+            alternatives = [_required(alt) for alt in av[1]]
+            if all(alternatives):
+                consider(set().union(*alternatives))
+        elif op in _REPEATS and av[0] >= 1:
+            consider(_required(av[2]))
+    if run:
+        consider({"".join(run)})
+    return best
+
+
+def extract_literals(pattern: str) -> List[str] | None:
+    """Обязательные литералы шаблона после fold(); None, если выделить их не удалось"""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return None
+    required = _required(parsed)
+    if not required:
+        return None
+    return sorted({fold(lit) for lit in required})
+
+
+class LiteralIndex:
+    """Автомат Ахо-Корасик по литералам правил, без учета регистра"""
+
+    def __init__(self, literals: Iterable[str]) -> None:
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[Set[str]] = [set()]
+        for literal in set(literals):
+            self._add(literal)
+        self._build()
+
+    def _add(self, literal: str) -> None:
+        node = 0
+        for ch in literal:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(set())
+            node = nxt
+        self.out[node].add(literal)
+
+    def _build(self) -> None:
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] |= self.out[self.fail[nxt]]
+
+    def search(self, text: str) -> Set[str]:
+        """Все литералы, встретившиеся в тексте"""
+        found: Set[str] = set()
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for ch in fold(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, List
+
+from .settings import settings
+
+# Состояние процесса-воркера: модель и версия (mtime_ns файла), с которой она загружена
+_model: Dict[str, Any] | None = None
+_version: int | None = None
+_barrier = None
+
+
+def _init_worker(barrier) -> None:
+    global _barrier
+    _barrier = barrier
+
+
+def _load(path: str, version: int) -> bool:
+    global _model, _version
+    if _version == version:
+        return True
+    import joblib  # sklearn нужен только воркерам локального режима
+
+    try:
+        _model = joblib.load(path)
+        _version = version
+    except Exception as exc:  # noqa: BLE001
+        # файл могли переписывать в момент чтения - остаемся на прежней модели
+        print(f"[local_model] load failed: {exc}", file=sys.stderr)
+        if _model is None:
+            raise
+    return True
+
+
+def _warm(path: str, version: int, timeout: float) -> int:
+    """Загрузка модели при прогреве; барьер держит воркер занятым, пока каждый не загрузит свою"""
+    _load(path, version)
+    _barrier.wait(timeout)
+    return os.getpid()
+
+
+def _predict(path: str, version: int, texts: List[str]) -> List[Dict[str, Any]]:
+    _load(path, version)
+    vectorizer, clf = _model["vectorizer"], _model["clf"]
+    probs = clf.predict_proba(vectorizer.transform(texts))
+    idx = probs.argmax(axis=1)
+    return [
+        {"label": str(clf.classes_[i]), "confidence": float(row[i])}
+        for row, i in zip(probs, idx)
+    ]
+
+
+def request_text(payload: Dict[str, Any]) -> str:
+    """Тот же текст, что строит ai_analyzer для /analyze"""
+    return " ".join(
+        [
+            str(payload.get("method") or "").upper(),
+            payload.get("path") or "",
+            payload.get("query") or "",
+            payload.get("content_type") or "",
+            payload.get("body") or "",
+        ]
+    )
+
+
+class LocalModel:
+    """Инференс артефакта ai_analyzer (joblib) в пуле процессов шлюза.
+
+    Фоновая задача следит за mtime файла модели. Новая версия передается с
+    каждым вызовом, и воркер перечитывает модель при первом вызове с ней.
+    Каждую версию пул сначала прогревает: по заданию на воркер, и задания
+    ждут друг друга на барьере, так что каждое попадает в свой процесс.
+    Пока прогрев не закончен (при старте, после смены файла или
+    пересоздания пула), а также если файла нет или прогрев не удался,
+    ready() ложно, и MLClient идет в удаленный /analyze.
+    """
+
+    def __init__(self, path: Path, workers: int) -> None:
+        self.path = path
+        self.workers = workers
+        self.pool: ProcessPoolExecutor | None = None
+        self.barrier = None
+        self.version: int | None = None
+        self.warm_version: int | None = None  # версия, загруженная во всех воркерах
+        self.warming: asyncio.Task | None = None
+        self.reloads = 0
+        self.errors = 0
+
+    def start(self) -> None:
+        self._check()
+        ctx = multiprocessing.get_context("spawn")
+        self.barrier = ctx.Barrier(self.workers)
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=ctx, initializer=_init_worker, initargs=(self.barrier,)
+        )
+        self._ensure_warm()
+
+    def close(self) -> None:
+        if self.warming is not None:
+            self.warming.cancel()
+            self.warming = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.warm_version = None
+
+    def ready(self) -> bool:
+        return self.pool is not None and self.version is not None and self.warm_version == self.version
+
+    def _ensure_warm(self) -> None:
+        if self.pool is None or self.version is None or self.warm_version == self.version:
+            return
+        if self.warming is not None and not self.warming.done():
+            return
+        self.warming = asyncio.get_running_loop().create_task(self._warm(self.version))
+
+    async def _warm(self, version: int) -> None:
+        loop = asyncio.get_running_loop()
+        self.barrier.reset()  # прошлый неудачный прогрев мог оставить барьер сломанным
+        try:
+            await asyncio.gather(*(
+                loop.run_in_executor(self.pool, _warm, str(self.path), version, settings.ml_local_warmup_sec)
+                for _ in range(self.workers)
+            ))
+        except Exception as exc:  # noqa: BLE001
+            # следующая попытка - на очередной проверке файла в watch()
+            self.errors += 1
+            print(f"[local_model] warm-up of {self.path} failed: {exc!r}", file=sys.stderr)
+            return
+        self.warm_version = version
+        print(f"[local_model] model loaded in {self.workers} workers", file=sys.stderr)
+
+    def _check(self) -> None:
+        try:
+            version = self.path.stat().st_mtime_ns
+        except OSError:
+            version = None
+        if version != self.version:
+            if self.version is not None:
+                self.reloads += 1
+                print(f"[local_model] model file changed, reloading {self.path}", file=sys.stderr)
+            self.version = version
+
+    async def watch(self) -> None:
+        while True:
+            await asyncio.sleep(settings.ml_local_reload_sec)
+            self._check()
+            self._ensure_warm()
+
+    async def predict(self, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        texts = [request_text(p) for p in payloads]
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self.pool, _predict, str(self.path), self.version, texts),
+                settings.ml_timeout_ms / 1000,
+            )
+        except BrokenProcessPool:
+            # воркер упал - пересоздаем пул, текущий вызов уйдет в удаленный анализатор
+            self.errors += 1
+            self.close()
+            self.start()
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready(),
+            "version": self.version,
+            "reloads": self.reloads,
+            "errors": self.errors,
+        }
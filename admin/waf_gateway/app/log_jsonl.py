@@ -1,26 +1,259 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import fcntl
+import hashlib
 import os
+import queue
+import sys
+import threading
+import time
 from pathlib import Path
-from typing import Any
+from typing import IO, Any, Dict, List, Tuple
 
 import orjson
 
-from .integrity_chain import IntegrityChain
+from .integrity_chain import IntegrityChain, merkle_root, sign_checkpoint
 from .settings import settings
 
 
+MAX_LOG_SLOTS = 64
+
+
+def claim_log_files(log_path: Path, state_path: Path) -> Tuple[Path, Path, IO]:
+    """Файлы лога и состояния цепочки, в которые пишет только этот процесс.
+
+    Цепочка хэшей допускает одного писателя. При uvicorn --workers N каждый
+    воркер берет первый свободный слот по flock на <лог>.lock: слот 0 -
+    waf_events.jsonl и hash_state.json, слот k - waf_events.wk.jsonl и
+    hash_state.wk.json. Слоты стабильны между перезапусками, и каждый файл
+    проверяется verify_log_chain.py отдельно. Замок держится, пока открыт
+    возвращенный файл.
+    """
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    for slot in range(MAX_LOG_SLOTS):
+        if slot == 0:
+            log, state = log_path, state_path
+        else:
+            log = log_path.with_name(f"{log_path.stem}.w{slot}{log_path.suffix}")
+            state = state_path.with_name(f"{state_path.stem}.w{slot}{state_path.suffix}")
+        lock = open(log.with_name(log.name + ".lock"), "a")
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            continue
+        return log, state, lock
+    raise RuntimeError(f"no free log slot for {log_path} (more than {MAX_LOG_SLOTS} writers)")
+
+
 class JsonlLogger:
+    """JSONL-лог с цепочкой хэшей, который пишет фоновый поток.
+
+    write() только кладет событие в ограниченную очередь. Поток-писатель
+    забирает события пачками, считает хэши цепочки в порядке очереди, держит
+    файл открытым и делает fsync по интервалу или объему. При переполнении
+    очереди событие отбрасывается со счетчиком (log_overflow_policy=drop)
+    или запрос ждет места в очереди до log_block_timeout_ms (block), не
+    занимая event loop. Голова цепочки сдвигается, только если пачка
+    записана в файл.
+    """
+
     def __init__(self) -> None:
-        self.log_path = settings.log_path
-        self.chain = IntegrityChain(settings.hash_state_path)
+        self.log_path, state_path, self.slot_lock = claim_log_files(settings.log_path, settings.hash_state_path)
+        self.chain = IntegrityChain(state_path, self.log_path)
+        self.last_checkpoint = time.monotonic()
+        self.queue: "queue.Queue[Dict[str, Any] | None]" = queue.Queue(maxsize=settings.log_queue_size)
+        self.thread: threading.Thread | None = None
+        self.file = None
+        self.file_size = 0
+        self.unsynced_bytes = 0
+        self.last_fsync = time.monotonic()
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.since_checkpoint = 0
+        # после ротации файл начинается с chain_checkpoint: когда старые файлы удалены,
+        # verify_log_chain.py принимает начало цепочки только от GENESIS или подписанной точки
+        self.new_file = False
 
-    def _rotate(self) -> None:
-        if not self.log_path.exists():
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        """Дописывает очередь и закрывает файл (вызывается при остановке)"""
+        if self.thread is None:
             return
-        if self.log_path.stat().st_size < settings.log_rotate_bytes:
+        self.queue.put(None)
+        self.thread.join(timeout=10.0)
+        self.thread = None
+
+    async def write(self, event: dict[str, Any]) -> None:
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(event)
             return
+        except queue.Full:
+            if settings.log_overflow_policy != "block":
+                self.dropped += 1
+                return
+        # block: повторяем с растущей паузой, пока поток-писатель не освободит место
+        deadline = time.monotonic() + settings.log_block_timeout_ms / 1000
+        delay = 0.001
+        while (left := deadline - time.monotonic()) > 0:
+            await asyncio.sleep(min(delay, left))
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                delay *= 2
+        self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self.queue.get(timeout=settings.log_fsync_interval_sec)
+            except queue.Empty:
+                self._sync(force=False)
+                continue
+            batch: List[Dict[str, Any] | None] = [first]
+            while len(batch) < settings.log_batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            try:
+                self._write_batch([event for event in batch if event is not None])
+            except Exception as exc:  # noqa: BLE001
+                # поток-писатель не должен умирать: иначе очередь встанет, а close() прождет таймаут
+                print(f"[log_jsonl] write error: {exc!r}", file=sys.stderr)
+            if stop:
+                self._sync(force=True)
+                self.chain.checkpoint()
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def _write_batch(self, events: List[Dict[str, Any]]) -> None:
+        if not events:
+            return
+        items = self._serialize(events)
+        if not items:
+            return
+        head, since_checkpoint = self.chain.prev_hash, self.since_checkpoint
+        try:
+            lines = [self._checkpoint_line()] if self.new_file else []
+            if settings.log_merkle_batches:
+                lines += self._merkle_lines([payload for _, payload in items])
+            else:
+                for event, payload in items:
+                    prev_hash, entry_hash = self.chain.append(payload)
+                    # исходный dict не трогаем: его еще читает обработчик запроса
+                    record = {**event, "prev_hash": prev_hash, "entry_hash": entry_hash}
+                    lines.append(orjson.dumps(record, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE))
+            self.since_checkpoint += len(items)
+            if self.since_checkpoint >= settings.log_checkpoint_entries:
+                lines.append(self._checkpoint_line())
+                self.since_checkpoint = 0
+            data = b"".join(lines)
+            f = self._open()
+            try:
+                f.write(data)
+                f.flush()
+            except OSError:
+                self._discard_tail()
+                raise
+        except Exception:
+            # пачка не записана: голова цепочки остается на последней записанной
+            self.chain.prev_hash, self.since_checkpoint = head, since_checkpoint
+            raise
+        self.new_file = False
+        self.file_size += len(data)
+        self.unsynced_bytes += len(data)
+        self.written += len(items)
+        self.batches += 1
+        self._sync(force=False)
+        if self.file_size >= settings.log_rotate_bytes:
+            self._rotate()
+        if time.monotonic() - self.last_checkpoint >= settings.hash_checkpoint_interval_sec:
+            self.chain.checkpoint()
+            self.last_checkpoint = time.monotonic()
+
+    def _serialize(self, events: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], bytes]]:
+        """Пары (событие, JSON); событие, которое не сериализуется, отбрасывается со счетчиком, а не вся пачка"""
+        items = []
+        for event in events:
+            try:
+                items.append((event, orjson.dumps(event, option=orjson.OPT_SORT_KEYS)))
+            except orjson.JSONEncodeError as exc:
+                self.rejected += 1
+                print(f"[log_jsonl] rejected event {event.get('request_id')}: {exc}", file=sys.stderr)
+        return items
+
+    def _merkle_lines(self, lines: List[bytes]) -> List[bytes]:
+        """Записи пачки без хэшей плюс одна запись merkle_batch, которая входит в цепочку.
+
+        Каждая запись сериализуется один раз; лист дерева - sha256 строки записи.
+        """
+        root = merkle_root([hashlib.sha256(line).digest() for line in lines]).hex()
+        batch = {"type": "merkle_batch", "count": len(lines), "merkle_root": root}
+        prev_hash, entry_hash = self.chain.append(orjson.dumps(batch, option=orjson.OPT_SORT_KEYS))
+        batch.update(prev_hash=prev_hash, entry_hash=entry_hash)
+        lines.append(orjson.dumps(batch, option=orjson.OPT_SORT_KEYS))
+        return [line + b"\n" for line in lines]
+
+    def _checkpoint_line(self) -> bytes:
+        """Запись chain_checkpoint после целой пачки: с нее сегмент файла проверяется независимо"""
+        record: Dict[str, Any] = {"type": "chain_checkpoint"}
+        if settings.log_checkpoint_key:
+            record["sig"] = sign_checkpoint(settings.log_checkpoint_key, self.chain.prev_hash)
+        prev_hash, entry_hash = self.chain.append(orjson.dumps(record, option=orjson.OPT_SORT_KEYS))
+        record.update(prev_hash=prev_hash, entry_hash=entry_hash)
+        return orjson.dumps(record, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+
+    def _open(self):
+        if self.file is None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.log_path, "ab")
+            self.file_size = self.file.tell()
+        return self.file
+
+    def _discard_tail(self) -> None:
+        """Закрывает файл и обрезает его до последней целиком записанной пачки"""
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+        try:
+            os.truncate(self.log_path, self.file_size)
+        except OSError as exc:
+            print(f"[log_jsonl] truncate error: {exc}", file=sys.stderr)
+
+    def _sync(self, force: bool) -> None:
+        if self.file is None or not self.unsynced_bytes:
+            return
+        due = time.monotonic() - self.last_fsync >= settings.log_fsync_interval_sec
+        if force or due or self.unsynced_bytes >= settings.log_fsync_bytes:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced_bytes = 0
+            self.last_fsync = time.monotonic()
+            self.fsyncs += 1
+
+    def _rotate(self) -> None:
+        self._sync(force=True)
+        self.file.close()
+        self.file = None
         for idx in reversed(range(1, settings.log_rotate_keep + 1)):
             src = self.log_path.with_name(self.log_path.name + f".{idx}")
             dst = self.log_path.with_name(self.log_path.name + f".{idx+1}")
@@ -30,17 +263,19 @@ class JsonlLogger:
                 else:
                     src.rename(dst)
         self.log_path.rename(self.log_path.with_name(self.log_path.name + ".1"))
+        self.new_file = True
 
-    def write(self, event: dict[str, Any]) -> None:
-        payload = orjson.dumps(event, option=orjson.OPT_SORT_KEYS)
-        prev_hash, entry_hash = self.chain.append(payload)
-        event["prev_hash"] = prev_hash
-        event["entry_hash"] = entry_hash
-        line = orjson.dumps(event, option=orjson.OPT_SORT_KEYS).decode()
-        self.log_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(self.log_path, "a", encoding="utf-8") as f:
-            f.write(line + "\n")
-        self._rotate()
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "alive": self.thread is not None and self.thread.is_alive(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "fsyncs": self.fsyncs,
+            "path": str(self.log_path),
+        }
 
 
 def get_logger() -> JsonlLogger:
@@ -8,16 +8,35 @@ from fastapi.responses import JSONResponse
 from .command_polling import CommandPoller
 from .decision_engine import DecisionEngine
 from .proxy import ProxyService
+from .settings import settings
+from .shared_state import run_maintenance
 
 app = FastAPI(title="WAF Gateway")
 engine = DecisionEngine()
 proxy_service = ProxyService(engine)
-poller = CommandPoller(engine.regex_engine, engine.blocklist)
+poller = CommandPoller(engine.regex_engine, engine.blocklist, engine.run_state)
 
 
 @app.on_event("startup")
 async def startup() -> None:
+    proxy_service.upstream.start()
+    engine.ml.start()
+    engine.alerts.start()
+    engine.logger.start()
     asyncio.create_task(poller.run_forever())
+    asyncio.create_task(engine.cache.run_expiry())
+    if settings.state_backend == "sqlite":
+        asyncio.create_task(run_maintenance(engine.rate_limiter, engine.blocklist))
+    else:
+        asyncio.create_task(engine.blocklist.run_expiry())
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    await proxy_service.upstream.close()
+    await engine.ml.close()
+    await engine.alerts.close()
+    await asyncio.to_thread(engine.logger.close)
 
 
 @app.get("/health")
@@ -25,27 +44,53 @@ async def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/waf/metrics")
+async def get_metrics() -> dict:
+    """Метрики пула соединений к upstream, префильтра regex, клиента ML, очереди алертов, кэша решений, rate limit и лога"""
+    return {
+        "upstream_pool": proxy_service.upstream.stats(),
+        "ml_client": engine.ml.stats(),
+        "alerts": engine.alerts.stats(),
+        "regex_prefilter": engine.regex_engine.prefilter_stats(),
+        "decision_cache": await engine.run_state(engine.cache.stats),
+        "rate_limiter": await engine.run_state(engine.rate_limiter.stats),
+        "logger": engine.logger.stats(),
+    }
+
+
 @app.get("/waf/blocklist")
 async def get_blocklist() -> dict:
     """Показать заблокированные IP"""
     import time
     now = time.time()
-    blocks = {ip: int(exp - now) for ip, exp in engine.blocklist.blocks.items() if exp > now}
+    active = await engine.run_state(engine.blocklist.active)
+    blocks = {ip: int(exp - now) for ip, exp in active.items()}
     return {"blocked_ips": blocks}
 
 
-@app.post("/waf/block/{ip}")
+@app.post("/waf/blocklist/bulk")
+async def bulk_block(body: dict) -> dict:
+    """Загрузить список адресов/подсетей: {"prefixes": [...], "ttl": 3600}"""
+    prefixes = body.get("prefixes", [])
+    if not isinstance(prefixes, list):
+        return JSONResponse(status_code=400, content={"error": "prefixes must be a list"})
+    loaded = await engine.run_state(engine.blocklist.bulk_load, prefixes, body.get("ttl"))
+    print(f"[WAF] Bulk-blocked {loaded} prefixes", file=sys.stderr)
+    return {"status": "blocked", "loaded": loaded}
+
+
+@app.post("/waf/block/{ip:path}")
 async def block_ip(ip: str, ttl: int = 3600) -> dict:
-    """Заблокировать IP"""
-    engine.blocklist.block(ip, ttl)
+    """Заблокировать IP или подсеть (CIDR)"""
+    await engine.run_state(engine.blocklist.block, ip, ttl)
     print(f"[WAF] Blocked IP: {ip} for {ttl}s", file=sys.stderr)
     return {"status": "blocked", "ip": ip, "ttl": ttl}
 
 
-@app.post("/waf/unblock/{ip}")
+@app.post("/waf/unblock/{ip:path}")
 async def unblock_ip(ip: str) -> dict:
-    """Разблокировать IP"""
-    engine.blocklist.unblock(ip)
+    """Разблокировать IP или подсеть (CIDR)"""
+    await engine.run_state(engine.blocklist.unblock, ip)
     print(f"[WAF] Unblocked IP: {ip}", file=sys.stderr)
     return {"status": "unblocked", "ip": ip}
 
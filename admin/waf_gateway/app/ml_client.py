@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import httpx
+
+from .local_model import LocalModel
+from .settings import settings
+
+
+class MLUnavailable(Exception):
+    pass
+
+
+class MLClient:
+    """Клиент ai_analyzer с объединением запросов.
+
+    Одинаковые запросы (по отпечатку), которые уже ждут ответа, не
+    отправляются повторно: все ждут один результат (single-flight).
+    Остальные копятся в пачку для /analyze/batch. Если свободен слот из
+    ml_concurrency, пачка уходит сразу, иначе ждет до ml_batch_max_items
+    элементов или ml_batch_max_wait_ms. Соединения берутся из одного пула
+    httpx. Если анализатор не знает /analyze/batch (404), клиент переходит на
+    поштучные POST /analyze.
+
+    При ml_mode=local пачки считаются моделью в пуле процессов шлюза
+    (LocalModel), а удаленный анализатор остается запасным путем.
+    """
+
+    def __init__(self) -> None:
+        self.client: httpx.AsyncClient | None = None
+        self.batch_url = settings.ai_batch_url or settings.ai_url.rstrip("/") + "/batch"
+        self.batch_supported = settings.ml_batching
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.pending: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self.wakeup = asyncio.Event()
+        self.slots = asyncio.Semaphore(settings.ml_concurrency)
+        self.task: asyncio.Task | None = None
+        self.running: set = set()
+        self.local = LocalModel(settings.ml_model_path, settings.ml_local_workers) if settings.ml_mode == "local" else None
+        self.local_items = 0
+        self.failure_count = 0
+        self.circuit_open_until = 0.0
+        self.requests = 0
+        self.items = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=settings.ml_timeout_ms / 1000,
+                limits=httpx.Limits(
+                    max_connections=settings.ml_concurrency,
+                    max_keepalive_connections=settings.ml_concurrency,
+                ),
+            )
+        return self.client
+
+    def start(self) -> None:
+        if self.local is not None:
+            self.local.start()
+            asyncio.create_task(self.local.watch())
+
+    async def close(self) -> None:
+        if self.local is not None:
+            self.local.close()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _circuit_open(self) -> bool:
+        return time.time() < self.circuit_open_until
+
+    def _record_failure(self) -> None:
+        self.failure_count += 1
+        if self.failure_count >= settings.circuit_failures:
+            self.circuit_open_until = time.time() + settings.circuit_cooldown_sec
+            self.failure_count = 0
+
+    def _record_success(self) -> None:
+        self.failure_count = 0
+
+    async def analyze(self, payload: Dict[str, Any], key: str | None = None) -> Dict[str, Any]:
+        if self._circuit_open():
+            raise MLUnavailable("circuit open")
+        if key is not None and key in self.inflight:
+            self.coalesced += 1
+            return await asyncio.shield(self.inflight[key])
+        if len(self.pending) >= settings.ml_queue_limit:
+            self.rejected += 1
+            raise MLUnavailable("queue full")
+
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(lambda f: self._done(key, f))
+        if key is not None:
+            self.inflight[key] = fut
+        self.pending.append((payload, fut))
+        self.wakeup.set()
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return await asyncio.shield(fut)
+
+    def _done(self, key: str | None, fut: asyncio.Future) -> None:
+        if key is not None:
+            self.inflight.pop(key, None)
+        if not fut.cancelled():
+            fut.exception()  # все ожидающие могли уйти по таймауту - не оставляем ошибку непрочитанной
+
+    async def _run(self) -> None:
+        while True:
+            await self.wakeup.wait()
+            await self.slots.acquire()
+            batching = self.batch_supported or (self.local is not None and self.local.ready())
+            max_items = settings.ml_batch_max_items if batching else 1
+            # слот свободен не сразу - за это время пачка успела накопиться
+            if batching and len(self.pending) < max_items and self.running:
+                await asyncio.sleep(settings.ml_batch_max_wait_ms / 1000)
+            batch, self.pending = self.pending[:max_items], self.pending[max_items:]
+            if not self.pending:
+                self.wakeup.clear()
+            if not batch:
+                self.slots.release()
+                continue
+            task = asyncio.create_task(self._send(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _send(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> None:
+        try:
+            results = await self._post(batch)
+        except MLUnavailable as exc:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        finally:
+            self.slots.release()
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def _post(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]) -> List[Dict[str, Any]]:
+        if self.local is not None and self.local.ready():
+            try:
+                results = await self.local.predict([payload for payload, _ in batch])
+                self.local_items += len(batch)
+                return results
+            except Exception as exc:  # noqa: BLE001
+                print(f"[ml_client] local inference failed, using remote: {exc!r}", file=sys.stderr)
+        client = self._get_client()
+        self.requests += 1
+        self.items += len(batch)
+        try:
+            if self.batch_supported and len(batch) > 1:
+                resp = await client.post(self.batch_url, json={"items": [payload for payload, _ in batch]})
+                if resp.status_code == 404:
+                    # старый ai_analyzer без /analyze/batch
+                    self.batch_supported = False
+                    return [await self._post_one(client, payload) for payload, _ in batch]
+                if resp.status_code != 200:
+                    self._record_failure()
+                    raise MLUnavailable(f"status {resp.status_code}")
+                self._record_success()
+                return resp.json()["results"]
+            return [await self._post_one(client, batch[0][0])]
+        except (httpx.HTTPError, asyncio.TimeoutError, KeyError, ValueError) as exc:
+            self._record_failure()
+            raise MLUnavailable(str(exc))
+
+    async def _post_one(self, client: httpx.AsyncClient, payload: Dict[str, Any]) -> Dict[str, Any]:
+        resp = await client.post(settings.ai_url, json=payload)
+        if resp.status_code != 200:
+            self._record_failure()
+            raise MLUnavailable(f"status {resp.status_code}")
+        self._record_success()
+        return resp.json()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "items": self.items,
+            "avg_batch": round(self.items / self.requests, 2) if self.requests else 0.0,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "pending": len(self.pending),
+            "inflight_keys": len(self.inflight),
+            "batch_supported": self.batch_supported,
+            "circuit_open": self._circuit_open(),
+            "local_items": self.local_items,
+            "local": self.local.stats() if self.local is not None else None,
+        }
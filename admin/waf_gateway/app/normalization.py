@@ -51,6 +51,10 @@ async def normalize_request(request: Request, body_bytes: bytes | None = None) -
     norm_path = normalize_path(path_decoded)
     canon_query, params = canonical_query(request.url.query)
     headers = {k.lower(): v for k, v in request.headers.items()}
+    body_len = len(body_bytes)
+    if settings.proxy_streaming and headers.get("content-length", "").isdigit():
+        # в потоковом режиме сюда приходит только окно инспекции
+        body_len = int(headers["content-length"])
     return {
         "method": request.method.upper(),
         "path": norm_path,
@@ -58,7 +62,7 @@ async def normalize_request(request: Request, body_bytes: bytes | None = None) -
         "params": params,
         "body": normalized_body,
         "body_bytes": body_bytes,
-        "body_len": len(body_bytes),
+        "body_len": body_len,
         "headers": headers,
         "content_type": request.headers.get("content-type", ""),
     }
@@ -1,32 +1,39 @@
 from __future__ import annotations
 
 import time
-from typing import Any
+from typing import Any, AsyncIterator, Tuple
 
 import httpx
 from fastapi import Request, Response
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 from .decision_engine import DecisionEngine
 from .settings import settings
+from .upstream_pool import UpstreamPool
 
 
 class ProxyService:
     def __init__(self, engine: DecisionEngine) -> None:
         self.engine = engine
+        self.upstream = UpstreamPool()
 
     async def handle(self, request: Request) -> Response:
         client_ip = request.client.host if request.client else "unknown"
-        body = await request.body()
         start = time.time()
+        if settings.proxy_streaming:
+            body, content = await self._read_prefix(request)
+        else:
+            body = await request.body()
+            content = body
         decision, log_entry, extra = await self.engine.evaluate(request, client_ip, body)
         headers = {"X-Request-Id": log_entry["request_id"]}
         
         if decision == "block":
             log_entry["status_code"] = 403
             log_entry["latency_ms"] = int((time.time() - start) * 1000)
-            self.engine.logger.write(log_entry)
-            await self.engine.notify(decision, log_entry)
+            await self.engine.logger.write(log_entry)
+            self.engine.notify(decision, log_entry)
             return JSONResponse(
                 status_code=403,
                 content={"request_id": log_entry["request_id"], "decision": "block", "reason": extra.get("reason")},
@@ -36,41 +43,66 @@ class ProxyService:
         if decision == "rate_limit":
             log_entry["status_code"] = 429
             log_entry["latency_ms"] = int((time.time() - start) * 1000)
-            self.engine.logger.write(log_entry)
-            await self.engine.notify(decision, log_entry)
+            await self.engine.logger.write(log_entry)
+            self.engine.notify(decision, log_entry)
             return JSONResponse(
                 status_code=429,
                 content={"request_id": log_entry["request_id"], "decision": "rate_limit"},
                 headers=headers,
             )
 
+        upstream = self.upstream.get(settings.upstream_url.rstrip("/"))
+        fwd_headers = {k: v for k, v in request.headers.items() if k.lower() != "host"}
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                fwd_headers = {k: v for k, v in request.headers.items() if k.lower() != "host"}
-                upstream_resp = await client.request(
+            if settings.proxy_streaming:
+                upstream_resp = await upstream.open_stream(
                     request.method,
                     self._compose_upstream_url(request),
-                    content=body,
+                    content=content,
                     headers=fwd_headers,
                 )
-        except httpx.HTTPError:
-            log_entry["status_code"] = 502
+            else:
+                upstream_resp = await upstream.request(
+                    request.method,
+                    self._compose_upstream_url(request),
+                    content=content,
+                    headers=fwd_headers,
+                )
+        except httpx.HTTPError as exc:
+            # все слоты пула заняты дольше upstream_pool_timeout_sec - перегрузка, а не отказ upstream
+            status = 503 if isinstance(exc, httpx.PoolTimeout) else 502
+            log_entry["status_code"] = status
             log_entry["latency_ms"] = int((time.time() - start) * 1000)
-            self.engine.logger.write(log_entry)
+            await self.engine.logger.write(log_entry)
             return JSONResponse(
-                status_code=502,
+                status_code=status,
                 content={"request_id": log_entry["request_id"], "error": "upstream unavailable"},
                 headers=headers,
             )
 
-        log_entry["status_code"] = upstream_resp.status_code
-        log_entry["latency_ms"] = int((time.time() - start) * 1000)
-        self.engine.logger.write(log_entry)
-        
-        hop_by_hop = {"connection", "keep-alive", "transfer-encoding", "te", "trailers", "upgrade"}
-        resp_headers = {k: v for k, v in upstream_resp.headers.items() if k.lower() not in hop_by_hop}
-        resp_headers.update(headers)
-        
+        try:
+            log_entry["status_code"] = upstream_resp.status_code
+            log_entry["latency_ms"] = int((time.time() - start) * 1000)
+            await self.engine.logger.write(log_entry)
+
+            hop_by_hop = {"connection", "keep-alive", "transfer-encoding", "te", "trailers", "upgrade"}
+            resp_headers = {k: v for k, v in upstream_resp.headers.items() if k.lower() not in hop_by_hop}
+            resp_headers.update(headers)
+        except BaseException:
+            if settings.proxy_streaming:
+                await upstream.close_stream(upstream_resp)
+            raise
+
+        if settings.proxy_streaming:
+            # aiter_raw отдает тело как есть, поэтому content-encoding/length остаются верными.
+            # Слот закрывает сам генератор; фоновая задача - если тело так и не начали читать
+            return StreamingResponse(
+                upstream.stream_body(upstream_resp),
+                status_code=upstream_resp.status_code,
+                headers=resp_headers,
+                background=BackgroundTask(upstream.close_stream, upstream_resp),
+            )
+
         return Response(
             content=upstream_resp.content,
             status_code=upstream_resp.status_code,
@@ -78,6 +110,36 @@ class ProxyService:
             media_type=upstream_resp.headers.get("content-type"),
         )
 
+    async def _read_prefix(self, request: Request) -> Tuple[bytes, AsyncIterator[bytes]]:
+        """Читает из тела только окно инспекции, остальное отдается потоком в upstream"""
+        stream = request.stream().__aiter__()
+        chunks: list[bytes] = []
+        size = 0
+        try:
+            async for chunk in stream:
+                if not chunk:
+                    continue
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= settings.body_truncate:
+                    break
+        except BaseException:
+            await stream.aclose()
+            raise
+        prefix = b"".join(chunks)
+
+        async def body_iter() -> AsyncIterator[bytes]:
+            try:
+                if prefix:
+                    yield prefix
+                async for chunk in stream:
+                    if chunk:
+                        yield chunk
+            finally:
+                await stream.aclose()
+
+        return prefix[: settings.body_truncate], body_iter()
+
     def _compose_upstream_url(self, request: Request) -> str:
         base = settings.upstream_url.rstrip("/")
         path = request.url.path
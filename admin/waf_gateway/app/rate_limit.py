@@ -1,33 +1,100 @@
 from __future__ import annotations
 
+import threading
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Dict
+from typing import Any, Dict, List
 
 from .settings import settings
 
 
-@dataclass
+@dataclass(slots=True)
 class Bucket:
     tokens: float
     last_ts: float
 
 
+def limiter_key(client_ip: str, normalized: dict) -> str:
+    """Ключ бакета согласно rate_limit_key"""
+    mode = settings.rate_limit_key
+    if mode == "ip_path":
+        return f"{client_ip}|{normalized.get('path', '')}"
+    if mode == "api_key":
+        api_key = normalized.get("headers", {}).get(settings.rate_limit_api_key_header.lower())
+        if api_key and api_key in settings.rate_limit_api_keys:
+            return f"key|{api_key}"
+    return client_ip
+
+
+class Shard:
+    """Часть таблицы бакетов со своим замком; бакеты хранятся в порядке последнего обращения"""
+
+    __slots__ = ("buckets", "lock", "max_keys")
+
+    def __init__(self, max_keys: int) -> None:
+        self.buckets: "OrderedDict[str, Bucket]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_keys = max_keys
+
+
 class RateLimiter:
+    """Token bucket по ключу клиента с ограниченной памятью.
+
+    Бакет, который успел полностью восстановиться, ничем не отличается от
+    нового, поэтому такие бакеты удаляются без потери состояния. Если ключей
+    больше бюджета rate_limit_max_keys, вытесняются самые давно неактивные.
+    """
+
     def __init__(self) -> None:
-        self.buckets: Dict[str, Bucket] = {}
+        self.shard_count = max(1, settings.rate_limit_shards)
+        per_shard = max(1, settings.rate_limit_max_keys // self.shard_count)
+        self.shards: List[Shard] = [Shard(per_shard) for _ in range(self.shard_count)]
+        self.evicted_idle = 0
+        self.evicted_forced = 0
 
-    def allow(self, ip: str, suspicious: bool = False) -> bool:
+    def allow(self, key: str, suspicious: bool = False) -> bool:
         burst = settings.rate_limit_burst_suspicious if suspicious else settings.rate_limit_burst
         refill = settings.rate_limit_refill_per_sec
         now = time.time()
-        bucket = self.buckets.get(ip, Bucket(tokens=burst, last_ts=now))
-        elapsed = now - bucket.last_ts
-        bucket.tokens = min(burst, bucket.tokens + elapsed * refill)
-        bucket.last_ts = now
-        if bucket.tokens < 1:
-            self.buckets[ip] = bucket
-            return False
-        bucket.tokens -= 1
-        self.buckets[ip] = bucket
-        return True
+        shard = self.shards[hash(key) % self.shard_count]
+        with shard.lock:
+            buckets = shard.buckets
+            bucket = buckets.get(key)
+            if bucket is None:
+                self._evict(shard, now, burst, refill)
+                bucket = Bucket(tokens=burst, last_ts=now)
+                buckets[key] = bucket
+            else:
+                buckets.move_to_end(key)
+            elapsed = now - bucket.last_ts
+            bucket.tokens = min(burst, bucket.tokens + elapsed * refill)
+            bucket.last_ts = now
+            if bucket.tokens < 1:
+                return False
+            bucket.tokens -= 1
+            return True
+
+    def _evict(self, shard: Shard, now: float, burst: int, refill: float) -> None:
+        buckets = shard.buckets
+        # амортизированно: пара восстановившихся бакетов с головы на каждую вставку
+        for _ in range(2):
+            if not buckets:
+                return
+            key, bucket = next(iter(buckets.items()))
+            if bucket.tokens + (now - bucket.last_ts) * refill < burst:
+                break
+            del buckets[key]
+            self.evicted_idle += 1
+        while len(buckets) >= shard.max_keys:
+            buckets.popitem(last=False)
+            self.evicted_forced += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracked_keys": sum(len(shard.buckets) for shard in self.shards),
+            "max_keys": settings.rate_limit_max_keys,
+            "shards": self.shard_count,
+            "evicted_idle": self.evicted_idle,
+            "evicted_forced": self.evicted_forced,
+        }
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import hashlib
+
 import regex
 import yaml
 from pathlib import Path
 from typing import Any, Dict, List, Tuple
 
+from .literal_index import LiteralIndex, extract_literals
+from .settings import settings
+
 RULES_FILE = Path(__file__).parent / "rules.yaml"
+BACKREF_RE = regex.compile(r"\\[1-9]|\(\?P=|\\g<")
 
 
 class RegexRule:
@@ -16,22 +22,207 @@ class RegexRule:
         self.description = data.get("description", "")
         self.target = data.get("target", "query")
         self.weight = int(data.get("weight", 1))
+        self.source = data["pattern"]
+        self.ignore_case = bool(flags)
         self.pattern = regex.compile(data["pattern"], flags=flags)
+        self.literals = extract_literals(self.source)
+
+    def gate_source(self) -> str | None:
+        """Шаблон для общего матчера группы; None, если правило нельзя объединять"""
+        source = self.source
+        ignore_case = self.ignore_case
+        if source.startswith("(?i)"):
+            source = source[4:]
+            ignore_case = True
+        # обратные ссылки и inline-флаги ломаются при склейке в одну альтернацию
+        if BACKREF_RE.search(source) or "(?" in source.replace("(?:", ""):
+            return None
+        wrapped = f"(?i:{source})" if ignore_case else f"(?:{source})"
+        try:
+            regex.compile(wrapped)
+        except regex.error:
+            return None
+        return wrapped
+
+
+class CompiledRuleSet:
+    """Правила, сгруппированные по target, с префильтром и общим матчером на группу.
+
+    Сначала автомат по обязательным литералам правил отбирает правила, которые
+    вообще могут сработать на строке. Затем общий матчер (альтернация всех
+    правил группы) сканирует строку один раз: если он не нашел совпадений,
+    ни одно правило группы не сработает и отдельные regex не запускаются.
+    """
+
+    def __init__(self, rules: List[RegexRule]) -> None:
+        self.rules = rules
+        self.gated: set[int] = set()
+        self.gates: Dict[str, regex.Pattern] = {}
+        sources: Dict[str, List[str]] = {}
+        for idx, rule in enumerate(rules):
+            gate = rule.gate_source()
+            if gate is None:
+                continue
+            sources.setdefault(rule.target, []).append(gate)
+            self.gated.add(idx)
+        for target, parts in sources.items():
+            self.gates[target] = regex.compile("|".join(parts))
+
+        # правила без выделенных литералов проверяются всегда
+        self.unfiltered: set[int] = set()
+        self.by_literal: Dict[str, set[int]] = {}
+        for idx, rule in enumerate(rules):
+            if rule.literals is None:
+                self.unfiltered.add(idx)
+                continue
+            for literal in rule.literals:
+                self.by_literal.setdefault(literal, set()).add(idx)
+        self.index = LiteralIndex(self.by_literal)
+
+    def candidate_rules(self, text: str) -> set[int]:
+        active = set(self.unfiltered)
+        for literal in self.index.search(text):
+            active |= self.by_literal[literal]
+        return active
+
+    def _gate(self, target: str, text: str) -> bool:
+        gate = self.gates.get(target)
+        if gate is None:
+            return True
+        try:
+            return gate.search(text, timeout=0.01) is not None
+        except regex.TimeoutError:
+            return True
 
 
 class RegexEngine:
     def __init__(self) -> None:
         self.rules: List[RegexRule] = []
+        self.compiled: CompiledRuleSet | None = None
+        self.rules_digest = b""
+        self.uses_headers = False
+        self.prefilter_requests = 0
+        self.prefilter_clean = 0
+        self.prefilter_checks = 0
+        self.prefilter_skipped = 0
         self.load_rules()
 
     def load_rules(self) -> None:
         data = yaml.safe_load(RULES_FILE.read_text(encoding="utf-8"))
         self.rules = [RegexRule(item) for item in data]
+        self.compile()
+
+    def compile(self) -> None:
+        self.compiled = CompiledRuleSet(self.rules)
+        # версия набора правил для ключа кэша решений: одинакова во всех воркерах с теми же правилами
+        h = hashlib.sha256()
+        for rule in self.rules:
+            h.update(f"{rule.id}\0{rule.target}\0{rule.ignore_case}\0{rule.weight}\0{rule.source}\0".encode())
+        self.rules_digest = h.digest()
+        self.uses_headers = any(rule.target == "headers" for rule in self.rules)
+
+    def cache_inputs(self, req: dict) -> List[bytes]:
+        """Что кроме запроса влияет на решение regex: набор правил и, если есть такие правила, заголовки"""
+        inputs = [self.rules_digest]
+        if self.uses_headers:
+            inputs.append(self._select_target("headers", req).encode())
+        return inputs
+
+    def add_rule(self, rule: RegexRule) -> None:
+        self.rules.append(rule)
+        self.compile()
 
     def reload(self) -> None:
         self.load_rules()
 
+    def prefilter_stats(self) -> Dict[str, Any]:
+        checks = self.prefilter_checks
+        return {
+            "requests": self.prefilter_requests,
+            "requests_clean": self.prefilter_clean,
+            "rule_checks": checks,
+            "rule_checks_skipped": self.prefilter_skipped,
+            "hit_ratio": round((checks - self.prefilter_skipped) / checks, 4) if checks else 0.0,
+        }
+
     def analyze(self, req: dict) -> Tuple[int, List[dict], str]:
+        if settings.regex_compiled and self.compiled is not None:
+            return self.analyze_compiled(req)
+        return self.analyze_simple(req)
+
+    def analyze_compiled(self, req: dict) -> Tuple[int, List[dict], str]:
+        """То же, что analyze_simple, но с префильтром по литералам и общим матчером на target"""
+        compiled = self.compiled
+        all_rules = set(range(len(compiled.rules)))
+        # target -> [[строка, имя параметра или None, правила-кандидаты, результат общего матчера]]
+        candidates: Dict[str, List[list]] = {}
+        any_active = False
+        for target in {rule.target for rule in compiled.rules}:
+            items: List[Tuple[str, str | None]] = []
+            if target == "query":
+                for key, values in req.get("params", {}).items():
+                    for v in values:
+                        items.append((f"{key}={v}", key))
+            items.append((self._select_target(target, req), None))
+            entries = []
+            for text, key in items:
+                active = compiled.candidate_rules(text) if settings.regex_prefilter else all_rules
+                any_active = any_active or bool(active)
+                entries.append([text, key, active, None])
+            candidates[target] = entries
+
+        checks = sum(len(candidates[rule.target]) for rule in compiled.rules)
+        self.prefilter_requests += 1
+        self.prefilter_checks += checks
+        if not any_active:
+            # ни один обязательный литерал не встретился: запрос чистый
+            self.prefilter_clean += 1
+            self.prefilter_skipped += checks
+            return (1 if "%25" in req.get("query", "") else 0), [], "unknown"
+
+        hits: List[dict] = []
+        categories: set[str] = set()
+        suspected_param = "unknown"
+        score = 0
+        for idx, rule in enumerate(compiled.rules):
+            gated = idx in compiled.gated
+            match, param = False, None
+            try:
+                for entry in candidates[rule.target]:
+                    text, key, active, passed = entry
+                    if idx not in active:
+                        self.prefilter_skipped += 1
+                        continue
+                    if gated:
+                        if passed is None:
+                            passed = entry[3] = compiled._gate(rule.target, text)
+                        if not passed:
+                            continue
+                    if rule.pattern.search(text, timeout=0.01):
+                        match, param = True, key
+                        break
+            except regex.TimeoutError:
+                match, param = False, None
+            if match:
+                categories.add(rule.category)
+                hits.append(
+                    {
+                        "id": rule.id,
+                        "category": rule.category,
+                        "target": rule.target,
+                        "description": rule.description,
+                    }
+                )
+                if param:
+                    suspected_param = param
+                score += rule.weight
+        if len(categories) > 1:
+            score += 2
+        if "%25" in req.get("query", ""):
+            score += 1
+        return score, hits, suspected_param
+
+    def analyze_simple(self, req: dict) -> Tuple[int, List[dict], str]:
         hits: List[dict] = []
         categories: set[str] = set()
         suspected_param = "unknown"
@@ -1,34 +1,109 @@
 from __future__ import annotations
 
 from pathlib import Path
+from typing import Dict, Set
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     upstream_url: str = "http://demo_upstream:8001"
+    upstream_max_connections: int = 100
+    upstream_max_keepalive: int = 20
+    upstream_keepalive_expiry_sec: float = 5.0
+    upstream_timeout_sec: float = 10.0
+    upstream_pool_timeout_sec: float = 5.0
+    upstream_http2: bool = False  # требует httpx[http2]
+    upstream_limits: Dict[str, int] = {}  # base_url -> max_connections
     ai_url: str = Field(default="http://ai_analyzer:8002/analyze", alias="AI_URL")
     telegram_backend_url: str = Field(default="", alias="TELEGRAM_BACKEND_URL")
     control_plane_hmac_secret: str = Field(default="", alias="CONTROL_PLANE_HMAC_SECRET")
     license_key_hash: str = Field(default="", alias="LICENSE_KEY_HASH")
     request_timeout_ms: int = 150
     ml_timeout_ms: int = 150
-    ml_queue_limit: int = 32
-    ml_concurrency: int = 4
+    ml_queue_limit: int = 256  # элементов, ждущих отправки в ai_analyzer
+    ml_concurrency: int = 4  # одновременных HTTP-запросов (пачек) к ai_analyzer
+    # Пачки для /analyze/batch; пустой ai_batch_url - ai_url + "/batch"
+    ml_batching: bool = True
+    ml_batch_max_items: int = 64
+    ml_batch_max_wait_ms: float = 2.0
+    ai_batch_url: str = ""
+    # remote - HTTP в ai_analyzer; local - тот же joblib-артефакт в пуле процессов шлюза
+    # (удаленный анализатор остается запасным путем)
+    ml_mode: str = "remote"
+    ml_model_path: Path = Path("/data/ml_artifacts/model.joblib")
+    ml_local_workers: int = 2
+    ml_local_reload_sec: float = 5.0
+    ml_local_warmup_sec: float = 60.0  # сколько ждать загрузки модели во всех воркерах пула
     circuit_failures: int = 5
     circuit_cooldown_sec: int = 30
+    regex_compiled: bool = True  # общий матчер на target вместо прогона каждого правила
+    regex_prefilter: bool = True  # пропуск правил, чьих обязательных литералов нет в строке
     suspicion_threshold: int = 4  # Порог для вызова ML (если score >= 4)
     normalize_decode_rounds: int = 2
     body_truncate: int = 8192
+    proxy_streaming: bool = False  # тело дальше окна body_truncate не буферизуется в шлюзе
     rate_limit_burst: int = 30
     rate_limit_refill_per_sec: float = 10.0
     rate_limit_burst_suspicious: int = 10
+    rate_limit_key: str = "ip"  # ip | ip_path | api_key (без заголовка или с неизвестным ключом - по IP)
+    rate_limit_api_key_header: str = "X-Api-Key"
+    # Известные API-ключи: только у них свой бакет. Заголовок не аутентифицирован, и бакет
+    # по любому присланному значению обходился бы сменой ключа на каждом запросе
+    rate_limit_api_keys: Set[str] = set()
+    rate_limit_max_keys: int = 1_000_000
+    rate_limit_shards: int = 16
     block_ttl_sec: int = 600
+    blocklist_sweep_interval_sec: float = 1.0
+    cache_max_entries: int = 1_000_000
+    cache_max_bytes: int = 256 * 1024 * 1024
+    cache_ttl_sec: int = 300
+    cache_sweep_interval_sec: float = 1.0
+    cache_sweep_batch: int = 10_000
+    # Хэш отпечатка для кэша решений:
+    #   sha256  - криптостойкий, на CPU с SHA-расширениями самый быстрый из стойких;
+    #   blake2b - 128 бит с ключом, стойкий к подбору коллизий;
+    #   xxh3    - 128 бит, нужен пакет xxhash, в разы быстрее на больших телах, но не
+    #             криптографический: seed всего 64 бита, коллизии можно подобрать и отравить
+    #             кэш (чужой запрос получит закэшированный allow). Только для доверенного трафика.
+    fingerprint_algo: str = "sha256"
+    # Ключ blake2b / seed xxh3. Пустой - случайный на процесс; задайте общий,
+    # если кэш разделяется между процессами
+    fingerprint_key: str = ""
+    # memory - состояние в процессе; sqlite - общий файл для всех воркеров uvicorn (--workers N).
+    # Лог с цепочкой хэшей у каждого воркера свой: waf_events.jsonl, waf_events.w1.jsonl, ...
+    state_backend: str = "memory"
+    state_path: Path = Path("/data/state/waf_state.sqlite")
+    state_busy_timeout_ms: int = 1000
+    state_sweep_interval_sec: float = 5.0
     log_path: Path = Path("/data/logs/waf_events.jsonl")
     log_rotate_bytes: int = 10_000_000
     log_rotate_keep: int = 3
+    log_queue_size: int = 10_000
+    log_batch_size: int = 256
+    log_fsync_interval_sec: float = 1.0
+    log_fsync_bytes: int = 1_000_000
+    log_overflow_policy: str = "drop"  # drop - отбросить со счетчиком; block - ждать место в очереди
+    log_block_timeout_ms: int = 50
     hash_state_path: Path = Path("/data/logs/hash_state.json")
+    hash_checkpoint_interval_sec: float = 5.0
+    # Вместо prev/entry_hash в каждой записи - одна запись merkle_batch на пачку
+    log_merkle_batches: bool = False
+    # Каждые N записей - запись chain_checkpoint: по ним verify_log_chain.py делит файл
+    # на сегменты для параллельной проверки; с ключом точка подписывается HMAC
+    log_checkpoint_entries: int = 10_000
+    log_checkpoint_key: str = ""
     ml_fail_closed: bool = False
+    # Очередь отправки событий в telegram_backend: при переполнении событие отбрасывается
+    alert_queue_size: int = 10_000
+    alert_workers: int = 4
+    alert_timeout_sec: float = 10.0
+    alert_max_retries: int = 3
+    alert_retry_base_ms: int = 200
+    alert_drain_sec: float = 5.0  # сколько при остановке ждать отправки оставшихся событий
+    alert_batching: bool = True  # пачки в /api/v1/events/batch, при 404 - поштучно
+    alert_batch_max_items: int = 100
+    alert_batch_max_wait_ms: float = 50.0
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,425 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
+
+from .cache import DecisionCache
+from .ip_blocklist import IPBlocklist, valid_items
+from .ip_trie import parse_address, parse_prefix, prefix_key
+from .rate_limit import RateLimiter
+from .settings import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    last_ts REAL NOT NULL,
+    allowed INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS blocks (
+    ip TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS block_prefixes (
+    prefix TEXT PRIMARY KEY,
+    bits INTEGER NOT NULL,
+    prefix_len INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    value BLOB NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS state_meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS verdicts_expires ON verdicts (expires_at);
+CREATE INDEX IF NOT EXISTS rate_buckets_last_ts ON rate_buckets (last_ts);
+"""
+
+# Пополнение и списание токена одним UPSERT: SQLite выполняет его атомарно,
+# поэтому все воркеры видят один и тот же бакет
+RATE_SQL = """
+INSERT INTO rate_buckets (key, tokens, last_ts, allowed) VALUES (:key, :burst - 1, :now, 1)
+ON CONFLICT(key) DO UPDATE SET
+    allowed = MIN(:burst, tokens + (:now - last_ts) * :refill) >= 1,
+    tokens = MIN(:burst, tokens + (:now - last_ts) * :refill)
+        - (MIN(:burst, tokens + (:now - last_ts) * :refill) >= 1),
+    last_ts = :now
+RETURNING allowed
+"""
+
+
+def connect(path: Path | None = None) -> sqlite3.Connection:
+    """Соединение процесса с общим файлом состояния (WAL, без fsync на каждую запись)"""
+    path = path or settings.state_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(
+        path, timeout=settings.state_busy_timeout_ms / 1000, isolation_level=None, check_same_thread=False
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class StateDB:
+    """Соединение процесса с общим файлом состояния.
+
+    Запрос sqlite3 блокирует поток, а если файл занят другим воркером - до
+    state_busy_timeout_ms. Поэтому горячий путь (call) выполняется в
+    отдельном потоке, а не в event loop. Замок не дает этому потоку и event
+    loop (админские ручки, команды из Telegram) одновременно работать с
+    соединением. Все обращения к состоянию, включая админские ручки,
+    метрики и команды из Telegram, идут через call. При
+    sqlite3.OperationalError классы ниже переходят на состояние своего
+    процесса, а не отдают клиенту 500.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.conn = connect(path)
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="waf-state")
+        self.errors = 0
+
+    def query(self, sql: str, params: Any = (), fetch: str = "one") -> Any:
+        with self.lock:
+            cur = self.conn.execute(sql, params)
+            if fetch == "one":
+                return cur.fetchone()
+            if fetch == "all":
+                return cur.fetchall()
+            return cur.rowcount
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield self.conn
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    async def call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def failed(self, where: str, exc: Exception) -> None:
+        self.errors += 1
+        print(f"[shared_state] {where}: {exc}, using per-process state", file=sys.stderr)
+
+
+class SharedRateLimiter:
+    """Token bucket в общем SQLite-файле: лимит один на все процессы шлюза"""
+
+    def __init__(self, db: StateDB) -> None:
+        self.db = db
+        self.local = RateLimiter()  # пока файл недоступен
+
+    def allow(self, key: str, suspicious: bool = False) -> bool:
+        burst = settings.rate_limit_burst_suspicious if suspicious else settings.rate_limit_burst
+        try:
+            row = self.db.query(
+                RATE_SQL,
+                {"key": key, "burst": burst, "now": time.time(), "refill": settings.rate_limit_refill_per_sec},
+            )
+        except sqlite3.OperationalError as exc:
+            self.db.failed("rate limit", exc)
+            return self.local.allow(key, suspicious)
+        return bool(row[0])
+
+    def purge_idle(self) -> int:
+        # бакет, простоявший дольше времени полного пополнения, равен новому
+        full_refill = settings.rate_limit_burst / settings.rate_limit_refill_per_sec
+        return self.db.query("DELETE FROM rate_buckets WHERE last_ts < ?", (time.time() - full_refill,), fetch="count")
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            (count,) = self.db.query("SELECT COUNT(*) FROM rate_buckets")
+        except sqlite3.OperationalError as exc:
+            self.db.failed("rate limit stats", exc)
+            count = None
+        return {"backend": "sqlite", "tracked_keys": count, "state_errors": self.db.errors}
+
+
+class SharedBlocklist:
+    """Блокировки в общем SQLite-файле; подсеть ищется по ключам всех длин префикса, что есть в таблице.
+
+    Блокировки этого процесса дублируются в local: по ним проверяется IP,
+    пока файл недоступен. Изменения, которые не удалось записать, ждут в
+    pending и дописываются при очистке. Любое изменение подсетей увеличивает
+    поколение prefix_gen в state_meta; проверка IP сверяет его и перечитывает
+    длины префиксов, так что подсеть, добавленная другим воркером, действует
+    сразу.
+    """
+
+    def __init__(self, db: StateDB) -> None:
+        self.db = db
+        self.local = IPBlocklist()
+        self.local_lock = threading.Lock()
+        self.prefix_lens: Dict[int, List[int]] = {}
+        self.prefix_gen = -1
+        # изменения, которые не удалось записать в файл: ("block" | "unblock", адреса, срок)
+        self.pending: List[Tuple[str, List[str], float]] = []
+        try:
+            self.refresh_prefix_lens()
+        except sqlite3.OperationalError as exc:
+            self.db.failed("blocklist", exc)
+
+    def block(self, ip: str, ttl: int | None = None) -> None:
+        with self.local_lock:
+            self.local.block(ip, ttl)
+        self._apply(("block", [ip], time.time() + (ttl or settings.block_ttl_sec)))
+
+    def bulk_load(self, prefixes: Iterable[str], ttl: int | None = None) -> int:
+        prefixes = list(valid_items(prefixes))
+        with self.local_lock:
+            self.local.bulk_load(prefixes, ttl)
+        self._apply(("block", prefixes, time.time() + (ttl or settings.block_ttl_sec)))
+        return len(prefixes)
+
+    def _apply(self, op: Tuple[str, List[str], float]) -> None:
+        """Изменение в файл; если он занят - в pending, повтор из purge_expired"""
+        if not self.pending:
+            try:
+                with self.db.transaction() as conn:
+                    self._write(conn, *op)
+                return
+            except sqlite3.OperationalError as exc:
+                self.db.failed("blocklist update", exc)
+        self.pending.append(op)
+
+    def flush_pending(self) -> None:
+        while self.pending:
+            with self.db.transaction() as conn:
+                self._write(conn, *self.pending[0])
+            self.pending.pop(0)
+
+    def _write(self, conn: sqlite3.Connection, kind: str, items: List[str], expire: float) -> None:
+        prefixes_changed = False
+        for ip in items:
+            if kind == "block":
+                prefixes_changed |= self._store(conn, ip, expire)
+                continue
+            parsed = parse_prefix(ip) if "/" in ip else None
+            if parsed is not None and parsed[2] < parsed[0]:
+                prefixes_changed |= conn.execute("DELETE FROM block_prefixes WHERE prefix = ?", (parsed[3],)).rowcount > 0
+            else:
+                conn.execute("DELETE FROM blocks WHERE ip = ?", (ip.split("/", 1)[0],))
+        if prefixes_changed:
+            self._bump_gen(conn)
+
+    def _store(self, conn: sqlite3.Connection, ip: str, expire: float) -> bool:
+        """Пишет адрес или подсеть; True, если это подсеть"""
+        if "/" in ip:
+            parsed = parse_prefix(ip)
+            if parsed is not None:
+                bits, _, prefix_len, key = parsed
+                if prefix_len < bits:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO block_prefixes (prefix, bits, prefix_len, expires_at) VALUES (?, ?, ?, ?)",
+                        (key, bits, prefix_len, expire),
+                    )
+                    return True
+                ip = key.split("/", 1)[0]
+        conn.execute("INSERT OR REPLACE INTO blocks (ip, expires_at) VALUES (?, ?)", (ip, expire))
+        return False
+
+    @staticmethod
+    def _bump_gen(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "INSERT INTO state_meta (name, value) VALUES ('prefix_gen', 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1"
+        )
+
+    def unblock(self, ip: str) -> None:
+        with self.local_lock:
+            self.local.unblock(ip)
+        self._apply(("unblock", [ip], 0.0))
+
+    def is_blocked(self, ip: str) -> bool:
+        try:
+            if self._is_blocked(ip):
+                return True
+        except sqlite3.OperationalError as exc:
+            self.db.failed("blocklist", exc)
+            with self.local_lock:
+                return self.local.is_blocked(ip)
+        if not self.pending:
+            return False
+        # блокировки этого процесса, еще не попавшие в файл
+        with self.local_lock:
+            return self.local.is_blocked(ip)
+
+    def _is_blocked(self, ip: str) -> bool:
+        now = time.time()
+        # адрес и поколение подсетей одним запросом
+        blocked, gen = self.db.query(
+            "SELECT EXISTS (SELECT 1 FROM blocks WHERE ip = ? AND expires_at > ?), "
+            "(SELECT value FROM state_meta WHERE name = 'prefix_gen')",
+            (ip, now),
+        )
+        if blocked:
+            return True
+        if (gen or 0) != self.prefix_gen:
+            self.refresh_prefix_lens()
+        if not self.prefix_lens:
+            return False
+        parsed = parse_address(ip)
+        if parsed is None or parsed[0] not in self.prefix_lens:
+            return False
+        bits, value = parsed
+        keys = [prefix_key(bits, value, length) for length in self.prefix_lens[bits]]
+        row = self.db.query(
+            f"SELECT 1 FROM block_prefixes WHERE prefix IN ({','.join('?' * len(keys))}) AND expires_at > ? LIMIT 1",
+            (*keys, now),
+        )
+        return row is not None
+
+    def _generation(self) -> int:
+        row = self.db.query("SELECT value FROM state_meta WHERE name = 'prefix_gen'")
+        return row[0] if row else 0
+
+    def active(self) -> Dict[str, float]:
+        now = time.time()
+        try:
+            with self.db.lock:
+                rows = self.db.query("SELECT ip, expires_at FROM blocks WHERE expires_at > ?", (now,), fetch="all")
+                rows += self.db.query(
+                    "SELECT prefix, expires_at FROM block_prefixes WHERE expires_at > ?", (now,), fetch="all"
+                )
+        except sqlite3.OperationalError as exc:
+            self.db.failed("blocklist", exc)
+            with self.local_lock:
+                return self.local.active()
+        result = dict(rows)
+        if self.pending:
+            with self.local_lock:
+                result.update(self.local.active())
+        return result
+
+    def refresh_prefix_lens(self) -> None:
+        # подхватывает подсети, добавленные другими воркерами
+        with self.db.lock:
+            gen = self._generation()
+            lens: Dict[int, List[int]] = {}
+            for bits, prefix_len in self.db.query("SELECT DISTINCT bits, prefix_len FROM block_prefixes", fetch="all"):
+                lens.setdefault(bits, []).append(prefix_len)
+        self.prefix_lens, self.prefix_gen = lens, gen
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self.local_lock:
+            self.local.purge_expired()
+        self.flush_pending()
+        with self.db.transaction() as conn:
+            removed = conn.execute("DELETE FROM blocks WHERE expires_at <= ?", (now,)).rowcount
+            prefixes = conn.execute("DELETE FROM block_prefixes WHERE expires_at <= ?", (now,)).rowcount
+            if prefixes:
+                self._bump_gen(conn)
+        return removed + prefixes
+
+
+class SharedDecisionCache:
+    """Кэш вердиктов в общем SQLite-файле; счетчики попаданий - на процесс.
+
+    Пока файл недоступен, вердикты читаются и пишутся в кэш процесса (local).
+    """
+
+    def __init__(self, db: StateDB) -> None:
+        self.db = db
+        self.ttl = settings.cache_ttl_sec
+        self.local = DecisionCache()
+        self.local_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            row = self.db.query("SELECT value FROM verdicts WHERE key = ? AND expires_at > ?", (key, time.time()))
+        except sqlite3.OperationalError as exc:
+            self.db.failed("decision cache", exc)
+            with self.local_lock:
+                return self.local.get(key)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tuple(orjson.loads(row[0]))
+
+    def set(self, key: str, value: Any) -> None:
+        try:
+            self.db.query(
+                "INSERT OR REPLACE INTO verdicts (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, time.time() + self.ttl, orjson.dumps(value)),
+                fetch="count",
+            )
+        except sqlite3.OperationalError as exc:
+            self.db.failed("decision cache", exc)
+            with self.local_lock:
+                self.local.set(key, value)
+
+    def purge_expired(self) -> int:
+        with self.local_lock:
+            self.local.purge_expired()
+        removed = self.db.query("DELETE FROM verdicts WHERE expires_at <= ?", (time.time(),), fetch="count")
+        # сверх лимита удаляются записи, которые истекут раньше всех
+        self.db.query(
+            "DELETE FROM verdicts WHERE key IN "
+            "(SELECT key FROM verdicts ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (settings.cache_max_entries,),
+            fetch="count",
+        )
+        return removed
+
+    async def run_expiry(self) -> None:
+        while True:
+            await asyncio.sleep(settings.cache_sweep_interval_sec)
+            try:
+                await self.db.call(self.purge_expired)
+            except sqlite3.OperationalError:
+                continue
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            (count,) = self.db.query("SELECT COUNT(*) FROM verdicts")
+        except sqlite3.OperationalError as exc:
+            self.db.failed("decision cache stats", exc)
+            count = None
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "entries": count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "state_errors": self.db.errors,
+        }
+
+
+async def run_maintenance(limiter: SharedRateLimiter, blocklist: SharedBlocklist) -> None:
+    """Периодическая очистка восстановившихся бакетов и истекших блокировок"""
+    while True:
+        await asyncio.sleep(settings.state_sweep_interval_sec)
+        try:
+            await limiter.db.call(limiter.purge_idle)
+            await blocklist.db.call(blocklist.purge_expired)
+        except sqlite3.OperationalError:
+            continue
@@ -1,11 +1,13 @@
 from __future__ import annotations
 
+import asyncio
 import hmac
+import random
 import time
 import uuid
 import sys
 from hashlib import sha256
-from typing import Any
+from typing import Any, Dict, List, Tuple
 
 import httpx
 import orjson
@@ -13,50 +15,186 @@ import orjson
 from .settings import settings
 
 
-async def send_event(event: dict[str, Any]) -> None:
-    print(f"[telegram_client] send_event called", file=sys.stderr)
-    
+def _configured() -> bool:
     if not settings.telegram_backend_url:
         print("[telegram_client] ERROR: TELEGRAM_BACKEND_URL not set", file=sys.stderr)
-        return
-    
+        return False
     if not settings.control_plane_hmac_secret:
         print("[telegram_client] ERROR: CONTROL_PLANE_HMAC_SECRET not set", file=sys.stderr)
-        return
-    
+        return False
     if not settings.license_key_hash:
         print("[telegram_client] ERROR: LICENSE_KEY_HASH not set", file=sys.stderr)
-        return
-    
-    print(f"[telegram_client] backend_url: {settings.telegram_backend_url}", file=sys.stderr)
-    print(f"[telegram_client] license_hash: {settings.license_key_hash[:16]}...", file=sys.stderr)
-    
+        return False
+    return True
+
+
+def sign(body: bytes) -> Dict[str, str]:
+    """Заголовки подписи; nonce новый на каждую попытку - бэкенд отвергает повторы"""
     timestamp = str(int(time.time()))
     nonce = uuid.uuid4().hex
-    event["license_key_hash"] = settings.license_key_hash
-    body = orjson.dumps(event)
-    
     signature = hmac.new(
         settings.control_plane_hmac_secret.encode(),
         f"{timestamp}\n{nonce}\n".encode() + body,
         sha256,
     ).hexdigest()
-    
-    headers = {
+    return {
         "X-Timestamp": timestamp,
         "X-Nonce": nonce,
         "X-Signature": signature,
         "Content-Type": "application/json",
     }
-    
-    url = settings.telegram_backend_url.rstrip("/") + "/api/v1/event"
-    print(f"[telegram_client] POST {url}", file=sys.stderr)
-    
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.post(url, content=body, headers=headers)
-            print(f"[telegram_client] response: {resp.status_code} {resp.text}", file=sys.stderr)
-    except httpx.HTTPError as e:
-        print(f"[telegram_client] HTTP ERROR: {e}", file=sys.stderr)
-    except Exception as e:
-        print(f"[telegram_client] ERROR: {e}", file=sys.stderr)
+
+
+def event_body(event: dict[str, Any]) -> bytes:
+    event["license_key_hash"] = settings.license_key_hash
+    return orjson.dumps(event)
+
+
+class AlertDispatcher:
+    """Фоновая отправка событий блокировки в telegram_backend.
+
+    submit() только кладет событие в ограниченную очередь (при переполнении
+    событие отбрасывается со счетчиком), поэтому ответ 403/429 не ждет
+    бэкенд. Воркеры (alert_workers) отправляют события через общий пул
+    соединений. Ошибки сети, 429 и 5xx повторяются с экспоненциальной
+    задержкой и случайным разбросом.
+
+    При alert_batching воркер забирает из очереди до alert_batch_max_items
+    событий (подождав alert_batch_max_wait_ms, если очередь не пуста
+    сразу на полную пачку) и отправляет их одним подписанным POST в
+    /api/v1/events/batch. Если бэкенд не знает этот путь (404), диспетчер
+    переходит на поштучную отправку.
+    """
+
+    def __init__(self) -> None:
+        self.queue: asyncio.Queue[dict[str, Any]] | None = None
+        self.client: httpx.AsyncClient | None = None
+        self.tasks: List[asyncio.Task] = []
+        self.url = settings.telegram_backend_url.rstrip("/") + "/api/v1/event"
+        self.batch_url = settings.telegram_backend_url.rstrip("/") + "/api/v1/events/batch"
+        self.batch_supported = settings.alert_batching
+        self.enabled = True
+        self.requests = 0
+        self.sent = 0
+        self.dropped = 0
+        self.retries = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self.tasks:
+            return
+        self.enabled = _configured()
+        self.queue = asyncio.Queue(maxsize=settings.alert_queue_size)
+        self.client = httpx.AsyncClient(
+            timeout=settings.alert_timeout_sec,
+            limits=httpx.Limits(
+                max_connections=settings.alert_workers,
+                max_keepalive_connections=settings.alert_workers,
+            ),
+        )
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(settings.alert_workers)]
+
+    async def close(self) -> None:
+        """Дает очереди разойтись за alert_drain_sec, затем останавливает воркеры"""
+        if self.queue is not None and self.enabled:
+            try:
+                await asyncio.wait_for(self.queue.join(), settings.alert_drain_sec)
+            except asyncio.TimeoutError:
+                pass
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def submit(self, event: dict[str, Any]) -> None:
+        if self.queue is None:
+            self.start()
+        if not self.enabled:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _take(self, events: List[dict[str, Any]]) -> None:
+        while len(events) < settings.alert_batch_max_items:
+            try:
+                events.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return
+
+    async def _worker(self) -> None:
+        while True:
+            events = [await self.queue.get()]
+            try:
+                if self.batch_supported:
+                    self._take(events)
+                    if len(events) < settings.alert_batch_max_items:
+                        await asyncio.sleep(settings.alert_batch_max_wait_ms / 1000)
+                        self._take(events)
+                if len(events) > 1 and self.batch_supported:
+                    await self._deliver_batch(events)
+                else:
+                    for event in events:
+                        await self._deliver(self.url, event_body(event), 1)
+            except Exception as exc:  # noqa: BLE001
+                self.failed += len(events)
+                print(f"[telegram_client] ERROR: {exc}", file=sys.stderr)
+            finally:
+                for _ in events:
+                    self.queue.task_done()
+
+    async def _deliver_batch(self, events: List[dict[str, Any]]) -> None:
+        body = orjson.dumps({"license_key_hash": settings.license_key_hash, "events": events})
+        if await self._deliver(self.batch_url, body, len(events)) == 404:
+            # старый telegram_backend без /api/v1/events/batch
+            self.batch_supported = False
+            for event in events:
+                await self._deliver(self.url, event_body(event), 1)
+
+    async def _deliver(self, url: str, body: bytes, count: int) -> int | None:
+        """Отправка с повторами; возвращает код ответа без повтора (None - сдались)"""
+        for attempt in range(settings.alert_max_retries + 1):
+            status, detail = await self._post(url, body, count)
+            if status is not None:
+                return status
+            if attempt == settings.alert_max_retries:
+                break
+            self.retries += 1
+            delay = settings.alert_retry_base_ms / 1000 * 2 ** attempt
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        self.failed += count
+        print(f"[telegram_client] giving up after {settings.alert_max_retries + 1} attempts: {detail}", file=sys.stderr)
+        return None
+
+    async def _post(self, url: str, body: bytes, count: int) -> Tuple[int | None, str]:
+        """(код ответа или None, если нужен повтор; описание ошибки)"""
+        self.requests += 1
+        try:
+            resp = await self.client.post(url, content=body, headers=sign(body))
+        except httpx.HTTPError as e:
+            return None, f"HTTP ERROR: {e!r}"
+        if resp.status_code == 429 or resp.status_code >= 500:
+            return None, f"status {resp.status_code}"
+        if resp.status_code == 404 and url == self.batch_url:
+            return 404, ""
+        if resp.status_code >= 400:
+            self.failed += count
+            print(f"[telegram_client] rejected: {resp.status_code} {resp.text[:200]}", file=sys.stderr)
+            return resp.status_code, ""
+        self.sent += count
+        return resp.status_code, ""
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "sent": self.sent,
+            "requests": self.requests,
+            "batch_supported": self.batch_supported,
+            "dropped": self.dropped,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, Set
+
+import httpx
+
+from .settings import settings
+
+
+class UpstreamClient:
+    """Долгоживущий клиент с keep-alive пулом для одного upstream"""
+
+    def __init__(self, base_url: str, max_connections: int) -> None:
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.client: httpx.AsyncClient | None = None
+        self.sem = asyncio.Semaphore(max_connections)
+        self.in_use = 0
+        self.streams: Set[httpx.Response] = set()
+        self.requests_total = 0
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+
+    def open(self) -> None:
+        if self.client is not None:
+            return
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=min(settings.upstream_max_keepalive, self.max_connections),
+            keepalive_expiry=settings.upstream_keepalive_expiry_sec,
+        )
+        timeout = httpx.Timeout(
+            settings.upstream_timeout_sec,
+            pool=settings.upstream_pool_timeout_sec,
+        )
+        self.client = httpx.AsyncClient(limits=limits, timeout=timeout, http2=settings.upstream_http2)
+
+    async def close(self) -> None:
+        if self.client is None:
+            return
+        await self.client.aclose()
+        self.client = None
+
+    async def acquire(self) -> httpx.AsyncClient:
+        """Ждет свободный слот пула и учитывает время ожидания.
+
+        Ожидание ограничено upstream_pool_timeout_sec, как и у пула httpx:
+        по истечении - httpx.PoolTimeout.
+        """
+        if self.client is None:
+            self.open()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.sem.acquire(), settings.upstream_pool_timeout_sec)
+        except asyncio.TimeoutError:
+            raise httpx.PoolTimeout(f"no free upstream slot in {settings.upstream_pool_timeout_sec}s") from None
+        waited = (time.perf_counter() - start) * 1000
+        self.wait_total_ms += waited
+        self.wait_max_ms = max(self.wait_max_ms, waited)
+        self.requests_total += 1
+        self.in_use += 1
+        return self.client
+
+    def release(self) -> None:
+        self.in_use -= 1
+        self.sem.release()
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        client = await self.acquire()
+        try:
+            return await client.request(method, url, **kwargs)
+        finally:
+            self.release()
+
+    async def open_stream(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """Запрос без чтения тела ответа; слот пула держится до close_stream"""
+        client = await self.acquire()
+        try:
+            req = client.build_request(method, url, **kwargs)
+            resp = await client.send(req, stream=True)
+        except BaseException:
+            self.release()
+            raise
+        self.streams.add(resp)
+        return resp
+
+    async def stream_body(self, resp: httpx.Response) -> AsyncIterator[bytes]:
+        """Тело ответа как есть; слот освобождается и при обрыве клиента или ошибке upstream"""
+        try:
+            async for chunk in resp.aiter_raw():
+                yield chunk
+        finally:
+            await self.close_stream(resp)
+
+    async def close_stream(self, resp: httpx.Response) -> None:
+        """Закрывает ответ open_stream и отдает слот; повторный вызов ничего не делает"""
+        if resp not in self.streams:
+            return
+        self.streams.discard(resp)
+        try:
+            await resp.aclose()
+        finally:
+            self.release()
+
+    def _idle_connections(self) -> int:
+        # httpx не отдает состояние пула публично, читаем из httpcore, если доступно
+        transport = getattr(self.client, "_transport", None)
+        pool = getattr(transport, "_pool", None)
+        connections = getattr(pool, "connections", None) or []
+        return sum(1 for conn in connections if conn.is_idle())
+
+    def stats(self) -> Dict[str, Any]:
+        avg_wait = self.wait_total_ms / self.requests_total if self.requests_total else 0.0
+        return {
+            "max_connections": self.max_connections,
+            "in_use": self.in_use,
+            "idle": self._idle_connections() if self.client else 0,
+            "requests_total": self.requests_total,
+            "wait_avg_ms": round(avg_wait, 3),
+            "wait_max_ms": round(self.wait_max_ms, 3),
+            "http2": settings.upstream_http2,
+        }
+
+
+class UpstreamPool:
+    """Набор клиентов по base URL, чтобы у каждого upstream были свои лимиты"""
+
+    def __init__(self) -> None:
+        self.clients: Dict[str, UpstreamClient] = {}
+
+    def get(self, base_url: str) -> UpstreamClient:
+        client = self.clients.get(base_url)
+        if client is None:
+            max_conn = settings.upstream_limits.get(base_url, settings.upstream_max_connections)
+            client = UpstreamClient(base_url, max_conn)
+            client.open()
+            self.clients[base_url] = client
+        return client
+
+    def start(self) -> None:
+        self.get(settings.upstream_url.rstrip("/"))
+
+    async def close(self) -> None:
+        for client in self.clients.values():
+            await client.close()
+        self.clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {url: client.stats() for url, client in self.clients.items()}
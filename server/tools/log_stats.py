@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Агрегаты по журналу WAF: топ атакующих IP, блокировки по категориям
+поминутно, p50/p95/p99 latency_ms по endpoint и число срабатываний правил.
+
+Файл читается пачками по --chunk строк. Из каждой строки берутся только
+поля схемы _build_log, строки кодируются целыми числами, а подсчет делается
+через numpy.bincount и np.add.at. Поэтому память зависит от числа разных
+IP, endpoint и правил, а не от числа событий. Задержки копятся в
+разреженной гистограмме на endpoint (только встреченные корзины): до 1 с
+шаг 1 мс, дальше шаг 1%. Ротированные файлы обрабатываются параллельно в
+пуле процессов.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    print("numpy is required: pip install numpy")
+    sys.exit(1)
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:  # pragma: no cover
+    loads = json.loads
+
+EXACT_MS = 1000
+LOG_STEP = 1.01
+LAT_BINS = EXACT_MS + int(math.log(3_600_000 / EXACT_MS, LOG_STEP)) + 1
+
+
+class Codes:
+    """Строка -> последовательный код; пачка кодируется через np.unique (None -> "None")"""
+
+    def __init__(self) -> None:
+        self.index: dict = {}
+        self.values: list = []
+
+    def __call__(self, value) -> int:
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode(self, values: list) -> np.ndarray:
+        uniq, inverse = np.unique(np.array(values, dtype=str), return_inverse=True)
+        return np.array([self(v) for v in uniq.tolist()], np.int64)[inverse.reshape(-1)]
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+def grow(acc: np.ndarray, n: int) -> np.ndarray:
+    if len(acc) >= n:
+        return acc
+    out = np.zeros((n,) + acc.shape[1:], dtype=acc.dtype)
+    out[: len(acc)] = acc
+    return out
+
+
+def latency_bucket(ms: np.ndarray) -> np.ndarray:
+    ms = np.maximum(ms, 0)
+    coarse = EXACT_MS + np.log(np.maximum(ms, EXACT_MS) / EXACT_MS) / math.log(LOG_STEP)
+    return np.minimum(np.where(ms < EXACT_MS, ms, coarse), LAT_BINS - 1).astype(np.int64)
+
+
+def bucket_value(bucket: int) -> float:
+    return float(bucket) if bucket < EXACT_MS else EXACT_MS * LOG_STEP ** (bucket - EXACT_MS)
+
+
+class Aggregator:
+    def __init__(self) -> None:
+        self.ips, self.eps, self.cats, self.rules, self.minutes, self.decisions = (Codes() for _ in range(6))
+        self.block = self.decisions("block")
+        self.decision_counts = np.zeros(0, np.int64)
+        self.ip_blocks = np.zeros(0, np.int64)
+        self.rule_hits = np.zeros(0, np.int64)
+        self.minute_cat = np.zeros((0, 0), np.int64)
+        # код endpoint -> {корзина: число}; плотная строка на LAT_BINS заняла бы ~15 КБ на путь
+        self.latency: list = []
+        self.total = 0
+
+    def add_chunk(self, lines: list) -> None:
+        # в цикле по строкам только разбор и выборка полей; кодирование и подсчет - по массивам
+        dec, ip, ts, ep, lat = [], [], [], [], []
+        cat_row, cat = [], []
+        rule = []
+        for line in lines:
+            try:
+                e = loads(line)
+            except ValueError:
+                continue
+            if "type" in e:  # merkle_batch / chain_checkpoint
+                continue
+            dec.append(e.get("decision"))
+            ip.append(e.get("client_ip"))
+            ts.append(e.get("timestamp_utc") or "")
+            ep.append(e.get("endpoint") or e.get("path"))
+            lat.append(e.get("latency_ms") or 0)
+            hits = e.get("regex_hits")
+            if hits:
+                row = len(dec) - 1
+                for category in {h.get("category") for h in hits}:
+                    cat_row.append(row)
+                    cat.append(category)
+                rule.extend(h.get("id") for h in hits)
+        if not dec:
+            return
+        self.total += len(dec)
+
+        dec_a = self.decisions.encode(dec)
+        ip_a = self.ips.encode(ip)
+        minute_a = self.minutes.encode(np.array(ts, dtype="U16").tolist())
+        ep_a = self.eps.encode(ep)
+        blocked = dec_a == self.block
+
+        self.decision_counts = grow(self.decision_counts, len(self.decisions))
+        self.decision_counts += np.bincount(dec_a, minlength=len(self.decisions))
+        self.ip_blocks = grow(self.ip_blocks, len(self.ips))
+        self.ip_blocks += np.bincount(ip_a[blocked], minlength=len(self.ips))
+        if rule:
+            rule_a = self.rules.encode(rule)
+            self.rule_hits = grow(self.rule_hits, len(self.rules))
+            self.rule_hits += np.bincount(rule_a, minlength=len(self.rules))
+        if cat:
+            cat_a = self.cats.encode(cat)
+            rows = np.asarray(cat_row, np.int64)
+            keep = blocked[rows]
+            shape = (len(self.minutes), len(self.cats))
+            if self.minute_cat.shape != shape:
+                out = np.zeros(shape, np.int64)
+                out[: self.minute_cat.shape[0], : self.minute_cat.shape[1]] = self.minute_cat
+                self.minute_cat = out
+            np.add.at(self.minute_cat, (minute_a[rows[keep]], cat_a[keep]), 1)
+        pairs, counts = np.unique(ep_a * LAT_BINS + latency_bucket(np.asarray(lat, np.float64)), return_counts=True)
+        self.latency.extend({} for _ in range(len(self.eps) - len(self.latency)))
+        for pair, n in zip(pairs.tolist(), counts.tolist()):
+            hist = self.latency[pair // LAT_BINS]
+            bucket = pair % LAT_BINS
+            hist[bucket] = hist.get(bucket, 0) + n
+
+    def result(self) -> dict:
+        """Частичный результат по именам (для слияния между процессами)"""
+        minute_cat = {}
+        for m, c in zip(*np.nonzero(self.minute_cat)):
+            minute_cat[(self.minutes.values[m], self.cats.values[c])] = int(self.minute_cat[m, c])
+        return {
+            "total": self.total,
+            "decisions": dict(zip(self.decisions.values, self.decision_counts.tolist())),
+            "ip_blocks": {self.ips.values[i]: int(self.ip_blocks[i]) for i in np.nonzero(self.ip_blocks)[0]},
+            "rule_hits": dict(zip(self.rules.values, self.rule_hits.tolist())),
+            "minute_cat": minute_cat,
+            "latency": dict(zip(self.eps.values, self.latency)),
+        }
+
+
+def aggregate_file(path: str, chunk: int) -> dict:
+    agg = Aggregator()
+    with open(path, "rb") as f:
+        lines = []
+        for line in f:
+            lines.append(line)
+            if len(lines) >= chunk:
+                agg.add_chunk(lines)
+                lines = []
+        agg.add_chunk(lines)
+    return agg.result()
+
+
+def merge(parts: list) -> dict:
+    out = {"total": 0, "decisions": {}, "ip_blocks": {}, "rule_hits": {}, "minute_cat": {}, "latency": {}}
+    for part in parts:
+        out["total"] += part["total"]
+        for key in ("decisions", "ip_blocks", "rule_hits", "minute_cat"):
+            for name, n in part[key].items():
+                out[key][name] = out[key].get(name, 0) + n
+        for ep, hist in part["latency"].items():
+            acc = out["latency"].setdefault(ep, {})
+            for bucket, n in hist.items():
+                acc[bucket] = acc.get(bucket, 0) + n
+    return out
+
+
+def percentiles(hist: dict, qs=(0.5, 0.95, 0.99)) -> list:
+    buckets = sorted(hist)
+    cum = np.cumsum([hist[b] for b in buckets])
+    return [bucket_value(buckets[int(np.searchsorted(cum, q * cum[-1]))]) for q in qs]
+
+
+def top(counts: dict, n: int) -> list:
+    return sorted(counts.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+
+def report(stats: dict, n: int, minutes: int) -> dict:
+    latency = sorted(stats["latency"].items(), key=lambda kv: sum(kv[1].values()), reverse=True)[:n]
+    per_minute: dict = {}
+    for (minute, category), count in stats["minute_cat"].items():
+        per_minute.setdefault(minute, {})[category] = count
+    recent = sorted(per_minute)[-minutes:]
+    return {
+        "total": stats["total"],
+        "decisions": stats["decisions"],
+        "top_ips": top(stats["ip_blocks"], n),
+        "blocks_per_minute": {m: per_minute[m] for m in recent},
+        "latency_ms": {
+            str(ep): dict(count=sum(hist.values()), **dict(zip(("p50", "p95", "p99"), percentiles(hist))))
+            for ep, hist in latency
+        },
+        "rule_hits": top(stats["rule_hits"], n),
+    }
+
+
+def print_report(rep: dict) -> None:
+    print(f"events: {rep['total']}  " + "  ".join(f"{k}={v}" for k, v in rep["decisions"].items() if v))
+    print("\nTop blocked IPs:")
+    for ip, count in rep["top_ips"]:
+        print(f"  {ip:>39}  {count}")
+    print("\nBlocks per category per minute:")
+    for minute, cats in rep["blocks_per_minute"].items():
+        print(f"  {minute}  " + "  ".join(f"{c}={n}" for c, n in sorted(cats.items(), key=str)))
+    print("\nLatency by endpoint (ms):")
+    for ep, row in rep["latency_ms"].items():
+        print(f"  {ep[:40]:<40} n={row['count']:<8} p50={row['p50']:.0f} p95={row['p95']:.0f} p99={row['p99']:.0f}")
+    print("\nRegex rule hits:")
+    for rule, count in rep["rule_hits"]:
+        print(f"  {str(rule):<20} {count}")
+
+
+def log_files(path: Path) -> list:
+    files = [path] if path.exists() else []
+    idx = 1
+    while path.with_name(path.name + f".{idx}").exists():
+        files.append(path.with_name(path.name + f".{idx}"))
+        idx += 1
+    return files
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Агрегаты по журналу WAF")
+    parser.add_argument("path", nargs="?", type=Path, default=Path("data/logs/waf_events.jsonl"))
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--minutes", type=int, default=30, help="сколько последних минут показать")
+    parser.add_argument("--chunk", type=int, default=100_000, help="строк в пачке")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--no-rotated", action="store_true", help="только текущий файл")
+    parser.add_argument("--json", action="store_true", help="вывод в JSON")
+    args = parser.parse_args()
+
+    files = log_files(args.path)[:1] if args.no_rotated else log_files(args.path)
+    if not files:
+        print(f"Not found: {args.path}")
+        sys.exit(1)
+
+    if args.jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(files))) as pool:
+            parts = list(pool.map(aggregate_file, map(str, files), [args.chunk] * len(files)))
+    else:
+        parts = [aggregate_file(str(f), args.chunk) for f in files]
+
+    rep = report(merge(parts), args.top, args.minutes)
+    if args.json:
+        print(json.dumps(rep, ensure_ascii=False, indent=2))
+    else:
+        print_report(rep)
+
+
+if __name__ == "__main__":
+    main()
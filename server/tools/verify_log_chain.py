@@ -1,67 +1,309 @@
 #!/usr/bin/env python3
-import json
+"""
+Проверка цепочки хэшей журнала WAF (waf_events.jsonl и ротированные .1..N).
+
+Файлы читаются через mmap. Записи chain_checkpoint, которые шлюз пишет
+каждые LOG_CHECKPOINT_ENTRIES записей, делят файл на сегменты: каждый
+сегмент проверяется отдельно в пуле процессов, а затем проверяется, что
+сегменты сцеплены друг с другом. С --key проверяются HMAC-подписи
+контрольных точек. Самый старый из файлов должен начинаться с GENESIS или
+с подписанной контрольной точки (шлюз пишет ее в начало файла после
+ротации), иначе срезанное начало журнала не отличить от ротации.
+
+С --incremental смещение и хэш последней проверенной записи сохраняются
+в <log>.verified.json, и следующий запуск проверяет только дописанное.
+"""
+from __future__ import annotations
+
+import argparse
 import hashlib
+import hmac
+import json
+import mmap
+import os
+import re
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+GENESIS = "0" * 64
+# Ключи отсортированы, поэтому хэши стоят внутри строки; без них остается ровно тот payload,
+# от которого шлюз считал хэш (повторная сериализация через json дала бы другие байты)
+HASH_FIELDS_RE = re.compile(rb',"(?:entry_hash|prev_hash)":"[0-9a-f]{64}"|"(?:entry_hash|prev_hash)":"[0-9a-f]{64}",')
+FIELD_RE = {
+    name: re.compile(rb'"' + name.encode() + rb'":"([0-9a-f]{64})"')
+    for name in ("entry_hash", "prev_hash", "merkle_root", "sig")
+}
+BATCH_MARKER = b'"type":"merkle_batch"'
+CHECKPOINT_MARKER = b'"type":"chain_checkpoint"'
+MIN_SEGMENT_BYTES = 4 * 1024 * 1024
+
+
+def merkle_root(leaves: list) -> bytes:
+    level = leaves
+    while len(level) > 1:
+        nxt = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nxt.append(level[-1])
+        level = nxt
+    return level[0]
+
+
+def field(line: bytes, name: str) -> str | None:
+    m = FIELD_RE[name].search(line)
+    return m.group(1).decode() if m else None
+
+
+def log_files(path: Path) -> list:
+    """Ротированные файлы от старых к новым, текущий - последним"""
+    files = []
+    idx = 1
+    while path.with_name(path.name + f".{idx}").exists():
+        files.append(path.with_name(path.name + f".{idx}"))
+        idx += 1
+    files.reverse()
+    if path.exists():
+        files.append(path)
+    return files
+
+
+def split_points(path: Path, start: int, jobs: int, live: bool = False) -> list:
+    """Границы сегментов: конец строки chain_checkpoint, не чаще чем раз в size/jobs байт.
+
+    В файл, куда еще пишет шлюз (live), последняя строка могла попасть не
+    целиком, поэтому проверка заканчивается на последнем переводе строки.
+    """
+    size = path.stat().st_size
+    if size <= start:
+        return [start, start]
+    bounds = [start]
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if live:
+            size = mm.rfind(b"\n", start, size) + 1 or start
+            if size <= start:
+                return [start, start]
+        target = max(MIN_SEGMENT_BYTES, (size - start) // max(1, jobs * 4))
+        pos = start
+        while True:
+            pos = mm.find(CHECKPOINT_MARKER, pos)
+            if pos == -1:
+                break
+            nl = mm.find(b"\n", pos)
+            if nl == -1:
+                break
+            pos = nl + 1
+            if pos - bounds[-1] >= target and pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return bounds
+
+
+def verify_segment(path: str, start: int, end: int, key: str | None) -> dict:
+    """Проверка сегмента [start, end) независимо от остальных.
+
+    Возвращает prev_hash первой записи цепочки, хэш последней, смещение,
+    до которого сегмент проверен целиком (без незакрытой пачки merkle), и
+    anchored - первая запись цепочки является контрольной точкой с верной подписью.
+    """
+    result = {"ok": True, "error": None, "first_prev": None, "last_hash": None, "anchored": False,
+              "entries": 0, "checkpoints": 0, "signed": 0, "pending": 0, "safe_end": start}
+    if end <= start:
+        return result
+
+    prev_hash = None
+    pending: list = []  # листья записей, ожидающих запись merkle_batch
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = start
+        while pos < end:
+            nl = mm.find(b"\n", pos, end)
+            line_end = end if nl == -1 else nl
+            offset = pos
+            line = mm[pos:line_end].rstrip(b"\r")
+            pos = line_end + 1
+            if not line.strip():
+                continue
+
+            def fail(msg: str) -> dict:
+                # номер строки считается только для отчета об ошибке
+                lineno = mm[:offset].count(b"\n") + 1
+                result.update(ok=False, error=f"{path}:{lineno} (@ {offset}): {msg}")
+                return result
+
+            entry_hash = field(line, "entry_hash")
+            if entry_hash is None:
+                # запись пачки: проверяется корнем дерева в следующей записи merkle_batch
+                pending.append(hashlib.sha256(line).digest())
+                continue
+
+            line_prev = field(line, "prev_hash")
+            if line_prev is None:
+                return fail("entry_hash without prev_hash")
+            first_record = prev_hash is None
+            if first_record:
+                result["first_prev"] = line_prev
+            elif line_prev != prev_hash:
+                return fail("prev_hash does not link to previous entry")
+            prev_hash = line_prev
 
-def compute_entry_hash(prev_hash: str, entry: dict) -> str:
-    entry_copy = dict(entry)
-    entry_copy.pop("prev_hash", None)
-    entry_copy.pop("entry_hash", None)
-    payload = json.dumps(entry_copy, sort_keys=True, ensure_ascii=False).encode()
-    return hashlib.sha256(prev_hash.encode() + payload).hexdigest()
+            if BATCH_MARKER in line:
+                try:
+                    count = json.loads(line).get("count")
+                except json.JSONDecodeError as e:
+                    return fail(f"bad json: {e}")
+                if count != len(pending) or merkle_root(pending).hex() != field(line, "merkle_root"):
+                    return fail(f"merkle root mismatch for batch of {len(pending)} entries")
+                result["entries"] += len(pending)
+                pending = []
+            elif CHECKPOINT_MARKER in line:
+                if pending:
+                    return fail(f"checkpoint inside unfinished batch ({len(pending)} entries)")
+                result["checkpoints"] += 1
+                if key:
+                    sig = field(line, "sig")
+                    expected = hmac.new(key.encode(), prev_hash.encode(), hashlib.sha256).hexdigest()
+                    if sig is None or not hmac.compare_digest(sig, expected):
+                        return fail("checkpoint signature mismatch")
+                    result["signed"] += 1
+                    result["anchored"] = result["anchored"] or first_record
+            else:
+                result["entries"] += 1
 
+            payload = HASH_FIELDS_RE.sub(b"", line)
+            expected = hashlib.sha256(prev_hash.encode() + payload).hexdigest()
+            if entry_hash != expected:
+                return fail("hash mismatch")
 
-def verify(path: Path) -> bool:
-    if not path.exists():
+            prev_hash = entry_hash
+            if not pending:
+                result["safe_end"] = pos if nl != -1 else end
+
+    result["last_hash"] = prev_hash
+    result["pending"] = len(pending)
+    return result
+
+
+def state_path(path: Path) -> Path:
+    return path.with_name(path.name + ".verified.json")
+
+
+def load_state(path: Path) -> dict | None:
+    try:
+        return json.loads(state_path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(path: Path, file: Path, offset: int, prev_hash: str) -> None:
+    tmp = state_path(path).with_suffix(".tmp")
+    tmp.write_text(json.dumps({"inode": file.stat().st_ino, "offset": offset, "prev_hash": prev_hash}), encoding="utf-8")
+    os.replace(tmp, state_path(path))
+
+
+def plan(path: Path, incremental: bool) -> tuple:
+    """Файлы со стартовыми смещениями и ожидаемый prev_hash первой записи (None - любой)"""
+    files = log_files(path)
+    state = load_state(path) if incremental else None
+    if state and not all(isinstance(state.get(name), t) for name, t in (("inode", int), ("offset", int), ("prev_hash", str))):
+        print(f"{state_path(path)} is incomplete, verifying from scratch")
+        state = None
+    if state:
+        for idx, file in enumerate(files):
+            if file.stat().st_ino != state["inode"]:
+                continue
+            if file.stat().st_size < state["offset"]:
+                print(f"{file} is shorter than last verified offset, verifying from scratch")
+                break
+            starts = [(file, state["offset"])] + [(f, 0) for f in files[idx + 1:]]
+            return starts, state["prev_hash"]
+        else:
+            print("last verified file is no longer present, verifying from scratch")
+    return [(f, 0) for f in files], None
+
+
+def verify(path: Path, jobs: int = 1, key: str | None = None, incremental: bool = False) -> bool:
+    starts, expected_prev = plan(path, incremental)
+    if not starts:
         print(f"file not found: {path}")
         return False
-    
-    prev_hash = "0" * 64
+
+    tasks = []
+    for file, start in starts:
+        bounds = split_points(file, start, jobs, live=file == path)
+        tasks.extend((str(file), a, b, key) for a, b in zip(bounds, bounds[1:]))
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(verify_segment, *zip(*tasks)))
+    else:
+        results = [verify_segment(*task) for task in tasks]
+
     ok = True
-    line_count = 0
-    
-    with path.open("r", encoding="utf-8") as f:
-        for line_no, line in enumerate(f, start=1):
-            line = line.strip()
-            if not line:
-                continue
-            
-            try:
-                entry = json.loads(line)
-            except json.JSONDecodeError as e:
-                print(f"line {line_no}: bad json: {e}")
-                ok = False
-                break
-            
-            expected = compute_entry_hash(prev_hash, entry)
-            actual = entry.get("entry_hash", "")
-            
-            if actual != expected:
-                print(f"line {line_no}: hash mismatch")
+    prev_hash = expected_prev
+    anchored = expected_prev is not None
+    entries = checkpoints = signed = 0
+    last_file, last_offset = None, None
+    for task, res in zip(tasks, results):
+        if not res["ok"]:
+            print(res["error"])
+            ok = False
+            break
+        if res["first_prev"] is not None:
+            if not anchored:
+                # более старого файла нет: начало цепочки подтверждают только GENESIS или подпись,
+                # иначе срезанные первые записи были бы неотличимы от удаленного ротацией файла
+                if res["first_prev"] != GENESIS:
+                    if not res["anchored"]:
+                        print(f"{task[0]}: chain starts from {res['first_prev'][:16]}... "
+                              "without a signed chain_checkpoint" + ("" if key else " (pass --key)"))
+                        ok = False
+                        break
+                    print(f"chain continues from signed checkpoint {res['first_prev'][:16]}... (rotated file)")
+                anchored = True
+            elif res["first_prev"] != prev_hash:
+                print(f"{task[0]} @ {task[1]}: segment does not link to previous entry")
                 ok = False
                 break
-            
-            prev_hash = actual
-            line_count += 1
-    
+            prev_hash = res["last_hash"]
+        if res["pending"] and task is not tasks[-1]:
+            print(f"{task[0]} @ {task[1]}: {res['pending']} entries without merkle_batch record")
+            ok = False
+            break
+        entries += res["entries"]
+        checkpoints += res["checkpoints"]
+        signed += res["signed"]
+        last_file, last_offset = Path(task[0]), res["safe_end"]
+
+    if ok and results and results[-1]["pending"]:
+        if tasks[-1][0] == str(path):
+            # шлюз дописывает пачку прямо сейчас: хвост проверит следующий запуск
+            print(f"{results[-1]['pending']} trailing entries of an unfinished batch not verified yet")
+        else:
+            print(f"{results[-1]['pending']} trailing entries without merkle_batch record (unfinished batch)")
+            ok = False
+
     if ok:
-        if line_count == 0:
-            print("empty file")
+        if entries == 0 and not checkpoints:
+            print("no new entries" if incremental and expected_prev else "empty file")
         else:
-            print(f"chain ok ({line_count} entries)")
-    
+            print(f"chain ok ({entries} entries, {checkpoints} checkpoints, {len(tasks)} segments)")
+        if key:
+            print(f"{signed} signed checkpoints verified")
+        if incremental and last_file is not None and prev_hash is not None:
+            save_state(path, last_file, last_offset, prev_hash)
+
     return ok
 
 
 def main() -> None:
-    if len(sys.argv) < 2:
-        print("usage: python verify_log_chain.py <path>")
-        sys.exit(1)
-    
-    path = Path(sys.argv[1])
-    success = verify(path)
+    parser = argparse.ArgumentParser(description="Проверка цепочки хэшей журнала WAF")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="процессов для сегментов")
+    parser.add_argument("--key", default=os.environ.get("LOG_CHECKPOINT_KEY"), help="ключ HMAC контрольных точек")
+    parser.add_argument("--incremental", action="store_true", help="продолжить с последнего проверенного смещения")
+    args = parser.parse_args()
+
+    success = verify(args.path, jobs=args.jobs, key=args.key or None, incremental=args.incremental)
     sys.exit(0 if success else 1)
 
 
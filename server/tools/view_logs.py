@@ -1,6 +1,22 @@
 #!/usr/bin/env python3
+"""
+Просмотр журнала WAF без чтения всего файла.
+
+Файлы (текущий, затем .1..N) читаются с конца блоками, и выборка
+останавливается, как только набрано -n записей или встречена запись старше
+--since. Фильтры сначала проверяются по байтам строки, а json.loads
+вызывается только для подходящих строк.
+
+--build-index пишет рядом с каждым файлом <file>.idx: для каждого блока из
+INDEX_BLOCK записей хранятся смещения, диапазон времени, наборы decision и
+category, а также bloom-фильтр client_ip. После этого запросы читают только
+те блоки, которые могут содержать подходящие записи.
+"""
+import argparse
+import hashlib
 import json
-import sys
+import os
+import time
 from pathlib import Path
 
 COLORS = {
@@ -12,6 +28,11 @@ COLORS = {
     "dim": "\033[2m",
 }
 
+READ_BLOCK = 256 * 1024
+INDEX_BLOCK = 4096
+BLOOM_BITS = 10 * INDEX_BLOCK  # ~10 бит на адрес: около 1% ложных срабатываний
+SERVICE_TYPES = (b'"type":"merkle_batch"', b'"type":"chain_checkpoint"')
+
 def c(text: str, color: str) -> str:
     return f"{COLORS.get(color, '')}{text}{COLORS['reset']}"
 
@@ -25,15 +46,15 @@ def fmt(e: dict) -> str:
     score = e.get("regex_score", 0)
     status = e.get("status_code", 0)
     ms = e.get("latency_ms", 0)
-    
+
     hits = e.get("regex_hits", [])
     cats = ",".join(set(h.get("category", "") for h in hits)) or "-"
-    
+
     dec_c = dec if dec in COLORS else "reset"
     dec_s = c(f"[{dec.upper():^6}]", dec_c)
-    
+
     l1 = f"{c(ts,'dim')} {dec_s} {ip:>15} {method:>4} {path}"
-    
+
     parts = []
     if query:
         parts.append(f"q={query}")
@@ -43,50 +64,226 @@ def fmt(e: dict) -> str:
         parts.append(f"cat={cats}")
     parts.append(f"s={status}")
     parts.append(f"{ms}ms")
-    
+
     l2 = "  " + " | ".join(parts)
     return f"{l1}\n{l2}"
 
+def log_files(path: Path) -> list:
+    """Текущий файл и ротированные, от новых к старым"""
+    files = [path] if path.exists() else []
+    idx = 1
+    while path.with_name(path.name + f".{idx}").exists():
+        files.append(path.with_name(path.name + f".{idx}"))
+        idx += 1
+    return files
+
+def parse_since(value: str) -> str:
+    """15m / 2h / 1d или префикс ISO-времени -> строка, сравнимая с timestamp_utc"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value[:-1].isdigit() and value[-1] in units:
+        ts = time.time() - int(value[:-1]) * units[value[-1]]
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts))
+    return value.replace(" ", "T")
+
+def reverse_lines(path: Path, start: int = 0, end: int | None = None):
+    """Строки диапазона [start, end) файла от последней к первой"""
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END) if end is None else end
+        rest = b""
+        while pos > start:
+            size = min(READ_BLOCK, pos - start)
+            pos -= size
+            f.seek(pos)
+            chunk = f.read(size) + rest
+            lines = chunk.split(b"\n")
+            rest = lines[0]
+            for line in reversed(lines[1:]):
+                if line.strip():
+                    yield line
+        if rest.strip():
+            yield rest
+
+class Query:
+    def __init__(self, args) -> None:
+        self.since = parse_since(args.since) if args.since else None
+        self.decision = "block" if args.blocks else args.decision
+        self.ip = args.ip
+        # категории в правилах в верхнем регистре (SQLI, XSS); сравниваем без учета регистра
+        self.category = args.category.upper() if args.category else None
+        # байтовые признаки: orjson пишет компактно, поэтому поле ищется как подстрока
+        self.needles = []
+        if self.decision:
+            self.needles.append(f'"decision":"{self.decision}"'.encode())
+        if self.ip:
+            self.needles.append(f'"client_ip":"{self.ip}"'.encode())
+        # категория проверяется по line.upper(), поэтому ее признак целиком в верхнем регистре
+        self.category_needle = f'"CATEGORY":"{self.category}"'.encode() if self.category else None
+
+    def match(self, line: bytes):
+        """(запись или None, True если дальше в прошлое идти не нужно)"""
+        for needle in self.needles:
+            if needle not in line:
+                return None, self.since is not None and self._older(line)
+        if self.category_needle and self.category_needle not in line.upper():
+            return None, self.since is not None and self._older(line)
+        if any(t in line for t in SERVICE_TYPES):
+            return None, False
+        try:
+            e = json.loads(line)
+        except ValueError:
+            return None, False
+        if self.since and e.get("timestamp_utc", "") < self.since:
+            return None, True
+        if self.decision and e.get("decision") != self.decision:
+            return None, False
+        if self.ip and e.get("client_ip") != self.ip:
+            return None, False
+        if self.category and not any(str(h.get("category") or "").upper() == self.category for h in e.get("regex_hits") or []):
+            return None, False
+        return e, False
+
+    def _older(self, line: bytes) -> bool:
+        pos = line.find(b'"timestamp_utc":"')
+        if pos == -1:
+            return False
+        return line[pos + 17:pos + 37].decode(errors="replace") < self.since
+
+    def block_may_match(self, block: dict) -> bool:
+        if self.since and block["ts_max"] < self.since:
+            return False
+        if self.decision and self.decision not in block["decisions"]:
+            return False
+        if self.category and not any(str(c or "").upper() == self.category for c in block["categories"]):
+            return False
+        if self.ip and not bloom_has(int(block["ips"], 16), self.ip):
+            return False
+        return True
+
+def bloom_positions(value: str) -> list:
+    digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+    return [int.from_bytes(digest[i:i + 4], "big") % BLOOM_BITS for i in (0, 4, 8, 12)]
+
+def bloom_has(bloom: int, value: str) -> bool:
+    return all(bloom >> p & 1 for p in bloom_positions(value))
+
+def index_path(path: Path) -> Path:
+    return path.with_name(path.name + ".idx")
+
+def load_index(path: Path) -> list | None:
+    """Блоки индекса, если он построен для этого же файла (inode совпадает)"""
+    try:
+        with open(index_path(path)) as f:
+            header = json.loads(f.readline())
+            if header.get("inode") != path.stat().st_ino:
+                return None
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return None
+
+def build_index(path: Path) -> int:
+    """Дописывает индекс до конца файла; возвращает число новых блоков"""
+    blocks = load_index(path)
+    mode = "a"
+    if blocks is None:
+        blocks, mode = [], "w"
+    pos = blocks[-1]["end"] if blocks else 0
+    added = 0
+    with open(path, "rb") as f, open(index_path(path), mode) as out:
+        if mode == "w":
+            out.write(json.dumps({"inode": path.stat().st_ino}) + "\n")
+        f.seek(pos)
+        while True:
+            block = {"start": pos, "end": pos, "ts_min": "~", "ts_max": "", "decisions": set(), "categories": set()}
+            bloom = 0
+            count = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # недописанная строка попадет в следующий проход
+                pos += len(line)
+                block["end"] = pos
+                if any(t in line for t in SERVICE_TYPES) or not line.strip():
+                    continue
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue
+                ts = e.get("timestamp_utc", "")
+                block["ts_min"] = min(block["ts_min"], ts)
+                block["ts_max"] = max(block["ts_max"], ts)
+                block["decisions"].add(e.get("decision"))
+                block["categories"].update(h.get("category") for h in e.get("regex_hits") or [])
+                for p in bloom_positions(str(e.get("client_ip"))):
+                    bloom |= 1 << p
+                count += 1
+                if count >= INDEX_BLOCK:
+                    break
+            if count < INDEX_BLOCK:
+                # хвост не индексируется: запросы дочитывают его напрямую
+                return added
+            block.update(decisions=sorted(block["decisions"], key=str), categories=sorted(block["categories"], key=str),
+                         ips=format(bloom, "x"), count=count)
+            out.write(json.dumps(block) + "\n")
+            added += 1
+
+def ranges(path: Path, q: Query):
+    """Диапазоны байт файла для чтения, от новых к старым"""
+    blocks = load_index(path)
+    if blocks is None:
+        yield 0, None
+        return
+    indexed_end = blocks[-1]["end"] if blocks else 0
+    yield indexed_end, None
+    for block in reversed(blocks):
+        if q.since and block["ts_max"] < q.since:
+            return
+        if q.block_may_match(block):
+            yield block["start"], block["end"]
+
+def query(path: Path, q: Query, limit: int) -> list:
+    found = []
+    for file in log_files(path):
+        for start, end in ranges(file, q):
+            for line in reverse_lines(file, start, end):
+                e, stop = q.match(line)
+                if stop:
+                    return found[::-1]
+                if e is not None:
+                    found.append(e)
+                    if len(found) >= limit:
+                        return found[::-1]
+    return found[::-1]
+
 def main():
-    log_path = Path("data/logs/waf_events.jsonl")
-    only_blocks = "--blocks" in sys.argv or "-b" in sys.argv
-    limit = 100
-    
-    for arg in sys.argv[1:]:
-        if arg.startswith("-n"):
-            try:
-                limit = int(arg[2:])
-            except:
-                pass
-        elif not arg.startswith("-"):
-            log_path = Path(arg)
-    
+    parser = argparse.ArgumentParser(description="Просмотр журнала WAF")
+    parser.add_argument("path", nargs="?", type=Path, default=Path("data/logs/waf_events.jsonl"))
+    parser.add_argument("-n", type=int, default=100, dest="limit", help="сколько последних записей показать")
+    parser.add_argument("-b", "--blocks", action="store_true", help="только блокировки")
+    parser.add_argument("--decision", help="allow | block | rate_limit")
+    parser.add_argument("--ip", help="client_ip")
+    parser.add_argument("--category", help="категория срабатывания regex, без учета регистра (sqli, xss, ...)")
+    parser.add_argument("--since", help="15m / 2h / 1d или 2024-05-01T12:00")
+    parser.add_argument("--build-index", action="store_true", help="построить/дописать индекс <file>.idx")
+    args = parser.parse_args()
+    log_path = args.path
+
     if not log_path.exists():
         print(f"Not found: {log_path}")
         return
-    
-    entries = []
-    with open(log_path) as f:
-        for line in f:
-            if not line.strip():
-                continue
-            try:
-                e = json.loads(line)
-                if only_blocks and e.get("decision") != "block":
-                    continue
-                entries.append(e)
-            except:
-                pass
-    
-    total = len(entries)
+
+    if args.build_index:
+        for file in log_files(log_path):
+            print(f"{file}: +{build_index(file)} index blocks")
+        return
+
+    entries = query(log_path, Query(args), args.limit)
     blocks = sum(1 for e in entries if e.get("decision") == "block")
-    
-    for e in entries[-limit:]:
+
+    for e in entries:
         print(fmt(e))
         print()
-    
+
     print(c("=" * 50, "dim"))
-    print(f"Showing {min(limit, len(entries))}/{total} | {c(str(blocks), 'block')} blocks")
+    print(f"Showing {len(entries)} | {c(str(blocks), 'block')} blocks")
 
 if __name__ == "__main__":
     main()